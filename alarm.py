@@ -0,0 +1,117 @@
+import threading
+import time
+from collections import deque
+
+
+class Alarm:
+    # Loops the alarm sound while any stream is alerting. load() decodes
+    # alarm.wav into memory once and reserves a mixer channel for it, with
+    # a small mixer buffer so the first samples go out quickly. pygame is
+    # imported there, so load() can run on a background thread in parallel
+    # with camera and model start-up. An alert raised while the sound is
+    # still loading starts it as soon as load() finishes. play() and stop()
+    # are idempotent: repeated calls while already playing or stopped never
+    # reach the mixer.
+
+    def __init__(self, path="alarm.wav", buffer_size=512, frequency=44100):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.frequency = frequency
+        self.sound = None
+        self.channel = None
+        self.loaded = False
+        self.playing = False
+        self.pending = None  # perf_counter() of an alert raised before the sound was loaded
+        self.ready = threading.Event()
+        self.ready_at = None
+        self.buffer_latency = None  # seconds of audio per mixer buffer
+        self.latencies = deque(maxlen=1000)  # alert decision -> sound handed to the mixer
+        self.latency_histogram = None
+        self.alerting_streams = set()
+        self.lock = threading.RLock()
+
+    def register_metrics(self, registry):
+        self.latency_histogram = registry.histogram(
+            'dms_alarm_start_seconds', 'Time from the alert decision to the alarm being submitted to the mixer')
+
+    def load(self):
+        try:
+            import pygame
+            pygame.mixer.pre_init(self.frequency, -16, 2, self.buffer_size)
+            pygame.mixer.init()
+            self.sound = pygame.mixer.Sound(self.path)  # decoded once, kept in memory
+            pygame.mixer.set_reserved(1)
+            self.channel = pygame.mixer.Channel(0)
+            self.buffer_latency = self.buffer_size / pygame.mixer.get_init()[0]
+            self.loaded = True
+        except Exception as e:
+            print("Could not load alarm sound, using system beep:", e)
+        self.ready_at = time.monotonic()
+        self.ready.set()
+        with self.lock:
+            pending, self.pending = self.pending, None
+            if pending is not None and self.loaded:
+                self.play(pending)
+
+    def start_loading(self):
+        thread = threading.Thread(target=self.load, daemon=True)
+        thread.start()
+        return thread
+
+    def play(self, started=None):
+        # started is time.perf_counter() when the alert was decided
+        started = time.perf_counter() if started is None else started
+        with self.lock:
+            if self.playing:
+                return
+            if not self.loaded:
+                if not self.ready.is_set() and self.pending is None:
+                    self.pending = started
+                return
+            try:
+                self.channel.play(self.sound, loops=-1)  # Loop indefinitely
+            except Exception:
+                print("Error playing alarm sound")
+                return
+            self.playing = True
+        latency = time.perf_counter() - started
+        self.latencies.append(latency)
+        if self.latency_histogram is not None:
+            self.latency_histogram.observe(latency)
+
+    def stop(self):
+        with self.lock:
+            self.pending = None
+            if not self.playing:
+                return
+            try:
+                self.channel.stop()
+            except Exception:
+                print("Error stopping alarm sound")
+            self.playing = False
+
+    # on_alert / on_clear callbacks for DetectionStream
+    def stream_alert(self, stream):
+        started = time.perf_counter()
+        with self.lock:
+            self.alerting_streams.add(stream.id)
+            self.play(started)
+
+    def stream_clear(self, stream):
+        with self.lock:
+            self.alerting_streams.discard(stream.id)
+            if not self.alerting_streams:
+                self.stop()
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+        stats = {
+            'loaded': self.loaded,
+            'playing': self.playing,
+            'buffer_latency_ms': None if self.buffer_latency is None else round(self.buffer_latency * 1000, 2),
+            'starts': len(latencies)
+        }
+        if latencies:
+            stats['start_p50_ms'] = round(latencies[len(latencies) // 2] * 1000, 3)
+            stats['start_max_ms'] = round(latencies[-1] * 1000, 3)
+        return stats
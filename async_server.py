@@ -0,0 +1,297 @@
+import asyncio
+import io
+import json
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from frame_broadcaster import MJPEG_BOUNDARY
+
+# Long-lived and status routes answered on the event loop itself
+NATIVE_ROUTE = re.compile(r'^/(video_feed|api/stream|api/status)(?:/(\d+))?$')
+
+
+class StreamFeed:
+    # Wakes the event loop's viewers of one stream when the broadcaster
+    # (or the status event stream) has something new. The encoder thread
+    # only schedules a callback, and only while async viewers are connected.
+
+    def __init__(self, loop, source):
+        self.loop = loop
+        self.viewers = 0
+        self.changed = asyncio.Event()
+        source.add_waker(self.wake)
+
+    def wake(self):
+        if self.viewers:
+            try:
+                self.loop.call_soon_threadsafe(self._set)
+            except RuntimeError:
+                pass  # the loop has been closed
+
+    def _set(self):
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+    async def wait(self, timeout):
+        try:
+            await asyncio.wait_for(self.changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+class AsyncStreamServer:
+    # Serves /video_feed, /api/stream and /api/status for every stream from
+    # one asyncio event loop, so hundreds of viewers cost a coroutine and a
+    # socket each instead of a thread. Every other route goes to the Flask
+    # app on a small thread pool.
+    #
+    # Backpressure: each viewer always gets the newest frame. Video
+    # connections have no write buffer of their own (high-water mark 0), so
+    # drain() parks a slow client's coroutine until its previous frame is
+    # all in the socket, and the frames published meanwhile are skipped for
+    # it instead of queueing up stale; a client that stays stuck for
+    # send_timeout seconds is disconnected. ?fps=N caps the rate of one
+    # viewer's video feed.
+
+    def __init__(self, app, streams, host='0.0.0.0', port=5000, wsgi_workers=8,
+                 write_buffer=256 * 1024, send_timeout=10.0, max_fps=30):
+        self.app = app
+        self.streams = streams
+        self.host = host
+        self.port = port
+        self.executor = ThreadPoolExecutor(wsgi_workers, thread_name_prefix='wsgi')
+        self.write_buffer = write_buffer
+        self.send_timeout = send_timeout
+        self.max_fps = max_fps
+        self.loop = None
+        self.frame_feeds = {}
+        self.event_feeds = {}
+        self.connections = 0
+        self.video_clients = 0
+        self.event_clients = 0
+        self.frames_sent = 0
+        self.frames_skipped = 0
+        self.slow_disconnects = 0
+        self.wsgi_requests = 0
+
+    def run(self):
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        for stream_id, stream in self.streams.items():
+            self.frame_feeds[stream_id] = StreamFeed(self.loop, stream.broadcaster)
+            self.event_feeds[stream_id] = StreamFeed(self.loop, stream.status_events)
+        server = await asyncio.start_server(self.handle, self.host, self.port, backlog=1024)
+        print(f"Async server listening on http://{self.host}:{self.port}")
+        async with server:
+            await server.serve_forever()
+
+    async def handle(self, reader, writer):
+        writer.transport.set_write_buffer_limits(high=self.write_buffer)
+        self.connections += 1
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                    break
+                try:
+                    method, target, version, headers = self.parse_head(head)
+                    length = int(headers.get('content-length', 0))
+                except ValueError:
+                    await self.send_simple(writer, 400, False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+                keep_alive = (version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close')
+
+                url = urlsplit(target)
+                match = NATIVE_ROUTE.match(url.path)
+                if match and method == 'GET':
+                    stream = self.streams.get(int(match.group(2) or 0))
+                    if stream is None:
+                        await self.send_simple(writer, 404, keep_alive)
+                    elif match.group(1) == 'video_feed':
+                        await self.video_feed(writer, stream, parse_qs(url.query))
+                        break
+                    elif match.group(1) == 'api/stream':
+                        await self.event_stream(writer, stream)
+                        break
+                    else:
+                        await self.status(writer, stream, keep_alive)
+                else:
+                    await self.wsgi(writer, method, url, version, headers, body, keep_alive)
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    def parse_head(self, head):
+        lines = head.decode('latin-1').split('\r\n')
+        method, target, version = lines[0].split(' ')
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+        return method, target, version, headers
+
+    async def send(self, writer, data):
+        writer.write(data)
+        await asyncio.wait_for(writer.drain(), self.send_timeout)
+
+    async def send_response(self, writer, status, headers, body, keep_alive):
+        lines = [f'HTTP/1.1 {status} {HTTPStatus(status).phrase}']
+        lines += [f'{name}: {value}' for name, value in headers]
+        lines.append(f'Content-Length: {len(body)}')
+        lines.append('Connection: keep-alive' if keep_alive else 'Connection: close')
+        await self.send(writer, ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+
+    async def send_simple(self, writer, status, keep_alive):
+        await self.send_response(writer, status, [('Content-Type', 'text/plain')],
+                                 HTTPStatus(status).phrase.encode(), keep_alive)
+
+    async def status(self, writer, stream, keep_alive):
+        snapshot = stream.snapshot
+        status = snapshot.status_dict()
+        status['ear'] = snapshot.ear
+        await self.send_response(writer, 200, [('Content-Type', 'application/json')],
+                                 json.dumps(status).encode(), keep_alive)
+
+    async def video_feed(self, writer, stream, query):
+        try:
+            fps = float(query.get('fps', [0])[0])
+        except ValueError:
+            fps = 0
+        fps = min(fps, self.max_fps) if fps > 0 else self.max_fps
+        interval = 1.0 / fps if fps else 0.0
+        # drain() returns only once the previous frame has left the buffer
+        writer.transport.set_write_buffer_limits(high=0)
+        await self.send(writer, b'HTTP/1.1 200 OK\r\nContent-Type: multipart/x-mixed-replace; boundary='
+                        + MJPEG_BOUNDARY + b'\r\nCache-Control: no-cache\r\nConnection: close\r\n\r\n')
+
+        broadcaster = stream.broadcaster
+        feed = self.frame_feeds[stream.id]
+        feed.viewers += 1
+        self.video_clients += 1
+        broadcaster.join()
+        try:
+            seq = 0
+            next_send = 0.0
+            while broadcaster.running:
+                delay = next_send - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                new_seq, part = broadcaster.latest_part()
+                if new_seq == seq or part is None:
+                    await feed.wait(1.0)
+                    continue
+                if seq:
+                    self.frames_skipped += max(0, new_seq - seq - 1)
+                seq = new_seq
+                next_send = time.monotonic() + interval
+                try:
+                    await self.send(writer, part)
+                except asyncio.TimeoutError:
+                    self.slow_disconnects += 1
+                    raise
+                self.frames_sent += 1
+        finally:
+            broadcaster.leave()
+            self.video_clients -= 1
+            feed.viewers -= 1
+
+    async def event_stream(self, writer, stream):
+        await self.send(writer, b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n'
+                        b'Cache-Control: no-cache\r\nX-Accel-Buffering: no\r\nConnection: close\r\n\r\n'
+                        b'retry: 1000\n\n')
+        events = stream.status_events
+        feed = self.event_feeds[stream.id]
+        feed.viewers += 1
+        self.event_clients += 1
+        events.join()
+        try:
+            seen = 0
+            while events.running:
+                seen, data = events.pending(seen)
+                if data is None:
+                    waited = time.monotonic()
+                    await feed.wait(events.keepalive)
+                    if time.monotonic() - waited >= events.keepalive:
+                        await self.send(writer, b": keepalive\n\n")
+                    continue
+                await self.send(writer, data)
+        finally:
+            events.leave()
+            self.event_clients -= 1
+            feed.viewers -= 1
+
+    async def wsgi(self, writer, method, url, version, headers, body, keep_alive):
+        self.wsgi_requests += 1
+        environ = {
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': unquote(url.path, 'latin-1'),
+            'QUERY_STRING': url.query,
+            'SERVER_NAME': self.host,
+            'SERVER_PORT': str(self.port),
+            'SERVER_PROTOCOL': version,
+            'REMOTE_ADDR': (writer.get_extra_info('peername') or ('', 0))[0],
+            'CONTENT_TYPE': headers.get('content-type', ''),
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False
+        }
+        for name, value in headers.items():
+            key = 'HTTP_' + name.upper().replace('-', '_')
+            if key not in ('HTTP_CONTENT_TYPE', 'HTTP_CONTENT_LENGTH'):
+                environ[key] = value
+        status, response_headers, response_body = await self.loop.run_in_executor(
+            self.executor, self.call_app, environ)
+        if method == 'HEAD':
+            response_body = b''
+        response_headers = [(name, value) for name, value in response_headers
+                            if name.lower() not in ('content-length', 'connection')]
+        await self.send_response(writer, status, response_headers, response_body, keep_alive)
+
+    def call_app(self, environ):
+        # Runs on the thread pool; only finite responses are expected here
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            started[:] = [int(status.split(' ', 1)[0]), headers]
+
+        try:
+            result = self.app(environ, start_response)
+            try:
+                body = b''.join(result)
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+        except Exception as e:
+            print("Error handling", environ['PATH_INFO'], e)
+            return 500, [('Content-Type', 'text/plain')], b'Internal Server Error'
+        return started[0], started[1], body
+
+    def stats(self):
+        return {
+            'mode': 'async',
+            'connections': self.connections,
+            'video_clients': self.video_clients,
+            'event_clients': self.event_clients,
+            'frames_sent': self.frames_sent,
+            'frames_skipped': self.frames_skipped,
+            'slow_disconnects': self.slow_disconnects,
+            'wsgi_requests': self.wsgi_requests
+        }
@@ -0,0 +1,229 @@
+import argparse
+import json
+import os
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+import numpy as np
+
+from detection_engine import EAR_THRESHOLD, STATUS_DROWSY, DrowsinessStateMachine, create_face_mesh, landmarks_ear
+from face_roi import FaceROITracker
+from inference_scheduler import AdaptiveInferenceScheduler
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.m4v', '.webm')
+
+# Event codes stored in the output file
+EVENT_CODES = {'drowsy': 1, 'face_missing': 2, 'clear': 0}
+
+# Options shared by every video, set once per process by the pool initializer
+worker_options = None
+
+
+def init_worker(options):
+    global worker_options
+    cv2.setNumThreads(1)  # one core per worker process
+    worker_options = options
+
+
+def analyze_video(path, output_path):
+    # Runs the live drowsiness state machine over every frame of one video
+    # and writes per-frame columns plus alert events to output_path. Each
+    # video gets its own FaceMesh, so no tracking state carries over from
+    # the previous one.
+    options = worker_options
+    face_mesh = create_face_mesh()
+    try:
+        return _analyze(path, output_path, face_mesh, options)
+    finally:
+        face_mesh.close()
+
+
+def _analyze(path, output_path, face_mesh, options):
+    tracker = FaceROITracker(face_mesh, inference_size=options['inference_size'])
+    scheduler = AdaptiveInferenceScheduler(EAR_THRESHOLD) if options['adaptive'] else None
+    state = DrowsinessStateMachine()
+
+    cap = cv2.VideoCapture(path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+
+    timestamps = array('d')
+    left_ears = array('f')
+    right_ears = array('f')
+    ears = array('f')
+    face_present = array('B')
+    alert_active = array('B')
+    event_frames = array('i')
+    event_codes = array('b')
+
+    # Per-frame EAR values for frames whose state update is still pending
+    # (adaptive mode replays skipped frames once the next inference lands)
+    pending = []
+
+    def advance(sample):
+        frame_index = len(alert_active)
+        if state.update(sample[3], sample[0]):
+            if state.alert_active:
+                code = EVENT_CODES['drowsy'] if state.status == STATUS_DROWSY else EVENT_CODES['face_missing']
+            else:
+                code = EVENT_CODES['clear']
+            event_frames.append(frame_index)
+            event_codes.append(code)
+        timestamps.append(sample[0])
+        left_ears.append(sample[1])
+        right_ears.append(sample[2])
+        ears.append(np.nan if sample[3] is None else sample[3])
+        face_present.append(sample[3] is not None)
+        alert_active.append(state.alert_active)
+
+    started = time.perf_counter()
+    frame_index = 0
+    inferred = 0
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        timestamp = frame_index / fps
+        frame_index += 1
+
+        if scheduler is not None and not scheduler.should_infer(frame):
+            pending.append(timestamp)
+            continue
+
+        if not options['roi_tracking']:
+            tracker.reset()
+        landmarks = tracker.process(frame)
+        inferred += 1
+        left_ear = right_ear = np.nan
+        avg_ear = None
+        if landmarks is not None:
+            left_ear, right_ear, avg_ear = landmarks_ear(landmarks, frame.shape[1] / frame.shape[0])
+
+        if scheduler is not None:
+            samples = scheduler.update(avg_ear, landmarks)
+            for skipped_time, skipped_ear in zip(pending, samples[:-1]):
+                advance((skipped_time, np.nan, np.nan, skipped_ear))
+            pending = []
+        advance((timestamp, left_ear, right_ear, avg_ear))
+
+    # Frames skipped at the very end keep the last inferred EAR
+    for skipped_time in pending:
+        advance((skipped_time, np.nan, np.nan, scheduler.last_ear))
+
+    cap.release()
+    elapsed = time.perf_counter() - started
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    np.savez_compressed(
+        output_path,
+        timestamp=np.frombuffer(timestamps, dtype=np.float64),
+        left_ear=np.frombuffer(left_ears, dtype=np.float32),
+        right_ear=np.frombuffer(right_ears, dtype=np.float32),
+        ear=np.frombuffer(ears, dtype=np.float32),
+        face_present=np.frombuffer(face_present, dtype=np.uint8).astype(bool),
+        alert_active=np.frombuffer(alert_active, dtype=np.uint8).astype(bool),
+        event_frame=np.frombuffer(event_frames, dtype=np.int32),
+        event_code=np.frombuffer(event_codes, dtype=np.int8),
+        fps=np.float64(fps)
+    )
+
+    codes = np.frombuffer(event_codes, dtype=np.int8)
+    frames = len(alert_active)
+    return {
+        'video': path,
+        'output': output_path,
+        'frames': frames,
+        'inferred_frames': inferred,
+        'video_fps': fps,
+        'processing_fps': round(frames / elapsed, 1) if elapsed > 0 else None,
+        'face_present_ratio': round(float(np.frombuffer(face_present, dtype=np.uint8).mean()), 4) if frames else None,
+        'drowsy_alerts': int((codes == EVENT_CODES['drowsy']).sum()),
+        'face_missing_alerts': int((codes == EVENT_CODES['face_missing']).sum()),
+        'first_alert_s': round(event_frames[0] / fps, 3) if len(event_frames) else None
+    }
+
+
+def find_videos(input_dir):
+    videos = []
+    for root, _, files in os.walk(input_dir):
+        for name in sorted(files):
+            if name.lower().endswith(VIDEO_EXTENSIONS):
+                videos.append(os.path.join(root, name))
+    return sorted(videos)
+
+
+def output_paths(videos, input_dir, output_dir):
+    # <output_dir>/<path relative to input_dir without extension>.npz, so
+    # the same file name in different subdirectories doesn't clash
+    paths = {}
+    for video in videos:
+        relative = os.path.splitext(os.path.relpath(video, input_dir))[0]
+        paths[video] = os.path.join(output_dir, relative + '.npz')
+    seen = {}
+    for video, path in paths.items():
+        if path in seen:
+            raise SystemExit(f"{seen[path]} and {video} would both be written to {path}; rename one of them")
+        seen[path] = video
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run drowsiness detection over recorded drive videos")
+    parser.add_argument('input_dir', help="directory searched recursively for video files")
+    parser.add_argument('-o', '--output-dir', default='analysis_output')
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count(),
+                        help="worker processes, one FaceMesh each (default: all cores)")
+    parser.add_argument('--inference-size', type=int, default=320,
+                        help="longest side of the image passed to FaceMesh (0 = native)")
+    parser.add_argument('--no-roi', action='store_true', help="always run full-frame detection")
+    parser.add_argument('--adaptive', action='store_true',
+                        help="use the adaptive inference scheduler like the live app")
+    args = parser.parse_args()
+
+    videos = find_videos(args.input_dir)
+    if not videos:
+        print("No videos found in", args.input_dir)
+        return
+    outputs = output_paths(videos, args.input_dir, args.output_dir)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    options = {
+        'inference_size': args.inference_size or None,
+        'roi_tracking': not args.no_roi,
+        'adaptive': args.adaptive
+    }
+
+    started = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker,
+                             initargs=(options,)) as pool:
+        futures = {pool.submit(analyze_video, path, outputs[path]): path for path in videos}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"{futures[future]}: failed ({e})")
+                continue
+            results.append(result)
+            print(f"{result['video']}: {result['frames']} frames at {result['processing_fps']} FPS, "
+                  f"{result['drowsy_alerts']} drowsy / {result['face_missing_alerts']} face-missing alerts")
+
+    elapsed = time.perf_counter() - started
+    total_frames = sum(r['frames'] for r in results)
+    summary = {
+        'videos': sorted(results, key=lambda r: r['video']),
+        'total_frames': total_frames,
+        'elapsed_s': round(elapsed, 2),
+        'aggregate_fps': round(total_frames / elapsed, 1) if elapsed > 0 else None,
+        'options': options,
+        'event_codes': EVENT_CODES
+    }
+    with open(os.path.join(args.output_dir, 'summary.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+    print(f"{len(results)} videos, {total_frames} frames in {elapsed:.1f} s "
+          f"({summary['aggregate_fps']} FPS aggregate)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,915 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import socket
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from detection_engine import (CLOSED_EYES_SECONDS, EAR_THRESHOLD, LEFT_EYE_INDICES, NO_FACE_SECONDS,
+                              RIGHT_EYE_INDICES, STATUS_MONITORING, DrowsinessStateMachine,
+                              create_face_mesh, eyes_ear, landmarks_ear)
+from overlay import draw_overlay
+from detection_stream import EMPTY_SNAPSHOT
+
+# Stages of drowsiness_detection() in pipeline order
+STAGES = ['acquire', 'bgr_to_rgb', 'face_mesh', 'landmarks', 'ear', 'overlay', 'copy', 'imencode']
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except Exception:
+        return 'unknown'
+
+
+def percentiles(samples_ns):
+    if not samples_ns:
+        return None
+    ms = np.asarray(samples_ns, dtype=np.float64) / 1e6
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {
+        'count': len(ms),
+        'mean_ms': round(float(ms.mean()), 4),
+        'p50_ms': round(float(p50), 4),
+        'p95_ms': round(float(p95), 4),
+        'p99_ms': round(float(p99), 4)
+    }
+
+
+def synthetic_frames(count=30, width=640, height=480, seed=0):
+    # Deterministic camera-like frames: gradient background, sensor noise and
+    # a face-sized ellipse that drifts a little between frames
+    rng = np.random.default_rng(seed)
+    gradient = np.tile(np.linspace(60, 160, width, dtype=np.float32), (height, 1))
+    frames = []
+    for i in range(count):
+        noise = rng.normal(0, 6, (height, width)).astype(np.float32)
+        gray = np.clip(gradient + noise, 0, 255).astype(np.uint8)
+        frame = cv2.merge([gray, gray, gray])
+        centre = (width // 2 + int(10 * np.sin(i / 5.0)), height // 2)
+        cv2.ellipse(frame, centre, (90, 120), 0, 0, 360, (140, 170, 210), -1)
+        frames.append(frame)
+    return frames
+
+
+class SyntheticSource:
+    def __init__(self, frames):
+        self.frames = frames
+        self.index = 0
+
+    def read(self):
+        frame = self.frames[self.index % len(self.frames)].copy()
+        self.index += 1
+        return True, frame
+
+    def release(self):
+        pass
+
+
+class LoopingVideoSource:
+    # Plays a recorded clip over and over so any frame count can be measured
+    def __init__(self, path):
+        self.path = path
+        self.cap = cv2.VideoCapture(path)
+        if not self.cap.isOpened():
+            raise IOError(f"Cannot open {path}")
+
+    def read(self):
+        ret, frame = self.cap.read()
+        if not ret:
+            self.cap.release()
+            self.cap = cv2.VideoCapture(self.path)
+            ret, frame = self.cap.read()
+        return ret, frame
+
+    def release(self):
+        self.cap.release()
+
+
+def run_stage_benchmark(source, frames, face_mesh=None, warmup=10):
+    samples = {stage: [] for stage in STAGES}
+    totals = []
+    # Used for the EAR stage whenever FaceMesh finds no face (synthetic input)
+    fallback_landmarks = np.random.default_rng(1).uniform(0.3, 0.7, (478, 2))
+    encode_params = [int(cv2.IMWRITE_JPEG_QUALITY), 80]
+    clock = time.perf_counter_ns
+
+    started = None
+    for i in range(warmup + frames):
+        if i == warmup:
+            started = time.perf_counter()
+            samples = {stage: [] for stage in STAGES}
+            totals = []
+        t_start = clock()
+
+        t0 = clock()
+        ret, frame = source.read()
+        t1 = clock()
+        if not ret:
+            break
+        samples['acquire'].append(t1 - t0)
+
+        t0 = clock()
+        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        samples['bgr_to_rgb'].append(clock() - t0)
+
+        landmarks = None
+        if face_mesh is not None:
+            t0 = clock()
+            results = face_mesh.process(rgb_frame)
+            samples['face_mesh'].append(clock() - t0)
+
+            if results.multi_face_landmarks:
+                t0 = clock()
+                points = results.multi_face_landmarks[0].landmark
+                landmarks = np.array([(p.x, p.y) for p in points], dtype=np.float32)
+                samples['landmarks'].append(clock() - t0)
+
+        ear_source = landmarks if landmarks is not None else fallback_landmarks
+        t0 = clock()
+        left_eye = ear_source[LEFT_EYE_INDICES]
+        right_eye = ear_source[RIGHT_EYE_INDICES]
+        _, _, avg_ear = landmarks_ear(ear_source, frame.shape[1] / frame.shape[0])
+        samples['ear'].append(clock() - t0)
+
+        t0 = clock()
+        draw_overlay(frame, left_eye, right_eye, avg_ear, STATUS_MONITORING, avg_ear < EAR_THRESHOLD)
+        samples['overlay'].append(clock() - t0)
+
+        t0 = clock()
+        published = frame.copy()
+        samples['copy'].append(clock() - t0)
+
+        t0 = clock()
+        cv2.imencode('.jpg', published, encode_params)
+        samples['imencode'].append(clock() - t0)
+
+        totals.append(clock() - t_start)
+
+    elapsed = time.perf_counter() - started if started else 0
+    return {
+        'frames': len(totals),
+        'sustained_fps': round(len(totals) / elapsed, 2) if elapsed > 0 else None,
+        'total': percentiles(totals),
+        'stages': {stage: percentiles(samples[stage]) for stage in STAGES}
+    }
+
+
+def print_report(report, baseline=None):
+    print(f"commit {report['commit']}  input {report['input']}  frames {report['results']['frames']}")
+    header = f"{'stage':<12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    if baseline:
+        header += f"{'p50 vs base':>14}"
+    print(header)
+    base_stages = baseline['results']['stages'] if baseline else {}
+    rows = list(report['results']['stages'].items()) + [('total', report['results']['total'])]
+    for name, stats in rows:
+        if not stats:
+            print(f"{name:<12}{'-':>10}{'-':>10}{'-':>10}")
+            continue
+        line = f"{name:<12}{stats['p50_ms']:>10.3f}{stats['p95_ms']:>10.3f}{stats['p99_ms']:>10.3f}"
+        base = baseline['results']['total'] if name == 'total' and baseline else base_stages.get(name)
+        if base:
+            line += f"{(stats['p50_ms'] / base['p50_ms'] - 1) * 100:>+13.1f}%"
+        print(line)
+    fps = report['results']['sustained_fps']
+    line = f"sustained FPS: {fps}"
+    if baseline and baseline['results'].get('sustained_fps'):
+        line += f" (baseline {baseline['results']['sustained_fps']} at {baseline['commit']})"
+    print(line)
+
+
+def stages_command(args):
+    if args.video:
+        source = LoopingVideoSource(args.video)
+        input_name = args.video
+    else:
+        source = SyntheticSource(synthetic_frames())
+        input_name = 'synthetic'
+
+    face_mesh = None if args.skip_face_mesh else create_face_mesh()
+    try:
+        results = run_stage_benchmark(source, args.frames, face_mesh)
+    finally:
+        source.release()
+
+    report = {
+        'benchmark': 'stages',
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'python': platform.python_version(),
+        'opencv': cv2.__version__,
+        'input': input_name,
+        'face_mesh': face_mesh is not None,
+        'results': results
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    output = args.output or os.path.join('bench_results', f"stages-{report['commit']}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print("results written to", output)
+
+
+# Frame counts the state machine used before it switched to seconds; they
+# were tuned for a 30 FPS camera
+LEGACY_EAR_CONSEC_FRAMES = 30
+LEGACY_NO_FACE_FRAMES = 60
+
+# (name, nominal FPS, relative jitter of the frame interval)
+DEBOUNCE_RATES = [('30 fps', 30, 0.0), ('15 fps', 15, 0.0), ('10 fps', 10, 0.0),
+                  ('5 fps', 5, 0.0), ('30 fps jitter', 30, 0.5), ('8 fps jitter', 8, 0.5)]
+
+
+def frame_times(fps, jitter, duration, seed=0):
+    # Monotonic capture times at a nominal rate, each interval randomly
+    # stretched or shortened by up to `jitter` of the nominal period
+    rng = np.random.default_rng(seed)
+    period = 1.0 / fps
+    times = [0.0]
+    while times[-1] < duration:
+        times.append(times[-1] + period * (1 + rng.uniform(-jitter, jitter)))
+    return times
+
+
+def time_to_alert(fps, jitter, onset, sample, legacy_frames, seed=0):
+    # Replays open eyes until `onset`, then `sample` (a closed-eye EAR or
+    # None for no face) until the alert fires. Returns the seconds from the
+    # first frame showing the condition to the alert for the time-based
+    # state machine and for the old frame-count rule, plus the longest frame
+    # interval seen.
+    state = DrowsinessStateMachine()
+    times = frame_times(fps, jitter, onset + 2.0 * legacy_frames / fps + 10.0, seed)
+    longest = max(b - a for a, b in zip(times, times[1:]))
+    first = next(i for i, t in enumerate(times) if t >= onset)
+    legacy = times[first + legacy_frames - 1] - times[first]
+    for t in times:
+        if state.update(EAR_THRESHOLD + 0.1 if t < onset else sample, t) and state.alert_active:
+            return t - times[first], legacy, longest
+    return None, legacy, longest
+
+
+# Gaps without samples before a single closed-eye frame; 2 s is the
+# stream's camera-reconnect pause
+DEBOUNCE_STALLS = [0.5, 1.0, 2.0, 5.0]
+
+
+def stall_then_blink(fps, stall):
+    # Replays open eyes, a stall with no samples, one closed-eye frame and
+    # open eyes again. Returns True if that lone blink raised an alert.
+    state = DrowsinessStateMachine()
+    period = 1.0 / fps
+    times = [i * period for i in range(2 * fps)]
+    blink = times[-1] + stall
+    times += [blink + i * period for i in range(2 * fps)]
+    alerted = False
+    for t in times:
+        state.update(EAR_THRESHOLD - 0.1 if t == blink else EAR_THRESHOLD + 0.1, t)
+        alerted = alerted or state.alert_active
+    return alerted
+
+
+def debounce_command(args):
+    cases = [('closed eyes', EAR_THRESHOLD - 0.1, CLOSED_EYES_SECONDS, LEGACY_EAR_CONSEC_FRAMES),
+             ('no face', None, NO_FACE_SECONDS, LEGACY_NO_FACE_FRAMES)]
+    print(f"{'condition':<13}{'rate':<15}{'target s':>9}{'worst s':>9}{'legacy s':>10}{'ok':>5}")
+    failures = 0
+    results = []
+    for name, sample, target, legacy_frames in cases:
+        for rate_name, fps, jitter in DEBOUNCE_RATES:
+            worst = None
+            legacy_worst = 0.0
+            rate_ok = True
+            for seed in range(args.runs):
+                # Onset falls between frames, so it is only seen on the next one
+                onset = 2.0 + (seed + 0.5) / (args.runs * fps)
+                measured, legacy, longest = time_to_alert(fps, jitter, onset, sample, legacy_frames, seed)
+                ok = measured is not None and abs(measured - target) <= longest + 1e-6
+                rate_ok = rate_ok and ok
+                failures += not ok
+                if measured is not None and (worst is None or abs(measured - target) > abs(worst - target)):
+                    worst = measured
+                legacy_worst = max(legacy_worst, legacy)
+                results.append({'condition': name, 'rate': rate_name, 'seed': seed,
+                                'time_to_alert_s': measured, 'legacy_time_to_alert_s': legacy, 'ok': ok})
+            shown = '-' if worst is None else f"{worst:.3f}"
+            print(f"{name:<13}{rate_name:<15}{target:>9.3f}{shown:>9}{legacy_worst:>10.3f}{'yes' if rate_ok else 'NO':>5}")
+    print(f"{len(results) - failures} of {len(results)} replays alerted within one frame interval of the target")
+
+    print()
+    print(f"{'stall then one closed frame':<30}{'alerted':>8}")
+    blinks = 0
+    false_alerts = 0
+    for fps in (30, 5):
+        for stall in DEBOUNCE_STALLS:
+            alerted = stall_then_blink(fps, stall)
+            blinks += 1
+            false_alerts += alerted
+            results.append({'condition': 'stall then blink', 'rate': f"{fps} fps", 'stall_s': stall,
+                            'alerted': alerted, 'ok': not alerted})
+            print(f"{f'{fps} fps, {stall:.1f} s stall':<30}{'YES' if alerted else 'no':>8}")
+    print(f"{blinks - false_alerts} of {blinks} lone blinks after a stall did not alert")
+    failures += false_alerts
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump({'benchmark': 'debounce', 'commit': git_commit(), 'results': results}, f, indent=2)
+        print("results written to", args.output)
+    if failures:
+        raise SystemExit(1)
+
+
+class LockedState:
+    # The old shared state: fields updated in place under one data_lock,
+    # which readers also held while encoding the frame
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.frame = None
+        self.seq = 0
+        self.ear = None
+
+
+def snapshot_contention(mode, seconds, video_readers, status_readers, frames):
+    # One writer publishing frames as fast as it can against video readers
+    # that JPEG-encode the newest frame and status readers polling the EAR.
+    # Every acquisition of the shared state is timed, and every read checks
+    # that the frame and the fields belong to the same sequence number.
+    encode_params = [int(cv2.IMWRITE_JPEG_QUALITY), 80]
+    clock = time.perf_counter_ns
+    writer_wait, reader_wait = [], []
+    torn = [0]
+    reads = [0]
+    running = [True]
+    locked = LockedState()
+    holder = [EMPTY_SNAPSHOT]
+
+    def check(seq, frame, ear):
+        if frame is not None and (int(frame[0, 0, 0]) != seq % 256 or ear != seq):
+            torn[0] += 1
+        reads[0] += 1
+
+    def video_reader():
+        waits = []
+        while running[0]:
+            t0 = clock()
+            if mode == 'lock':
+                with locked.lock:
+                    waits.append(clock() - t0)
+                    seq, frame, ear = locked.seq, locked.frame, locked.ear
+                    check(seq, frame, ear)
+                    if frame is not None:
+                        cv2.imencode('.jpg', frame, encode_params)
+            else:
+                snapshot = holder[0]
+                waits.append(clock() - t0)
+                check(snapshot.seq, snapshot.frame, snapshot.ear)
+                if snapshot.frame is not None:
+                    cv2.imencode('.jpg', snapshot.frame, encode_params)
+        reader_wait.extend(waits)
+
+    def status_reader():
+        waits = []
+        while running[0]:
+            t0 = clock()
+            if mode == 'lock':
+                with locked.lock:
+                    waits.append(clock() - t0)
+                    check(locked.seq, locked.frame, locked.ear)
+            else:
+                snapshot = holder[0]
+                waits.append(clock() - t0)
+                check(snapshot.seq, snapshot.frame, snapshot.ear)
+            time.sleep(0.001)
+        reader_wait.extend(waits)
+
+    threads = [threading.Thread(target=video_reader) for _ in range(video_readers)]
+    threads += [threading.Thread(target=status_reader) for _ in range(status_readers)]
+    for thread in threads:
+        thread.start()
+
+    published = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        published += 1
+        frame = frames[published % len(frames)].copy()
+        if mode == 'lock':
+            # As drowsiness_detection() did: update, draw and copy under the lock
+            t0 = clock()
+            with locked.lock:
+                writer_wait.append(clock() - t0)
+                locked.seq = published
+                draw_overlay(frame, None, None, None, STATUS_MONITORING, False)
+                frame[0, 0] = published % 256
+                locked.frame = frame.copy()
+                locked.ear = published
+        else:
+            # Build the frame privately, then swap in the new snapshot
+            draw_overlay(frame, None, None, None, STATUS_MONITORING, False)
+            frame[0, 0] = published % 256
+            t0 = clock()
+            holder[0] = EMPTY_SNAPSHOT._replace(seq=published, frame=frame, ear=published)
+            writer_wait.append(clock() - t0)
+        time.sleep(0)
+
+    running[0] = False
+    for thread in threads:
+        thread.join()
+    return {
+        'published_fps': round(published / seconds, 1),
+        'reads': reads[0],
+        'torn_reads': torn[0],
+        'writer_wait': percentiles(writer_wait),
+        'reader_wait': percentiles(reader_wait)
+    }
+
+
+def snapshots_command(args):
+    frames = synthetic_frames(count=8)
+    results = {}
+    print(f"{'mode':<10}{'writer fps':>11}{'writer wait p50/p99 ms':>26}{'reader wait p50/p99 ms':>26}{'torn':>6}")
+    for mode in ('lock', 'snapshot'):
+        result = snapshot_contention(mode, args.seconds, args.video_readers, args.status_readers, frames)
+        results[mode] = result
+        writer, reader = result['writer_wait'], result['reader_wait']
+        print(f"{mode:<10}{result['published_fps']:>11}"
+              f"{writer['p50_ms']:>15.4f}/{writer['p99_ms']:<10.4f}"
+              f"{reader['p50_ms']:>15.4f}/{reader['p99_ms']:<10.4f}{result['torn_reads']:>6}")
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump({'benchmark': 'snapshots', 'commit': git_commit(), 'results': results}, f, indent=2)
+        print("results written to", args.output)
+    if results['snapshot']['torn_reads']:
+        raise SystemExit(1)
+
+
+def alarm_command(args):
+    # A dummy SDL audio driver mixes buffers without a sound card, so the
+    # numbers are comparable across machines and CI
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    from alarm import Alarm
+
+    alarm = Alarm(args.sound, buffer_size=args.buffer)
+    alarm.load()
+    if not alarm.loaded:
+        raise SystemExit(1)
+
+    class Stream:
+        id = 0
+
+    stream = Stream()
+    clock = time.perf_counter_ns
+    repeat_calls = []
+    for _ in range(args.iterations):
+        alarm.stream_alert(stream)
+        # Further alerts while it is playing must not touch the mixer
+        t0 = clock()
+        alarm.stream_alert(stream)
+        repeat_calls.append(clock() - t0)
+        time.sleep(args.hold)
+        alarm.stream_clear(stream)
+        time.sleep(args.hold)
+    preloaded = [int(latency * 1e9) for latency in alarm.latencies]
+
+    # The old way: mixer.music streaming the file from disk
+    import pygame
+    music = []
+    pygame.mixer.music.load(args.sound)
+    for _ in range(args.iterations):
+        t0 = clock()
+        pygame.mixer.music.play(-1)
+        music.append(clock() - t0)
+        time.sleep(args.hold)
+        pygame.mixer.music.stop()
+        time.sleep(args.hold)
+
+    driver = pygame.mixer.get_init()
+    buffer_ms = alarm.buffer_latency * 1000
+    print(f"driver {os.environ['SDL_AUDIODRIVER']}  mixer {driver}  buffer {args.buffer} samples ({buffer_ms:.1f} ms)")
+    print(f"{'start path':<28}{'p50 ms':>10}{'p99 ms':>10}{'+buffer p99':>13}")
+    rows = [('preloaded Sound + channel', percentiles(preloaded), True),
+            ('repeat alert while playing', percentiles(repeat_calls), False),
+            ('mixer.music from disk', percentiles(music), True)]
+    for name, stats, starts_sound in rows:
+        line = f"{name:<28}{stats['p50_ms']:>10.3f}{stats['p99_ms']:>10.3f}"
+        if starts_sound:
+            # The first samples leave within one mixer buffer of submission
+            line += f"{stats['p99_ms'] + buffer_ms:>13.3f}"
+        print(line)
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump({'benchmark': 'alarm', 'commit': git_commit(), 'driver': os.environ['SDL_AUDIODRIVER'],
+                       'buffer_ms': buffer_ms, 'preloaded': percentiles(preloaded),
+                       'repeat_alert': percentiles(repeat_calls), 'music': percentiles(music)}, f, indent=2)
+        print("results written to", args.output)
+
+
+def ear_command(args):
+    # EAR from a landmark array: per-point distance calls as the scripts
+    # used to do, against the vectorized NumPy path, per frame and batched.
+    # The points are already in pixel proportions (aspect ratio 1).
+    import math
+    rng = np.random.default_rng(0)
+    landmarks = rng.uniform(0.3, 0.7, (args.frames, 478, 2)).astype(np.float32)
+    clock = time.perf_counter_ns
+
+    def per_call(dist):
+        def ear(points):
+            eyes = []
+            for indices in (LEFT_EYE_INDICES, RIGHT_EYE_INDICES):
+                eye = points[indices]
+                eyes.append((dist(eye[1], eye[5]) + dist(eye[2], eye[4])) / (2.0 * dist(eye[0], eye[3])))
+            return eyes
+        return ear
+
+    def numpy_ear(points):
+        return eyes_ear(points, 1.0)
+
+    paths = [('math.dist', per_call(math.dist)), ('numpy', numpy_ear)]
+    try:
+        from scipy.spatial import distance
+        paths.insert(0, ('scipy euclidean', per_call(distance.euclidean)))
+    except ImportError:
+        pass
+
+    expected = eyes_ear(landmarks, 1.0)
+    results = {}
+    print(f"{'path':<18}{'p50 us':>10}{'p99 us':>10}")
+    for name, ear in paths:
+        samples = []
+        for points in landmarks:
+            t0 = clock()
+            value = ear(points)
+            samples.append(clock() - t0)
+        assert np.allclose(value, expected[-1], rtol=1e-4)
+        stats = percentiles(samples)
+        results[name] = stats
+        print(f"{name:<18}{stats['p50_ms'] * 1000:>10.2f}{stats['p99_ms'] * 1000:>10.2f}")
+    t0 = clock()
+    eyes_ear(landmarks, 1.0)
+    batch_us = (clock() - t0) / 1000 / args.frames
+    results['numpy batch'] = {'per_frame_us': round(batch_us, 3)}
+    print(f"{'numpy batch':<18}{batch_us:>10.2f}  per frame, {args.frames} frames in one call")
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump({'benchmark': 'ear', 'commit': git_commit(), 'results': results}, f, indent=2)
+        print("results written to", args.output)
+
+
+def telemetry_command(args):
+    # Per-sample cost of the memory-mapped telemetry log against writing the
+    # same 32-byte record through a buffered file, a write() system call per
+    # sample and a write() plus fsync() per sample
+    from telemetry_log import RECORD_DTYPE, TelemetryLog
+    directory = tempfile.mkdtemp(prefix='dms-telemetry-', dir=args.directory)
+    rng = np.random.default_rng(0)
+    ears = rng.uniform(0.1, 0.4, args.records).astype(np.float32).tolist()
+    clock = time.perf_counter_ns
+    now = time.time()
+
+    def record(i):
+        return (now + i / 30.0, i + 1, ears[i], ears[i], ears[i], 0.0, 1, 0, 0, 0)
+
+    results = {}
+    try:
+        log = TelemetryLog(directory, max_bytes=args.file_mb * 1024 * 1024, flush_interval=3600)
+        samples = []
+        for i in range(args.records):
+            t0 = clock()
+            log.append(now + i / 30.0, ears[i], ears[i], ears[i], 0.0, True, False, STATUS_MONITORING)
+            samples.append(clock() - t0)
+        # The msync done by the background thread, off the detection path
+        t0 = clock()
+        log.flush()
+        flush_ms = (clock() - t0) / 1e6
+        log_stats = log.stats()
+        log.close()
+        results['mmap log'] = percentiles(samples)
+
+        def file_path(name):
+            return os.path.join(directory, name)
+
+        with open(file_path('buffered.bin'), 'wb') as f:
+            samples = []
+            for i in range(args.records):
+                t0 = clock()
+                f.write(np.array(record(i), dtype=RECORD_DTYPE).tobytes())
+                samples.append(clock() - t0)
+        results['buffered write'] = percentiles(samples)
+
+        fd = os.open(file_path('unbuffered.bin'), os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+        samples = []
+        for i in range(args.records):
+            t0 = clock()
+            os.write(fd, np.array(record(i), dtype=RECORD_DTYPE).tobytes())
+            samples.append(clock() - t0)
+        os.close(fd)
+        results['write() per sample'] = percentiles(samples)
+
+        fd = os.open(file_path('fsync.bin'), os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+        samples = []
+        for i in range(min(args.records, args.fsync_records)):
+            t0 = clock()
+            os.write(fd, np.array(record(i), dtype=RECORD_DTYPE).tobytes())
+            os.fsync(fd)
+            samples.append(clock() - t0)
+        os.close(fd)
+        results['write()+fsync()'] = percentiles(samples)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    frame_us = 1e6 / 30
+    print(f"{args.records} samples, {log_stats['files']} log file(s), one flush of the log {flush_ms:.2f} ms")
+    print(f"{'path':<22}{'p50 us':>10}{'p99 us':>10}{'mean us':>10}{'% of 30 FPS frame':>20}")
+    for name, stats in results.items():
+        print(f"{name:<22}{stats['p50_ms'] * 1000:>10.2f}{stats['p99_ms'] * 1000:>10.2f}"
+              f"{stats['mean_ms'] * 1000:>10.2f}{100 * stats['mean_ms'] * 1000 / frame_us:>20.4f}")
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump({'benchmark': 'telemetry', 'commit': git_commit(), 'records': args.records,
+                       'flush_ms': flush_ms, 'results': results}, f, indent=2)
+        print("results written to", args.output)
+
+
+class ViewerStream:
+    # Just the parts of a detection stream the serving routes use
+    def __init__(self):
+        from frame_broadcaster import FrameBroadcaster
+        from status_events import StatusEventStream
+        self.id = 0
+        self.snapshot = EMPTY_SNAPSHOT
+        self.broadcaster = FrameBroadcaster()
+        self.status_events = StatusEventStream()
+
+
+async def viewer_client(port, path, marker, seconds, read_size=65536, pause=0.0):
+    # Reads a long-lived response for seconds and counts the markers (MJPEG
+    # boundaries or SSE events) in it; pause makes a deliberately slow client
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    started = time.monotonic()
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+    count, first, tail = 0, None, b''
+    deadline = started + seconds
+    try:
+        while time.monotonic() < deadline:
+            try:
+                chunk = await asyncio.wait_for(reader.read(read_size), deadline - time.monotonic())
+            except asyncio.TimeoutError:
+                break
+            if not chunk:
+                break
+            data = tail + chunk
+            found = data.count(marker)
+            if found and first is None:
+                first = time.monotonic() - started
+            count += found
+            tail = data[-len(marker) + 1:]
+            if pause:
+                await asyncio.sleep(pause)
+    finally:
+        writer.close()
+    return {'count': count, 'first_s': first, 'rate': count / seconds}
+
+
+async def status_poller(port, seconds, interval=0.1):
+    latencies = []
+    errors = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        t0 = time.perf_counter_ns()
+        try:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(b"GET /api/status HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n")
+            response = await asyncio.wait_for(reader.read(), 5.0)
+            writer.close()
+            if not response.startswith(b'HTTP/1.1 200') and not response.startswith(b'HTTP/1.0 200'):
+                errors += 1
+            else:
+                latencies.append(time.perf_counter_ns() - t0)
+        except (OSError, asyncio.TimeoutError):
+            errors += 1
+        await asyncio.sleep(interval)
+    return latencies, errors
+
+
+def viewer_load(port, args, results):
+    # Runs in its own process so the clients do not share the server's GIL
+    async def run():
+        clients = [viewer_client(port, '/video_feed', b'--frame', args.seconds) for _ in range(args.video)]
+        clients += [viewer_client(port, f'/video_feed?fps={args.cap_fps}', b'--frame', args.seconds)
+                    for _ in range(args.capped)]
+        clients += [viewer_client(port, '/video_feed', b'--frame', args.seconds, read_size=4096, pause=0.05)
+                    for _ in range(args.slow)]
+        clients += [viewer_client(port, '/api/stream', b'event: ear', args.seconds) for _ in range(args.events)]
+        clients += [status_poller(port, args.seconds) for _ in range(args.status)]
+        return await asyncio.gather(*clients, return_exceptions=True)
+
+    outcome = asyncio.run(run())
+    groups = {'video': args.video, 'capped': args.capped, 'slow': args.slow, 'events': args.events}
+    summary = {}
+    index = 0
+    for name, count in groups.items():
+        group = outcome[index:index + count]
+        index += count
+        ok = [r for r in group if isinstance(r, dict) and r['count']]
+        rates = sorted(r['rate'] for r in ok)
+        firsts = sorted(r['first_s'] for r in ok)
+        summary[name] = {
+            'clients': count,
+            'receiving': len(ok),
+            'rate_p50': round(rates[len(rates) // 2], 1) if rates else 0.0,
+            'rate_min': round(rates[0], 1) if rates else 0.0,
+            'first_p99_s': round(firsts[int(len(firsts) * 0.99) - 1 if len(firsts) > 1 else 0], 3) if firsts else None
+        }
+    latencies, errors = [], 0
+    for result in outcome[index:]:
+        if isinstance(result, tuple):
+            latencies += result[0]
+            errors += result[1]
+        else:
+            errors += 1
+    summary['status'] = {'pollers': args.status, 'errors': errors, 'latency': percentiles(latencies)}
+    results.put(summary)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def viewers_run(mode, args, frames):
+    # The server's own app and routes, serving a stand-in stream; importing
+    # the script starts nothing
+    import sleep_detection_vehicle as vehicle
+    stream = ViewerStream()
+    vehicle.streams.clear()
+    vehicle.streams[0] = stream
+    app = vehicle.create_app()
+    port = free_port()
+    if mode == 'async':
+        from async_server import AsyncStreamServer
+        server = AsyncStreamServer(app, vehicle.streams, host='127.0.0.1', port=port, max_fps=vehicle.MAX_FPS)
+        threading.Thread(target=server.run, daemon=True).start()
+    else:
+        from werkzeug.serving import make_server
+        import logging
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)  # no line per request
+        server = make_server('127.0.0.1', port, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    time.sleep(0.5)
+
+    running = [True]
+
+    def publisher():
+        # A 30 FPS camera: a frame to encode and an EAR event per tick
+        i = 0
+        while running[0]:
+            i += 1
+            stream.snapshot = EMPTY_SNAPSHOT._replace(seq=i, ear=0.3)
+            stream.broadcaster.publish(frames[i % len(frames)])
+            stream.status_events.publish_ear(0.3)
+            time.sleep(1 / 30)
+
+    threading.Thread(target=publisher, daemon=True).start()
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    clients = context.Process(target=viewer_load, args=(port, args, results))
+    cpu = time.process_time()
+    clients.start()
+    peak_threads = 0
+    deadline = time.monotonic() + args.seconds + 2
+    while clients.is_alive() and time.monotonic() < deadline + 10:
+        peak_threads = max(peak_threads, threading.active_count())
+        time.sleep(0.1)
+    summary = results.get(timeout=30)
+    clients.join()
+    summary['server_threads_peak'] = peak_threads
+    summary['server_cpu_s'] = round(time.process_time() - cpu, 2)
+    if mode == 'async':
+        summary['server'] = server.stats()
+    running[0] = False
+    stream.broadcaster.stop()
+    stream.status_events.stop()
+    if mode != 'async':
+        server.shutdown()
+    return summary
+
+
+def viewers_command(args):
+    frames = synthetic_frames(count=8)
+    modes = ['threaded', 'async'] if args.mode == 'both' else [args.mode]
+    results = {}
+    print(f"{args.video} viewers, {args.capped} capped at {args.cap_fps} FPS, {args.slow} slow readers, "
+          f"{args.events} event streams, {args.status} status pollers, {args.seconds:.0f} s")
+    print(f"{'mode':<10}{'video fps p50/min':>19}{'capped fps':>12}{'slow fps':>10}{'events/s':>10}"
+          f"{'status p50/p99 ms':>19}{'errors':>8}{'threads':>9}{'cpu s':>7}")
+    for mode in modes:
+        summary = viewers_run(mode, args, frames)
+        results[mode] = summary
+        status = summary['status']['latency'] or {'p50_ms': float('nan'), 'p99_ms': float('nan')}
+        print(f"{mode:<10}{summary['video']['rate_p50']:>11.1f}/{summary['video']['rate_min']:<7.1f}"
+              f"{summary['capped']['rate_p50']:>12.1f}{summary['slow']['rate_p50']:>10.1f}"
+              f"{summary['events']['rate_p50']:>10.1f}"
+              f"{status['p50_ms']:>11.1f}/{status['p99_ms']:<7.1f}{summary['status']['errors']:>8}"
+              f"{summary['server_threads_peak']:>9}{summary['server_cpu_s']:>7}")
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump({'benchmark': 'viewers', 'commit': git_commit(), 'args': vars(args) | {'func': None},
+                       'results': results}, f, indent=2)
+        print("results written to", args.output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drowsiness detection benchmarks (no camera or GUI needed)")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    stages = subparsers.add_parser('stages', help="per-stage latency of the detection pipeline")
+    stages.add_argument('--video', help="recorded clip to loop over (default: synthetic frames)")
+    stages.add_argument('--frames', type=int, default=300)
+    stages.add_argument('--skip-face-mesh', action='store_true',
+                        help="time everything except MediaPipe inference")
+    stages.add_argument('--output', help="JSON results file (default: bench_results/stages-<commit>.json)")
+    stages.add_argument('--compare', help="previous JSON results to compare against")
+    stages.set_defaults(func=stages_command)
+
+    debounce = subparsers.add_parser('debounce', help="time to alert when replaying EAR at different frame rates")
+    debounce.add_argument('--runs', type=int, default=20, help="jittered replays per rate")
+    debounce.add_argument('--output', help="JSON results file")
+    debounce.set_defaults(func=debounce_command)
+
+    snapshots = subparsers.add_parser('snapshots', help="lock wait of the old data_lock vs atomic snapshot swaps")
+    snapshots.add_argument('--seconds', type=float, default=3.0, help="duration of each mode")
+    snapshots.add_argument('--video-readers', type=int, default=4, help="/video_feed viewers encoding frames")
+    snapshots.add_argument('--status-readers', type=int, default=2, help="/api/status pollers")
+    snapshots.add_argument('--output', help="JSON results file")
+    snapshots.set_defaults(func=snapshots_command)
+
+    alarm = subparsers.add_parser('alarm', help="alert-to-sound latency of the alarm (dummy audio driver by default)")
+    alarm.add_argument('--sound', default='alarm.wav')
+    alarm.add_argument('--buffer', type=int, default=512, help="mixer buffer size in samples")
+    alarm.add_argument('--iterations', type=int, default=100)
+    alarm.add_argument('--hold', type=float, default=0.02, help="seconds between start and stop")
+    alarm.add_argument('--output', help="JSON results file")
+    alarm.set_defaults(func=alarm_command)
+
+    ear = subparsers.add_parser('ear', help="EAR computation: per-point distance calls vs vectorized NumPy")
+    ear.add_argument('--frames', type=int, default=10000)
+    ear.add_argument('--output', help="JSON results file")
+    ear.set_defaults(func=ear_command)
+
+    viewers = subparsers.add_parser('viewers', help="many local HTTP viewers against the threaded and async servers")
+    viewers.add_argument('--mode', choices=['threaded', 'async', 'both'], default='both')
+    viewers.add_argument('--seconds', type=float, default=10.0, help="duration of each mode")
+    viewers.add_argument('--video', type=int, default=100, help="/video_feed viewers at full rate")
+    viewers.add_argument('--capped', type=int, default=100, help="/video_feed viewers with ?fps=")
+    viewers.add_argument('--cap-fps', type=float, default=2.0)
+    viewers.add_argument('--slow', type=int, default=10, help="viewers reading slower than the stream")
+    viewers.add_argument('--events', type=int, default=100, help="/api/stream dashboards")
+    viewers.add_argument('--status', type=int, default=10, help="/api/status pollers (10 per second each)")
+    viewers.add_argument('--output', help="JSON results file")
+    viewers.set_defaults(func=viewers_command)
+
+    telemetry = subparsers.add_parser('telemetry', help="per-sample cost of the memory-mapped telemetry log vs file writes")
+    telemetry.add_argument('--records', type=int, default=100000)
+    telemetry.add_argument('--fsync-records', type=int, default=2000, help="samples for the fsync-per-sample path")
+    telemetry.add_argument('--file-mb', type=int, default=64, help="size of each log file")
+    telemetry.add_argument('--directory', help="where to write the scratch files (default: system temp dir)")
+    telemetry.add_argument('--output', help="JSON results file")
+    telemetry.set_defaults(func=telemetry_command)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+import time
+
+import numpy as np
+
+# Drowsiness detection parameters. Durations are in seconds of monotonic
+# time, so the time to alert does not depend on the frame rate.
+EAR_THRESHOLD = 0.25  # Eye Aspect Ratio threshold
+CLOSED_EYES_SECONDS = 1.0  # Eyes closed this long (net of decay) triggers the alert
+NO_FACE_SECONDS = 2.0  # Face missing this long triggers the alert
+MAX_SAMPLE_GAP = 0.5  # Longest interval one sample can vouch for, e.g. across a camera stall
+
+# Landmark indices for left and right eyes
+LEFT_EYE_INDICES = [33, 160, 158, 133, 153, 144]
+RIGHT_EYE_INDICES = [362, 385, 387, 263, 373, 380]
+
+# Point pairs whose distances make up the EAR, per eye: the two vertical
+# pairs (p2-p6, p3-p5), then the horizontal one (p1-p4)
+EAR_PAIRS = [[1, 5], [2, 4], [0, 3]]
+EYE_PAIR_INDICES = np.array([[[eye[a], eye[b]] for a, b in EAR_PAIRS]
+                             for eye in (LEFT_EYE_INDICES, RIGHT_EYE_INDICES)])
+
+STATUS_MONITORING = "Monitoring Active"
+STATUS_SEARCHING = "Searching for face..."
+STATUS_DROWSY = "DROWSINESS DETECTED!"
+STATUS_NO_FACE = "FACE NOT DETECTED!"
+STATUS_FAULT = "DETECTION UNAVAILABLE!"
+
+
+def _pair_ear(points):
+    # points: (..., 3, 2, 2) endpoints of the EAR's three distances
+    d = points[..., 0, :] - points[..., 1, :]
+    dist = np.sqrt((d * d).sum(axis=-1))
+    return (dist[..., 0] + dist[..., 1]) / (2.0 * dist[..., 2])
+
+
+def eyes_ear(landmarks, aspect):
+    # (left, right) EAR from an (N, 2) landmark array in one pass, or an
+    # (..., 2) array of them from stacked landmarks, e.g. (frames, N, 2).
+    # Landmarks are normalized to the frame, so x is scaled by its aspect
+    # ratio (width / height) to measure the eye in pixel proportions, the
+    # space EAR_THRESHOLD is meant for, whatever the camera's aspect ratio.
+    points = np.take(landmarks, EYE_PAIR_INDICES, axis=-2)
+    if aspect != 1.0:
+        points = points * np.array([aspect, 1.0], dtype=np.float32)
+    return _pair_ear(points)
+
+
+def landmarks_ear(landmarks, aspect):
+    # Left, right and average EAR from an (N, 2) landmark array
+    left_ear, right_ear = eyes_ear(landmarks, aspect).tolist()
+    return left_ear, right_ear, (left_ear + right_ear) / 2.0
+
+
+def create_face_mesh():
+    # mediapipe is imported here, so importing this module stays cheap
+    import mediapipe as mp
+    return mp.solutions.face_mesh.FaceMesh(
+        min_detection_confidence=0.5,
+        min_tracking_confidence=0.5,
+        max_num_faces=1
+    )
+
+
+class DrowsinessStateMachine:
+    # Time-based drowsiness logic: time with the eyes closed accumulates and
+    # time with them open slowly decays it at the same rate; a long enough
+    # stretch without a face also alerts. Each update accounts for the time
+    # since the previous one, so a drop in frame rate never delays an alert.
+    # That time is credited to what the previous sample showed, so closed
+    # time only builds up across consecutive closed samples: a single closed
+    # frame after a stall (e.g. a camera reconnect) adds nothing.
+    # on_alert / on_clear are called on alert transitions (e.g. the alarm).
+
+    def __init__(self, ear_threshold=EAR_THRESHOLD, closed_eyes_seconds=CLOSED_EYES_SECONDS,
+                 no_face_seconds=NO_FACE_SECONDS, max_sample_gap=MAX_SAMPLE_GAP,
+                 on_alert=None, on_clear=None):
+        self.ear_threshold = ear_threshold
+        self.closed_eyes_seconds = closed_eyes_seconds
+        self.no_face_seconds = no_face_seconds
+        self.max_sample_gap = max_sample_gap
+        self.on_alert = on_alert
+        self.on_clear = on_clear
+
+        self.closed_time = 0.0
+        self.no_face_time = 0.0
+        self.last_update = None
+        self.last_state = None  # 'open', 'closed' or 'no_face' for the previous sample
+        self.status = STATUS_MONITORING
+        self.alert_active = False
+
+    def _raise_alert(self):
+        self.alert_active = True
+        if self.on_alert:
+            self.on_alert()
+
+    def _clear_alert(self):
+        self.alert_active = False
+        if self.on_clear:
+            self.on_clear()
+
+    def fault(self):
+        # No eye detector could be started, so nothing is being monitored:
+        # alert until someone deals with it
+        self.status = STATUS_FAULT
+        if not self.alert_active:
+            self._raise_alert()
+
+    def update(self, avg_ear, now=None):
+        # Advances the state to `now` (time.monotonic() by default); avg_ear
+        # is None when no face was found. Returns True if alert_active
+        # changed on this update.
+        now = time.monotonic() if now is None else now
+        elapsed = 0.0
+        if self.last_update is not None:
+            elapsed = min(max(now - self.last_update, 0.0), self.max_sample_gap)
+        self.last_update = now
+        was_active = self.alert_active
+
+        # The interval since the previous sample, in that sample's state
+        if self.last_state == 'closed':
+            self.closed_time += elapsed
+        elif self.last_state == 'open':
+            # Slowly decay the closed time for more robust detection
+            self.closed_time = max(0.0, self.closed_time - elapsed)
+        elif self.last_state == 'no_face':
+            self.no_face_time += elapsed
+
+        if avg_ear is not None:
+            self.no_face_time = 0.0  # Reset no face timer
+
+            # Check for drowsiness
+            if avg_ear < self.ear_threshold:
+                self.last_state = 'closed'
+                # Small tolerance so n frames of 1/n s add up to a full second
+                if self.closed_time >= self.closed_eyes_seconds - 1e-6 and not self.alert_active:
+                    self.status = STATUS_DROWSY
+                    self._raise_alert()
+            else:
+                self.last_state = 'open'
+                if self.closed_time == 0.0 and self.alert_active:
+                    self._clear_alert()
+
+            # Face found again: back from "Searching for face...", to the
+            # drowsiness alert if the face was lost while it was sounding
+            if not self.alert_active:
+                self.status = STATUS_MONITORING
+            elif self.status == STATUS_SEARCHING:
+                self.status = STATUS_DROWSY
+        else:
+            self.last_state = 'no_face'
+            if self.no_face_time >= self.no_face_seconds - 1e-6:
+                self.status = STATUS_NO_FACE
+                if not self.alert_active:
+                    self._raise_alert()
+            else:
+                self.status = STATUS_SEARCHING
+
+        return self.alert_active != was_active
@@ -0,0 +1,333 @@
+import itertools
+import math
+import multiprocessing
+import threading
+import time
+
+import cv2
+
+from alarm import Alarm
+from metrics import Registry
+from frame_broadcaster import FrameBroadcaster
+from status_events import StatusEventStream
+from incident_recorder import IncidentRecorder
+from shared_frames import STATUSES, SharedFrameRing
+from detection_stream import (EMPTY_SNAPSHOT, DetectionSnapshot, DetectionStream, StreamMetrics,
+                              StreamWorkerPool, parse_source)
+
+
+def run_detection(sources, ring_names, conn, workers, stream_options, alarm_path):
+    # Entry point of the detection process: the same DetectionStreams and
+    # worker pool as the in-process mode, plus the alarm, with every
+    # annotated frame written to the stream's shared ring. Web traffic
+    # lives in another interpreter, so it cannot take this one's GIL. Small
+    # requests from the web process (metrics, history, pipeline stats) are
+    # answered over conn until the web process goes away; every handler
+    # returns right away, so one request never holds up the next. A stream
+    # with no working eye detector publishes its fault and makes the
+    # process exit non-zero, so the supervisor restarts it for a new try.
+    registry = Registry()
+    stream_metrics = StreamMetrics(registry)
+    alarm = Alarm(alarm_path)
+    alarm.register_metrics(registry)
+    alarm.start_loading()
+
+    fault = threading.Event()
+    streams = []
+    for stream_id, (source, ring_name) in enumerate(zip(sources, ring_names)):
+        streams.append(DetectionStream(
+            stream_id, source, stream_metrics,
+            on_alert=alarm.stream_alert, on_clear=alarm.stream_clear, on_fault=lambda stream: fault.set(),
+            frame_ring=SharedFrameRing.attach(ring_name), **stream_options))
+    pool = StreamWorkerPool(min(workers, len(streams)))
+    pool.start()
+    for stream in streams:
+        stream.start(pool)
+
+    started_at = stream_options.get('started_at', time.monotonic())
+
+    def startup():
+        # Empty until the alarm has loaded; the web process polls
+        return {} if alarm.ready_at is None else {'audio_ready': round(alarm.ready_at - started_at, 3)}
+
+    handlers = {
+        'metrics': registry.render,
+        'history': lambda stream_id, points, seconds, now:
+            streams[stream_id].history.downsample(points=points, seconds=seconds, now=now),
+        'history_stats': lambda stream_id: streams[stream_id].history.stats(),
+        'pipeline': lambda stream_id: streams[stream_id].pipeline_stats(),
+        'startup': startup,
+        'alarm': alarm.stats
+    }
+    while not fault.is_set():
+        try:
+            if not conn.poll(0.5):
+                continue
+            request = conn.recv()
+        except (EOFError, OSError):
+            break
+        if request is None:
+            break
+        call_id, method, args = request
+        try:
+            reply = handlers[method](*args)
+        except Exception as e:
+            print(f"Detection process: {method} request failed:", e)
+            reply = None
+        try:
+            conn.send((call_id, reply))
+        except (EOFError, OSError):
+            break
+
+    for stream in streams:
+        stream.stop()
+    pool.stop()
+    alarm.stop()
+    if fault.is_set():
+        raise SystemExit(1)
+
+
+class DetectionProcess:
+    # Owns the shared rings and the detection process in the web process,
+    # and restarts the detection process if it ever exits unexpectedly.
+    # The spawn start method is used on every platform, so the child never
+    # inherits the web server's threads or locks. Calls are tagged with an
+    # id and a reader thread hands each reply to its caller, so callers
+    # only take the lock to send and never wait on each other.
+
+    def __init__(self, sources, workers, stream_options, alarm_path='alarm.wav', ring_slots=8,
+                 max_height=720, max_width=1280):
+        self.sources = [str(source) for source in sources]
+        self.workers = workers
+        self.stream_options = stream_options
+        self.alarm_path = alarm_path
+        self.rings = [SharedFrameRing.create(ring_slots, max_height, max_width) for _ in self.sources]
+        self.context = multiprocessing.get_context('spawn')
+        self.process = None
+        self.conn = None
+        self.lock = threading.Lock()  # serializes sends on conn
+        self.call_ids = itertools.count(1)
+        self.pending = {}  # call id -> [Event, reply]
+        self.running = False
+        self.restarts = 0
+
+    def _spawn(self):
+        parent_conn, child_conn = self.context.Pipe()
+        self.process = self.context.Process(
+            target=run_detection, name='detection', daemon=True,
+            args=(self.sources, [ring.name for ring in self.rings], child_conn, self.workers, self.stream_options,
+                  self.alarm_path))
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+        threading.Thread(target=self._read_replies, args=(parent_conn,), daemon=True).start()
+
+    def _read_replies(self, conn):
+        # Runs until this process's end of the pipe goes away
+        while True:
+            try:
+                call_id, reply = conn.recv()
+            except (EOFError, OSError):
+                break
+            waiter = self.pending.get(call_id)
+            if waiter is not None:  # None when the caller already gave up
+                waiter[1] = reply
+                waiter[0].set()
+
+    def start(self):
+        self.running = True
+        self._spawn()
+        threading.Thread(target=self._supervise, daemon=True).start()
+
+    def _supervise(self):
+        while self.running:
+            self.process.join(1.0)
+            if self.running and not self.process.is_alive():
+                print(f"Detection process exited with code {self.process.exitcode} - restarting...")
+                self.restarts += 1
+                time.sleep(2)
+                with self.lock:
+                    self._spawn()
+
+    def call(self, method, *args, timeout=2.0):
+        # Returns None if the detection process does not answer in time
+        call_id = next(self.call_ids)
+        waiter = [threading.Event(), None]
+        self.pending[call_id] = waiter
+        try:
+            with self.lock:
+                self.conn.send((call_id, method, args))
+            if waiter[0].wait(timeout):
+                return waiter[1]
+        except (EOFError, OSError):
+            pass
+        finally:
+            del self.pending[call_id]
+        return None
+
+    def stop(self):
+        # Stop the RemoteStreams first; they read from the rings closed here
+        self.running = False
+        if self.process is not None:
+            with self.lock:
+                try:
+                    self.conn.send(None)
+                except (EOFError, OSError):
+                    pass
+            self.process.join(2.0)
+            if self.process.is_alive():
+                self.process.terminate()
+        for ring in self.rings:
+            ring.close()
+
+
+class WebStreamMetrics:
+    # Metric families produced on the web side in this mode; everything
+    # else comes from the detection process's registry
+    def __init__(self, registry):
+        self.jpeg_encode_seconds = registry.histogram(
+            'dms_jpeg_encode_seconds', 'JPEG encode time per broadcast frame', ['stream'])
+        self.stream_clients = registry.gauge('dms_stream_clients', 'Connected /video_feed clients', ['stream'])
+        self.event_clients = registry.gauge('dms_event_clients', 'Connected /api/stream clients', ['stream'])
+        self.incident_buffer_bytes = registry.gauge(
+            'dms_incident_buffer_bytes', 'Memory held by the pre-alert JPEG ring buffer', ['stream'])
+        self.overwritten_reads = registry.gauge(
+            'dms_shared_ring_overwritten_reads', 'Shared ring slots overwritten while being read', ['stream'])
+
+
+class RemoteHistory:
+    # EarHistory interface answered by the detection process
+    def __init__(self, detection, stream_id):
+        self.detection = detection
+        self.stream_id = stream_id
+
+    def downsample(self, points=300, seconds=None, now=None):
+        history = self.detection.call('history', self.stream_id, points, seconds, now)
+        return history if history is not None else {'t': [], 'ear': [], 'face_present': []}
+
+    def stats(self):
+        return self.detection.call('history_stats', self.stream_id) or {}
+
+
+class RemoteStream:
+    # Web-process stand-in for a DetectionStream running in the detection
+    # process, with the attributes the routes use. A reader thread follows
+    # the stream's shared ring: it JPEG-encodes straight from the NumPy view
+    # of the newest slot (only while someone is watching or recording),
+    # then checks the slot was not overwritten meanwhile.
+
+    def __init__(self, stream_id, source, ring, detection, web_metrics, clip_writer=None,
+                 incident_buffer_bytes=16 * 1024 * 1024, jpeg_quality=80, poll_interval=0.005):
+        self.id = stream_id
+        self.source = parse_source(source)
+        self.ring = ring
+        self.detection = detection
+        self.poll_interval = poll_interval
+        self.encode_params = [int(cv2.IMWRITE_JPEG_QUALITY), jpeg_quality]
+        self.running = False
+        self.reader = None
+
+        self.snapshot = EMPTY_SNAPSHOT
+        self.history = RemoteHistory(detection, stream_id)
+        self.last_fps = None
+        self.first_frame = threading.Event()
+        self.web_startup = {}
+        self.started_at = detection.stream_options.get('started_at', time.monotonic())
+
+        label = str(stream_id)
+        self.encode_seconds = web_metrics.jpeg_encode_seconds.labels(label)
+        web_metrics.overwritten_reads.labels(label).set_function(lambda: self.ring.overwritten_reads)
+        self.broadcaster = FrameBroadcaster(jpeg_quality)
+        web_metrics.stream_clients.labels(label).set_function(lambda: self.broadcaster.clients)
+        self.status_events = StatusEventStream()
+        web_metrics.event_clients.labels(label).set_function(lambda: self.status_events.clients)
+
+        self.recorder = None
+        if clip_writer is not None:
+            self.recorder = IncidentRecorder(stream_id, clip_writer, max_bytes=incident_buffer_bytes)
+            self.broadcaster.add_listener(self.recorder.add_frame)
+            web_metrics.incident_buffer_bytes.labels(label).set_function(
+                lambda: self.recorder.buffer.memory_bytes)
+
+    @property
+    def startup(self):
+        pipeline = self.detection.call('pipeline', self.id) or {}
+        startup = dict(pipeline.get('startup_s') or {})
+        startup.update(self.web_startup)
+        return startup
+
+    def fps(self):
+        return self.last_fps
+
+    def read_loop(self):
+        last_seq = 0
+        while self.running:
+            seq = self.ring.latest()
+            if seq == last_seq:
+                time.sleep(self.poll_interval)
+                continue
+            last_seq = seq
+            result = self.ring.read(seq)
+            if result is None:
+                continue
+            record, frame = result
+
+            jpeg = None
+            # Lower degradation levels send some slots without an image
+            if frame.size and (self.broadcaster.clients or self.broadcaster.listeners):
+                start = time.perf_counter()
+                ret, buffer = cv2.imencode('.jpg', frame, self.encode_params)
+                self.encode_seconds.observe(time.perf_counter() - start)
+                if ret and self.ring.is_current(seq):
+                    jpeg = buffer.tobytes()
+                else:
+                    self.ring.overwritten_reads += 1
+            del frame  # the view must not outlive this iteration
+
+            previous = self.snapshot
+            ear = float(record['ear'])
+            snapshot = DetectionSnapshot(
+                seq, float(record['captured_at']), None, STATUSES[int(record['status'])],
+                bool(record['alert_active']), None if math.isnan(ear) else ear,
+                float(record['closed_time']), float(record['no_face_time']),
+                int(record['drowsy_alerts']), int(record['face_missing_alerts']), record['level'].decode())
+            self.snapshot = snapshot
+            fps = float(record['fps'])
+            self.last_fps = None if math.isnan(fps) else fps
+
+            if self.recorder is not None:
+                if snapshot.drowsy_alerts > previous.drowsy_alerts:
+                    self.recorder.trigger('drowsy')
+                elif snapshot.face_missing_alerts > previous.face_missing_alerts:
+                    self.recorder.trigger('face_missing')
+            self.status_events.publish_status(snapshot.status_dict())
+            self.status_events.publish_ear(snapshot.ear)
+            if jpeg is not None:
+                self.broadcaster.publish_jpeg(jpeg)
+
+            if not self.first_frame.is_set() and not snapshot.fault:
+                self.web_startup['web_first_frame'] = round(time.monotonic() - self.started_at, 3)
+                self.first_frame.set()
+
+    def pipeline_stats(self):
+        stats = self.detection.call('pipeline', self.id) or {'stream': self.id, 'source': str(self.source)}
+        stats['shared_ring'] = self.ring.stats()
+        stats['detection_process'] = {
+            'pid': self.detection.process.pid if self.detection.process else None,
+            'restarts': self.detection.restarts
+        }
+        return stats
+
+    def start(self):
+        self.running = True
+        self.reader = threading.Thread(target=self.read_loop, daemon=True)
+        self.reader.start()
+
+    def stop(self):
+        self.running = False
+        if self.reader is not None:
+            self.reader.join(1.0)
+        self.broadcaster.stop()
+        self.status_events.stop()
+        if self.recorder is not None:
+            self.recorder.flush()
@@ -0,0 +1,551 @@
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+from overlay import draw_overlay
+from status_events import StatusEventStream
+from metrics import RateMeter
+from frame_broadcaster import FrameBroadcaster
+from pipeline import LatestQueue, DeadlinePacer
+from face_roi import FaceROITracker
+from inference_scheduler import AdaptiveInferenceScheduler
+from ear_history import EarHistory
+from haar_eyes import HaarEyeDetector
+from incident_recorder import IncidentRecorder
+from load_controller import LoadController
+from telemetry_log import TelemetryLog
+from detection_engine import (EAR_THRESHOLD, LEFT_EYE_INDICES, RIGHT_EYE_INDICES,
+                              STATUS_DROWSY, STATUS_FAULT, STATUS_MONITORING, STATUS_NO_FACE,
+                              DrowsinessStateMachine, create_face_mesh, landmarks_ear)
+
+# FaceMesh is built this many times, this far apart, before a stream gives up on it
+FACE_MESH_ATTEMPTS = 3
+FACE_MESH_RETRY_SECONDS = 2.0
+
+
+def parse_source(source):
+    # Camera indices are given as plain integers, anything else is a path or URL
+    source = str(source).strip()
+    return int(source) if source.isdigit() else source
+
+
+class DetectionSnapshot(namedtuple('DetectionSnapshot', [
+        'seq', 'captured_at', 'frame', 'status', 'alert_active', 'ear',
+        'closed_time', 'no_face_time', 'drowsy_alerts', 'face_missing_alerts', 'level'],
+        defaults=('full',))):
+    # Everything a reader needs about one processed frame. A new snapshot is
+    # built per frame and swapped in with a single attribute assignment, so
+    # readers never take a lock and never see fields from two frames. The
+    # frame is the annotated image and is not modified once published;
+    # level is the degradation level the frame was processed at.
+    __slots__ = ()
+
+    @property
+    def drowsy(self):
+        return self.alert_active and self.status == STATUS_DROWSY
+
+    @property
+    def face_missing(self):
+        return self.alert_active and self.status == STATUS_NO_FACE
+
+    @property
+    def fault(self):
+        return self.status == STATUS_FAULT
+
+    def status_dict(self):
+        return {
+            'status': self.status,
+            'alert_active': self.alert_active,
+            'drowsy': self.drowsy,
+            'face_missing': self.face_missing,
+            'fault': self.fault,
+            'level': self.level
+        }
+
+
+EMPTY_SNAPSHOT = DetectionSnapshot(0, None, None, STATUS_MONITORING, False, None, 0.0, 0.0, 0, 0)
+
+
+class StreamMetrics:
+    # Metric families shared by all streams, labelled by stream id
+    def __init__(self, registry):
+        self.stage_seconds = registry.histogram(
+            'dms_stage_seconds', 'Per-frame processing time of each pipeline stage', ['stream', 'stage'])
+        self.frames_total = registry.counter(
+            'dms_frames_total', 'Frames processed by the inference stage', ['stream'])
+        self.fps = registry.gauge('dms_fps', 'Achieved processing rate in frames per second', ['stream'])
+        self.camera_reconnects = registry.counter(
+            'dms_camera_reconnects_total', 'Camera read failures that triggered a reconnect', ['stream'])
+        self.jpeg_encode_seconds = registry.histogram(
+            'dms_jpeg_encode_seconds', 'JPEG encode time per broadcast frame', ['stream'])
+        self.alert_latency_seconds = registry.histogram(
+            'dms_alert_latency_seconds',
+            'Time from capturing the frame that crossed the alert threshold to play_alert() returning', ['stream'])
+        self.alerts_total = registry.counter('dms_alerts_total', 'Alerts raised', ['stream', 'kind'])
+        self.stream_clients = registry.gauge('dms_stream_clients', 'Connected /video_feed clients', ['stream'])
+        self.event_clients = registry.gauge('dms_event_clients', 'Connected /api/stream clients', ['stream'])
+        self.queue_depth = registry.gauge('dms_queue_depth', 'Items waiting in a pipeline queue', ['stream', 'queue'])
+        self.queue_drops = registry.counter(
+            'dms_queue_drops_total', 'Items dropped by a pipeline queue', ['stream', 'queue'])
+        self.perclos = registry.gauge('dms_perclos', 'Share of face frames with eyes closed over the history window', ['stream'])
+        self.blink_rate = registry.gauge('dms_blink_rate_per_minute', 'Blinks per minute over the history window', ['stream'])
+        self.time_to_first_frame = registry.gauge(
+            'dms_time_to_first_frame_seconds', 'Seconds from process start to the first processed frame', ['stream'])
+        self.incident_buffer_bytes = registry.gauge(
+            'dms_incident_buffer_bytes', 'Memory held by the pre-alert JPEG ring buffer', ['stream'])
+        self.degradation_level = registry.gauge(
+            'dms_degradation_level', 'Active step of the CPU-budget degradation ladder (0 = full processing)', ['stream'])
+
+
+class DetectionStream:
+    # Everything one camera needs: its own FaceMesh, tracker, scheduler,
+    # state machine, queues, broadcaster and event stream. Capture and
+    # annotation run on the stream's own threads; inference steps are run
+    # by a StreamWorkerPool shared by all streams.
+
+    def __init__(self, stream_id, source, stream_metrics, on_alert=None, on_clear=None,
+                 face_mesh_factory=create_face_mesh, roi_tracking=True, inference_size=320,
+                 adaptive_inference=True, max_fps=30, clip_writer=None, incident_buffer_bytes=16 * 1024 * 1024,
+                 started_at=None, frame_ring=None, frame_budget=None, degradation_levels=None, telemetry=None,
+                 on_fault=None):
+        self.id = stream_id
+        self.source = parse_source(source)
+        self.roi_tracking = roi_tracking
+        self.adaptive_inference = adaptive_inference
+        self.running = False
+        self.pool = None
+
+        # Seconds from started_at (process start) to each startup milestone
+        self.started_at = time.monotonic() if started_at is None else started_at
+        self.startup = {}
+        self.first_frame = threading.Event()
+
+        # Track the face region between frames and run FaceMesh on a padded
+        # crop; lower the inference rate while the eyes are clearly open.
+        # FaceMesh is built by warm_up() while the camera opens, and frames
+        # only go to inference once a detector is ready. on_fault is called
+        # if neither FaceMesh nor the Haar fallback can be started.
+        self.face_mesh_factory = face_mesh_factory
+        self.inference_size = inference_size
+        self.face_mesh = None
+        self.face_tracker = None
+        self.detector_ready = False
+        self.on_fault = on_fault
+        self.inference_scheduler = AdaptiveInferenceScheduler(EAR_THRESHOLD)
+        self.haar_eyes = None  # built when the ladder first reaches the Haar level
+
+        # Steps down to cheaper processing when frames take longer than
+        # frame_budget seconds, and back up when there is headroom again
+        self.load_controller = LoadController(frame_budget, degradation_levels)
+        self.annotation_time = 0.0  # overlay drawing time of the last frame
+        self.video_pacer = None
+        self.drowsiness = DrowsinessStateMachine(
+            on_alert=(lambda: on_alert(self)) if on_alert else None,
+            on_clear=(lambda: on_clear(self)) if on_clear else None)
+
+        label = str(stream_id)
+        self.capture_seconds = stream_metrics.stage_seconds.labels(label, 'capture')
+        self.inference_seconds = stream_metrics.stage_seconds.labels(label, 'inference')
+        self.annotation_seconds = stream_metrics.stage_seconds.labels(label, 'annotation')
+        self.frames_total = stream_metrics.frames_total.labels(label)
+        self.camera_reconnects = stream_metrics.camera_reconnects.labels(label)
+        self.alert_latency_seconds = stream_metrics.alert_latency_seconds.labels(label)
+        self.drowsy_alerts = stream_metrics.alerts_total.labels(label, 'drowsy')
+        self.face_missing_alerts = stream_metrics.alerts_total.labels(label, 'face_missing')
+        self.fps_meter = RateMeter()
+        stream_metrics.fps.labels(label).set_function(self.fps_meter.rate)
+        stream_metrics.time_to_first_frame.labels(label).set_function(lambda: self.startup.get('first_frame'))
+        stream_metrics.degradation_level.labels(label).set_function(lambda: self.load_controller.depth)
+
+        # Latest published state; replaced, never mutated, so reading
+        # stream.snapshot once gives a consistent view without locking
+        self.snapshot = EMPTY_SNAPSHOT
+        self.seq = 0
+        self.drowsy_alert_count = 0
+        self.face_missing_alert_count = 0
+
+        # Constant-memory EAR history with running PERCLOS and blink rate
+        self.history = EarHistory()
+        self.skipped_times = []  # capture times of frames the scheduler skipped
+        stream_metrics.perclos.labels(label).set_function(self.history.perclos)
+        # Every sample also goes to a memory-mapped log on disk; telemetry
+        # holds the TelemetryLog options, None turns it off
+        self.telemetry = None
+        if telemetry is not None:
+            try:
+                self.telemetry = TelemetryLog(stream_id=stream_id, **telemetry)
+            except OSError as e:
+                print(f"Stream {stream_id}: telemetry log disabled:", e)
+        self.wall_offset = time.time() - time.monotonic()  # monotonic -> wall clock
+        stream_metrics.blink_rate.labels(label).set_function(self.history.blink_rate)
+
+        # Pipeline stages: capture -> inference -> annotation
+        self.capture_queue = LatestQueue(maxsize=1)  # inference always takes the freshest frame
+        self.render_queue = LatestQueue(maxsize=2)
+        self.capture_pacer = DeadlinePacer(1.0 / max_fps)
+        self.pipeline_latency = None
+        for queue_name, stage_queue in (('capture', self.capture_queue), ('render', self.render_queue)):
+            stream_metrics.queue_depth.labels(label, queue_name).set_function(
+                lambda stage_queue=stage_queue: len(stage_queue.items))
+            stream_metrics.queue_drops.labels(label, queue_name).set_function(
+                lambda stage_queue=stage_queue: stage_queue.drops)
+
+        # Encodes each annotated frame once and fans it out to every viewer
+        self.broadcaster = FrameBroadcaster(encode_histogram=stream_metrics.jpeg_encode_seconds.labels(label))
+        stream_metrics.stream_clients.labels(label).set_function(lambda: self.broadcaster.clients)
+
+        # Pushes status transitions and throttled EAR to dashboards
+        self.status_events = StatusEventStream()
+        stream_metrics.event_clients.labels(label).set_function(lambda: self.status_events.clients)
+
+        # Set when detection runs in its own process: every annotated frame
+        # and its result also go to this SharedFrameRing for the web process
+        self.frame_ring = frame_ring
+
+        # Keeps the last seconds of encoded frames and saves a clip around each alert
+        self.recorder = None
+        if clip_writer is not None:
+            self.recorder = IncidentRecorder(stream_id, clip_writer, max_bytes=incident_buffer_bytes)
+            self.broadcaster.add_listener(self.recorder.add_frame)
+            stream_metrics.incident_buffer_bytes.labels(label).set_function(
+                lambda: self.recorder.buffer.memory_bytes)
+
+        # Set while the stream is queued for, or being processed by, a pool worker
+        self.scheduled = False
+        self.schedule_lock = threading.Lock()
+
+    def mark_startup(self, milestone):
+        if milestone not in self.startup:
+            self.startup[milestone] = round(time.monotonic() - self.started_at, 3)
+
+    def warm_up(self):
+        # Builds FaceMesh and runs it once on a blank frame, so loading the
+        # model and allocating its buffers overlap with opening the camera.
+        # A stream whose FaceMesh keeps failing runs on the Haar level only;
+        # with no detector at all it raises the fault alert.
+        face_mesh = None
+        for attempt in range(1, FACE_MESH_ATTEMPTS + 1):
+            try:
+                face_mesh = self.face_mesh_factory()
+                face_mesh.process(np.zeros((480, 640, 3), dtype=np.uint8))
+                break
+            except Exception as e:
+                print(f"Stream {self.id} FaceMesh initialization failed (attempt {attempt}):", e)
+                face_mesh = None
+                if attempt < FACE_MESH_ATTEMPTS:
+                    time.sleep(FACE_MESH_RETRY_SECONDS)
+
+        if face_mesh is not None:
+            self.face_mesh = face_mesh
+            self.face_tracker = FaceROITracker(face_mesh, inference_size=self.inference_size)
+        elif self.fall_back_to_haar():
+            print(f"Stream {self.id}: FaceMesh unavailable - detecting with the Haar eye fallback only")
+        else:
+            self.fail()
+            return
+        self.mark_startup('model_ready')
+        self.detector_ready = True
+        # Process whatever the camera delivered in the meantime
+        self.pool.notify(self)
+
+    def fall_back_to_haar(self):
+        # Drops every FaceMesh level from the ladder; False if no Haar level
+        # is left to run or its cascades can't be loaded
+        controller = self.load_controller
+        if not any(level['detector'] == 'haar' for level in controller.levels):
+            return False
+        for level in list(controller.levels):
+            if level['detector'] != 'haar':
+                controller.disable(level['name'])
+        return self.haar_detector() is not None
+
+    def fail(self):
+        # Nothing can be detected on this stream: publish STATUS_FAULT with
+        # the alert raised rather than keep showing "Monitoring Active"
+        print(f"Stream {self.id}: no eye detector could be started - raising the fault alert")
+        self.drowsiness.fault()
+        self.seq += 1
+        state = EMPTY_SNAPSHOT._replace(seq=self.seq, captured_at=time.monotonic(), status=self.drowsiness.status,
+                                        alert_active=True, level=self.load_controller.name)
+        self.snapshot = state
+        self.status_events.publish_status(state.status_dict())
+        if self.frame_ring is not None:
+            self.frame_ring.write(state, with_frame=False)
+        if self.on_fault:
+            self.on_fault(self)
+
+    def open_capture(self):
+        cap = cv2.VideoCapture(self.source)
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+        return cap
+
+    def capture_loop(self):
+        # Reads the camera at sensor rate. Recorded files have no sensor to
+        # pace them, so they are played back at their own frame rate.
+        cap = self.open_capture()
+        playback = None
+        if isinstance(self.source, str) and os.path.isfile(self.source):
+            playback = DeadlinePacer(1.0 / (cap.get(cv2.CAP_PROP_FPS) or 30.0))
+
+        while self.running:
+            start = time.perf_counter()
+            ret, captured = cap.read()
+            if not ret:
+                cap.release()
+                if playback is None:
+                    self.camera_reconnects.inc()
+                    print(f"Camera {self.id} error - reconnecting...")
+                    time.sleep(2)
+                cap = self.open_capture()  # files loop from the start
+                continue
+
+            self.capture_seconds.observe(time.perf_counter() - start)
+            self.mark_startup('first_capture')
+            # Frames arriving faster than max_fps are dropped here, so the
+            # camera keeps being drained without sleeping
+            if self.capture_pacer.due():
+                self.capture_queue.put((time.monotonic(), captured))
+                if self.detector_ready:
+                    self.pool.notify(self)
+            if playback is not None:
+                playback.wait()
+
+        cap.release()
+
+    def inference_step(self):
+        # Processes the newest captured frame, if any. Only ever run by one
+        # pool worker at a time for a given stream.
+        item = self.capture_queue.get(timeout=0)
+        if item is None:
+            return
+        captured_at, frame = item
+        start = time.perf_counter()
+        scheduler = self.inference_scheduler
+        level = self.load_controller.level
+        haar_eyes = self.haar_detector() if level['detector'] == 'haar' else None
+
+        left_eye = right_eye = None
+        left_ear = right_ear = avg_ear = None
+        if haar_eyes is not None:
+            # Cheapest level: eye boxes from the OpenCV cascades, every frame
+            landmarks = None
+            avg_ear, left_eye, right_eye = haar_eyes.process(frame)
+            ear_samples = scheduler.update(avg_ear, None) if self.adaptive_inference else [avg_ear]
+            sample_times = self.skipped_times + [captured_at]
+            self.skipped_times = []
+        elif not self.adaptive_inference or scheduler.should_infer(frame):
+            # Find face landmarks (normalized to the full frame) with MediaPipe
+            if not self.roi_tracking:
+                self.face_tracker.reset()
+            self.face_tracker.inference_size = level['inference_size'] or self.inference_size
+            landmarks = self.face_tracker.process(frame)
+
+            if landmarks is not None:
+                # Get eye landmarks
+                left_eye = landmarks[LEFT_EYE_INDICES]
+                right_eye = landmarks[RIGHT_EYE_INDICES]
+
+                # Calculate EAR for both eyes
+                left_ear, right_ear, avg_ear = landmarks_ear(landmarks, frame.shape[1] / frame.shape[0])
+
+            # One EAR sample per captured frame, including any skipped ones
+            ear_samples = scheduler.update(avg_ear, landmarks) if self.adaptive_inference else [avg_ear]
+            sample_times = self.skipped_times + [captured_at]
+            self.skipped_times = []
+        else:
+            # Skipped frame: show the last result, counters catch up on the next inference
+            landmarks = scheduler.last_landmarks
+            left_eye = landmarks[LEFT_EYE_INDICES]
+            right_eye = landmarks[RIGHT_EYE_INDICES]
+            avg_ear = scheduler.last_ear
+            ear_samples = []
+            sample_times = []
+            self.skipped_times.append(captured_at)
+
+        # The state machine is only touched by the one worker running this
+        # stream, so no lock is needed here
+        drowsiness = self.drowsiness
+        for sample_time, sample in zip(sample_times, ear_samples):
+            if drowsiness.update(sample, sample_time) and drowsiness.alert_active:
+                self.alert_latency_seconds.observe(time.monotonic() - captured_at)
+                if drowsiness.status == STATUS_DROWSY:
+                    self.drowsy_alerts.inc()
+                    self.drowsy_alert_count += 1
+                else:
+                    self.face_missing_alerts.inc()
+                    self.face_missing_alert_count += 1
+                if self.recorder is not None:
+                    self.recorder.trigger('drowsy' if drowsiness.status == STATUS_DROWSY else 'face_missing')
+            self.history.append(sample_time, sample)
+            if self.telemetry is not None:
+                # Per-eye values exist only for the frame that was inferred
+                measured = sample_time == captured_at
+                self.telemetry.append(
+                    sample_time + self.wall_offset,
+                    left_ear if measured and left_ear is not None else np.nan,
+                    right_ear if measured and right_ear is not None else np.nan,
+                    np.nan if sample is None else sample, drowsiness.closed_time,
+                    sample is not None, drowsiness.alert_active, drowsiness.status)
+
+        self.seq += 1
+        state = DetectionSnapshot(self.seq, captured_at, None, drowsiness.status, drowsiness.alert_active,
+                                  avg_ear, drowsiness.closed_time, drowsiness.no_face_time,
+                                  self.drowsy_alert_count, self.face_missing_alert_count, level['name'])
+
+        # Transitions go out to dashboards immediately
+        self.status_events.publish_status(state.status_dict())
+        self.status_events.publish_ear(avg_ear)
+
+        self.render_queue.put((state, frame, left_eye, right_eye))
+
+        elapsed = time.perf_counter() - start
+        self.inference_seconds.observe(elapsed)
+        if self.load_controller.observe(elapsed + self.annotation_time):
+            print(f"Stream {self.id}: processing level {level['name']} -> {self.load_controller.name}")
+        self.frames_total.inc()
+        self.fps_meter.tick()
+        if not self.first_frame.is_set():
+            self.mark_startup('first_frame')
+            self.first_frame.set()
+
+    def haar_detector(self):
+        # None (and the level dropped from the ladder) if the cascades can't be loaded
+        if self.haar_eyes is None:
+            try:
+                self.haar_eyes = HaarEyeDetector()
+            except Exception as e:
+                print(f"Stream {self.id}: Haar eye fallback unavailable:", e)
+                self.load_controller.disable(self.load_controller.name)
+                return None
+        return self.haar_eyes
+
+    def video_due(self, level):
+        # Whether this frame goes to viewers; lower levels cap the video rate
+        video_fps = level['video_fps']
+        if video_fps is None:
+            self.video_pacer = None
+            return True
+        if not video_fps:
+            return False
+        if self.video_pacer is None or self.video_pacer.period != 1.0 / video_fps:
+            self.video_pacer = DeadlinePacer(1.0 / video_fps)
+        return self.video_pacer.due()
+
+    def annotation_loop(self):
+        while self.running:
+            item = self.render_queue.get(timeout=1.0)
+            if item is None:
+                continue
+            state, annotated, left_eye, right_eye = item
+            level = self.load_controller.level
+
+            # The frame is owned by this stage now, so it can be drawn on in place
+            if level['overlay']:
+                start = time.perf_counter()
+                draw_overlay(annotated, left_eye, right_eye, state.ear, state.status, state.alert_active)
+                self.annotation_time = time.perf_counter() - start
+                self.annotation_seconds.observe(self.annotation_time)
+            else:
+                self.annotation_time = 0.0
+
+            # Publish by swapping the reference; the annotated frame is
+            # read-only from here on, for snapshot readers and the broadcaster
+            self.snapshot = state._replace(frame=annotated)
+            video = self.video_due(level)
+            if video:
+                self.broadcaster.publish(annotated)
+            if self.frame_ring is not None:
+                # Results go out with every frame, the image only with video frames
+                self.frame_ring.write(self.snapshot, self.fps(), with_frame=video)
+
+            # Smoothed capture-to-publish latency in seconds
+            latency = time.monotonic() - state.captured_at
+            self.pipeline_latency = latency if self.pipeline_latency is None else \
+                0.9 * self.pipeline_latency + 0.1 * latency
+
+    def fps(self):
+        return self.fps_meter.rate()
+
+    def start(self, pool):
+        self.pool = pool
+        self.running = True
+        for loop in (self.warm_up, self.capture_loop, self.annotation_loop):
+            threading.Thread(target=loop, daemon=True).start()
+
+    def stop(self):
+        self.running = False
+        self.broadcaster.stop()
+        self.status_events.stop()
+        if self.recorder is not None:
+            self.recorder.flush()
+        if self.telemetry is not None:
+            self.telemetry.close()
+
+    def pipeline_stats(self):
+        return {
+            'stream': self.id,
+            'source': str(self.source),
+            'capture_queue': self.capture_queue.stats(),
+            'render_queue': self.render_queue.stats(),
+            'face_tracker': None if self.face_tracker is None else self.face_tracker.stats(),
+            'inference_scheduler': self.inference_scheduler.stats(),
+            'load_controller': self.load_controller.stats(),
+            'history': self.history.stats(),
+            'telemetry': None if self.telemetry is None else self.telemetry.stats(),
+            'incident_recorder': None if self.recorder is None else self.recorder.stats(),
+            'startup_s': self.startup,
+            'fps': None if self.fps() is None else round(self.fps(), 1),
+            'latency_ms': None if self.pipeline_latency is None else round(self.pipeline_latency * 1000, 1)
+        }
+
+
+class StreamWorkerPool:
+    # Fixed set of inference workers shared by all streams. A stream is
+    # queued when its capture thread delivers a frame and is never processed
+    # by two workers at once, so each FaceMesh instance stays single-threaded.
+    # MediaPipe and OpenCV release the GIL while they work, so the workers
+    # run in parallel on separate cores.
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.ready = queue.Queue()
+        self.running = False
+
+    def start(self):
+        self.running = True
+        for i in range(self.workers):
+            threading.Thread(target=self._worker, name=f"inference-{i}", daemon=True).start()
+
+    def stop(self):
+        self.running = False
+        for _ in range(self.workers):
+            self.ready.put(None)
+
+    def notify(self, stream):
+        with stream.schedule_lock:
+            if stream.scheduled:
+                return
+            stream.scheduled = True
+        self.ready.put(stream)
+
+    def _worker(self):
+        while self.running:
+            stream = self.ready.get()
+            if stream is None:
+                break
+            try:
+                stream.inference_step()
+            except Exception as e:
+                print(f"Stream {stream.id} inference error:", e)
+            with stream.schedule_lock:
+                # A frame that arrived meanwhile gets the stream queued again
+                more = stream.capture_queue.items and stream.running
+                stream.scheduled = bool(more)
+            if more:
+                self.ready.put(stream)
@@ -0,0 +1,155 @@
+import threading
+
+import numpy as np
+
+from detection_engine import EAR_THRESHOLD
+
+
+class EarHistory:
+    # Fixed-size ring buffer of timestamped EAR samples and face-present
+    # flags. PERCLOS (share of face frames with the eyes closed) and the
+    # blink rate over the last `window` seconds are kept as running sums:
+    # each append adds the new sample and subtracts whatever fell out of the
+    # window, so the cost per frame is O(1) amortized and memory never grows.
+
+    def __init__(self, capacity=36000, window=60.0, ear_threshold=EAR_THRESHOLD, max_blink_duration=0.5):
+        self.capacity = capacity
+        self.window = window
+        self.ear_threshold = ear_threshold
+        self.max_blink_duration = max_blink_duration
+
+        self.timestamps = np.zeros(capacity, dtype=np.float64)
+        self.ears = np.full(capacity, np.nan, dtype=np.float32)
+        self.face_present = np.zeros(capacity, dtype=bool)
+        self.closed = np.zeros(capacity, dtype=bool)
+        self.blink_end = np.zeros(capacity, dtype=bool)
+
+        self.total = 0  # samples ever appended; the next slot is total % capacity
+        self.window_start = 0  # absolute index of the oldest sample inside the window
+        self.window_face = 0
+        self.window_closed = 0
+        self.window_blinks = 0
+        self.closed_since = None
+        self.lock = threading.Lock()
+
+    def _evict(self):
+        slot = self.window_start % self.capacity
+        self.window_face -= int(self.face_present[slot])
+        self.window_closed -= int(self.closed[slot])
+        self.window_blinks -= int(self.blink_end[slot])
+        self.window_start += 1
+
+    def append(self, timestamp, ear):
+        # ear is None when no face was found
+        face = ear is not None
+        closed = face and bool(ear < self.ear_threshold)
+
+        # A blink is a short closure that ends with the eyes open again
+        blink_end = False
+        if closed:
+            if self.closed_since is None:
+                self.closed_since = timestamp
+        elif face and self.closed_since is not None:
+            blink_end = timestamp - self.closed_since <= self.max_blink_duration
+            self.closed_since = None
+
+        with self.lock:
+            # The slot about to be overwritten may still be inside the window
+            if self.total - self.window_start >= self.capacity:
+                self._evict()
+
+            slot = self.total % self.capacity
+            self.timestamps[slot] = timestamp
+            self.ears[slot] = np.nan if ear is None else ear
+            self.face_present[slot] = face
+            self.closed[slot] = closed
+            self.blink_end[slot] = blink_end
+            self.total += 1
+
+            self.window_face += int(face)
+            self.window_closed += int(closed)
+            self.window_blinks += int(blink_end)
+
+            horizon = timestamp - self.window
+            while self.window_start < self.total and \
+                    self.timestamps[self.window_start % self.capacity] < horizon:
+                self._evict()
+
+    def perclos(self):
+        return self.window_closed / self.window_face if self.window_face else None
+
+    def blink_rate(self):
+        # Blinks per minute over the part of the window that has data
+        with self.lock:
+            if self.total - self.window_start < 2:
+                return None
+            first = self.timestamps[self.window_start % self.capacity]
+            last = self.timestamps[(self.total - 1) % self.capacity]
+            blinks = self.window_blinks
+        span = float(last - first)
+        return blinks * 60.0 / span if span > 0 else None
+
+    def _segments(self, count):
+        # Slot ranges covering the newest `count` samples, oldest first
+        start = (self.total - count) % self.capacity
+        end = start + count
+        if end <= self.capacity:
+            return [(start, end)]
+        return [(start, self.capacity), (0, end - self.capacity)]
+
+    def downsample(self, points=300, seconds=None, now=None):
+        # Every n-th sample of the newest `seconds` (default: the whole
+        # buffer), taken through strided views so only the returned points
+        # are copied. Times are relative to `now` (or the newest sample).
+        with self.lock:
+            available = min(self.total, self.capacity)
+            if not available:
+                return {'t': [], 'ear': [], 'face_present': []}
+
+            newest = self.timestamps[(self.total - 1) % self.capacity]
+            now = newest if now is None else now
+            count = available
+            if seconds is not None:
+                # Samples are in time order, so search the window boundary
+                horizon = now - seconds
+                lo, hi = 0, available
+                while lo < hi:
+                    mid = (lo + hi) // 2
+                    if self.timestamps[(self.total - available + mid) % self.capacity] < horizon:
+                        lo = mid + 1
+                    else:
+                        hi = mid
+                count = available - lo
+
+            step = max(1, -(-count // max(1, points)))
+            times, ears, faces = [], [], []
+            offset = 0
+            for start, end in self._segments(count):
+                # Keep the stride continuous across the wrap-around
+                first = start + (-offset) % step
+                times.append(self.timestamps[first:end:step] - now)
+                ears.append(self.ears[first:end:step])
+                faces.append(self.face_present[first:end:step])
+                offset += end - start
+            t = np.concatenate(times)
+            ear = np.concatenate(ears)
+            face = np.concatenate(faces)
+
+        return {
+            't': np.round(t, 3).tolist(),
+            'ear': [None if np.isnan(v) else round(float(v), 3) for v in ear],
+            'face_present': face.tolist()
+        }
+
+    def stats(self):
+        perclos = self.perclos()
+        blink_rate = self.blink_rate()
+        return {
+            'window_s': self.window,
+            'samples': min(self.total, self.capacity),
+            'window_samples': self.total - self.window_start,
+            'perclos': None if perclos is None else round(perclos, 4),
+            'blink_rate_per_min': None if blink_rate is None else round(blink_rate, 2),
+            'memory_bytes': int(self.timestamps.nbytes + self.ears.nbytes + self.face_present.nbytes +
+                                self.closed.nbytes + self.blink_end.nbytes)
+        }
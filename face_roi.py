@@ -0,0 +1,114 @@
+import time
+
+import cv2
+import numpy as np
+
+
+class FaceROITracker:
+    # Runs FaceMesh on a padded crop around the face found in the previous
+    # frame instead of the whole image, optionally downscaled so its longest
+    # side is at most inference_size pixels. Landmarks are returned as an
+    # (N, 2) array normalized to the full frame, exactly like a full-frame
+    # run. When the face is lost the next attempt is a full-frame detection.
+
+    def __init__(self, face_mesh, padding=0.3, inference_size=None, min_roi_size=48):
+        self.face_mesh = face_mesh
+        self.padding = padding
+        self.inference_size = inference_size
+        self.min_roi_size = min_roi_size
+        self.roi = None  # (x0, y0, x1, y1) in pixels, None = full frame
+
+        # Smoothed per-frame latency (seconds) for each mode, plus counts
+        self.latency = {'full': None, 'tracked': None}
+        self.frames = {'full': 0, 'tracked': 0}
+        self.lost = 0
+
+    def reset(self):
+        self.roi = None
+
+    def _run(self, frame, roi):
+        h, w = frame.shape[:2]
+        x0, y0, x1, y1 = roi if roi is not None else (0, 0, w, h)
+        crop = frame[y0:y1, x0:x1]
+
+        if self.inference_size:
+            longest = max(crop.shape[0], crop.shape[1])
+            if longest > self.inference_size:
+                scale = self.inference_size / float(longest)
+                crop = cv2.resize(crop, (max(1, int(crop.shape[1] * scale)),
+                                         max(1, int(crop.shape[0] * scale))),
+                                  interpolation=cv2.INTER_AREA)
+
+        rgb_crop = cv2.cvtColor(crop, cv2.COLOR_BGR2RGB)
+        results = self.face_mesh.process(rgb_crop)
+        if not results.multi_face_landmarks:
+            return None
+
+        landmarks = results.multi_face_landmarks[0].landmark
+        points = np.array([(p.x, p.y) for p in landmarks], dtype=np.float32)
+
+        # Map crop-normalized coordinates back to the full frame
+        points[:, 0] = (x0 + points[:, 0] * (x1 - x0)) / w
+        points[:, 1] = (y0 + points[:, 1] * (y1 - y0)) / h
+        return points
+
+    def _update_roi(self, points, w, h):
+        xs = points[:, 0] * w
+        ys = points[:, 1] * h
+        x0, x1 = xs.min(), xs.max()
+        y0, y1 = ys.min(), ys.max()
+
+        # Square, padded box so the face keeps its proportions after resizing
+        size = max(x1 - x0, y1 - y0) * (1.0 + 2 * self.padding)
+        cx, cy = (x0 + x1) / 2.0, (y0 + y1) / 2.0
+        x0 = int(max(0, cx - size / 2))
+        y0 = int(max(0, cy - size / 2))
+        x1 = int(min(w, cx + size / 2))
+        y1 = int(min(h, cy + size / 2))
+
+        if x1 - x0 < self.min_roi_size or y1 - y0 < self.min_roi_size:
+            self.roi = None
+        else:
+            self.roi = (x0, y0, x1, y1)
+
+    def _record(self, mode, elapsed):
+        previous = self.latency[mode]
+        self.latency[mode] = elapsed if previous is None else 0.95 * previous + 0.05 * elapsed
+        self.frames[mode] += 1
+
+    def process(self, frame):
+        # Returns full-frame normalized landmarks, or None if no face was found
+        start = time.perf_counter()
+        h, w = frame.shape[:2]
+
+        mode = 'tracked' if self.roi is not None else 'full'
+        points = self._run(frame, self.roi)
+        if points is None and self.roi is not None:
+            # Tracking lost - fall back to a full-frame detection right away
+            self.lost += 1
+            self.roi = None
+            mode = 'full'
+            points = self._run(frame, None)
+
+        if points is None:
+            self.roi = None
+        else:
+            self._update_roi(points, w, h)
+
+        self._record(mode, time.perf_counter() - start)
+        return points
+
+    def stats(self):
+        full = self.latency['full']
+        tracked = self.latency['tracked']
+        return {
+            'tracking': self.roi is not None,
+            'roi': self.roi,
+            'inference_size': self.inference_size,
+            'full_frames': self.frames['full'],
+            'tracked_frames': self.frames['tracked'],
+            'tracking_lost': self.lost,
+            'full_latency_ms': None if full is None else round(full * 1000, 2),
+            'tracked_latency_ms': None if tracked is None else round(tracked * 1000, 2),
+            'latency_reduction': None if not full or tracked is None else round(1 - tracked / full, 3)
+        }
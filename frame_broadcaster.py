@@ -0,0 +1,148 @@
+import threading
+import time
+
+import cv2
+
+# Multipart headers for the MJPEG stream served on /video_feed
+MJPEG_BOUNDARY = b'frame'
+MJPEG_PART_HEADER = b'--' + MJPEG_BOUNDARY + b'\r\nContent-Type: image/jpeg\r\n\r\n'
+
+
+class FrameBroadcaster:
+    # Encodes each published frame to JPEG exactly once on its own thread and
+    # hands the same bytes to every subscriber. The detection thread only swaps
+    # a reference in publish(), so it never waits on encoding or on viewers.
+
+    def __init__(self, jpeg_quality=80, encode_histogram=None):
+        self.encode_params = [int(cv2.IMWRITE_JPEG_QUALITY), jpeg_quality]
+        self.encode_histogram = encode_histogram
+
+        # Raw frames handed over by the detection thread
+        self._frame_ready = threading.Condition()
+        self._pending_frame = None
+        self._pending_seq = 0
+
+        # Latest encoded frame shared by all subscribers
+        self._jpeg_ready = threading.Condition()
+        self._part = None
+        self._jpeg_seq = 0
+
+        self.clients = 0
+        self.listeners = []  # called with the JPEG bytes of every encoded frame
+        self.wakers = []  # called after every encoded frame, e.g. to wake an event loop
+        self.running = True
+        self._thread = threading.Thread(target=self._encode_loop, daemon=True)
+        self._thread.start()
+
+    def publish(self, frame):
+        # The frame must not be modified by the caller after publishing
+        with self._frame_ready:
+            self._pending_frame = frame
+            self._pending_seq += 1
+            self._frame_ready.notify()
+
+    def add_listener(self, listener):
+        # Listeners keep frames encoded even with no viewers, and run on the
+        # encoder thread, so they must return quickly
+        self.listeners.append(listener)
+
+    def add_waker(self, waker):
+        # Unlike listeners, wakers do not keep frames encoded; they run on
+        # the encoder thread and must only schedule work elsewhere
+        self.wakers.append(waker)
+
+    def stop(self):
+        self.running = False
+        with self._frame_ready:
+            self._frame_ready.notify_all()
+        with self._jpeg_ready:
+            self._jpeg_ready.notify_all()
+
+    def _encode_loop(self):
+        encoded_seq = 0
+        while self.running:
+            with self._frame_ready:
+                while self.running and self._pending_seq == encoded_seq:
+                    self._frame_ready.wait()
+                frame = self._pending_frame
+                seq = self._pending_seq
+
+            # Nobody is watching - leave the frame pending until someone is
+            if frame is None or (self.clients == 0 and not self.listeners):
+                encoded_seq = seq
+                continue
+
+            start = time.perf_counter()
+            ret, buffer = cv2.imencode('.jpg', frame, self.encode_params)
+            if self.encode_histogram is not None:
+                self.encode_histogram.observe(time.perf_counter() - start)
+            encoded_seq = seq
+            if not ret:
+                continue
+
+            self.publish_jpeg(buffer.tobytes(), seq)
+
+    def publish_jpeg(self, jpeg, seq=None):
+        # Fans out an already-encoded frame, e.g. one encoded by a reader of
+        # another process's frames; publish() ends up here after encoding
+        part = MJPEG_PART_HEADER + jpeg + b'\r\n'
+        with self._jpeg_ready:
+            self._part = part
+            self._jpeg_seq = self._jpeg_seq + 1 if seq is None else seq
+            self._jpeg_ready.notify_all()
+        for listener in self.listeners:
+            listener(jpeg)
+        for waker in self.wakers:
+            waker()
+
+    def wait_for_frame(self, last_seq, timeout=1.0):
+        # Returns (seq, MJPEG part) of the newest encoded frame after last_seq.
+        # A slow client simply skips ahead to whatever is newest instead of
+        # queueing old frames.
+        with self._jpeg_ready:
+            deadline = time.monotonic() + timeout
+            while self.running and self._jpeg_seq == last_seq:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._jpeg_ready.wait(remaining)
+            return self._jpeg_seq, self._part
+
+    def latest_part(self):
+        with self._jpeg_ready:
+            return self._jpeg_seq, self._part
+
+    def join(self):
+        with self._frame_ready:
+            self.clients += 1
+            # Make sure a newly joined viewer gets the current frame encoded
+            if self._pending_frame is not None:
+                self._pending_seq += 1
+                self._frame_ready.notify()
+
+    def leave(self):
+        with self._frame_ready:
+            self.clients -= 1
+
+    def stream(self, max_fps=None):
+        # Generator for a multipart/x-mixed-replace response, optionally
+        # capped at max_fps frames per second for this client
+        interval = 1.0 / max_fps if max_fps else 0.0
+        self.join()
+        try:
+            seq = 0
+            next_send = 0.0
+            while self.running:
+                new_seq, part = self.wait_for_frame(seq)
+                if new_seq == seq or part is None:
+                    continue
+                delay = next_send - time.monotonic()
+                if delay > 0:
+                    # Skip the frames in between and send the newest one
+                    time.sleep(delay)
+                    new_seq, part = self.latest_part()
+                seq = new_seq
+                next_send = time.monotonic() + interval
+                yield part
+        finally:
+            self.leave()
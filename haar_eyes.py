@@ -0,0 +1,84 @@
+import os
+
+import cv2
+import numpy as np
+
+from detection_engine import EAR_THRESHOLD
+
+# EAR-like values reported to the state machine, since Haar boxes carry no
+# eyelid shape: open eyes sit well above the threshold, closed well below
+OPEN_EAR = EAR_THRESHOLD + 0.1
+CLOSED_EAR = EAR_THRESHOLD * 0.5
+
+
+class HaarEyeDetector:
+    # Classic OpenCV fallback for the cheapest degradation level. A face
+    # cascade runs on a small grayscale copy of the frame (only around the
+    # previous face once one was found), then an eye cascade looks in the
+    # upper half of the face. The eye cascade finds open eyes and rarely
+    # closed ones, so a face without eyes counts as closed. process()
+    # returns (ear, left_eye, right_eye) with the eye boxes' corners as
+    # normalized points, in the same form as the FaceMesh path; ear is None
+    # when there is no face.
+
+    def __init__(self, cascade_dir=None, detect_size=240, eye_face_width=120):
+        cascade_dir = cascade_dir or cv2.data.haarcascades
+        paths = [os.path.join(cascade_dir, name) for name in
+                 ('haarcascade_frontalface_default.xml', 'haarcascade_eye_tree_eyeglasses.xml')]
+        if not all(os.path.isfile(path) for path in paths):
+            raise RuntimeError(f"Haar cascades not found in {cascade_dir}")
+        self.face_cascade, self.eye_cascade = (cv2.CascadeClassifier(path) for path in paths)
+        if self.face_cascade.empty() or self.eye_cascade.empty():
+            raise RuntimeError(f"Haar cascades in {cascade_dir} could not be loaded")
+        self.detect_size = detect_size
+        self.eye_face_width = eye_face_width
+        self.face = None  # (x, y, w, h) in full-frame pixels
+
+    def _find_face(self, gray):
+        h, w = gray.shape
+        # Search a padded window around the last face first, the whole frame otherwise
+        windows = []
+        if self.face is not None:
+            fx, fy, fw, fh = self.face
+            x0, y0 = max(0, fx - fw // 2), max(0, fy - fh // 2)
+            windows.append((x0, y0, min(w, fx + fw + fw // 2), min(h, fy + fh + fh // 2)))
+        windows.append((0, 0, w, h))
+
+        for x0, y0, x1, y1 in windows:
+            region = gray[y0:y1, x0:x1]
+            scale = min(1.0, self.detect_size / float(max(region.shape)))
+            small = cv2.resize(region, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) \
+                if scale < 1.0 else region
+            faces = self.face_cascade.detectMultiScale(small, scaleFactor=1.2, minNeighbors=4, minSize=(30, 30))
+            if len(faces):
+                fx, fy, fw, fh = max(faces, key=lambda face: face[2] * face[3])
+                return (x0 + int(fx / scale), y0 + int(fy / scale), int(fw / scale), int(fh / scale))
+        return None
+
+    def process(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        self.face = self._find_face(gray)
+        if self.face is None:
+            return None, None, None
+
+        fx, fy, fw, fh = self.face
+        upper = gray[fy:fy + fh // 2, fx:fx + fw]
+        scale = min(1.0, self.eye_face_width / float(fw))
+        if scale < 1.0:
+            upper = cv2.resize(upper, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        upper = cv2.equalizeHist(upper)
+        eyes = self.eye_cascade.detectMultiScale(upper, scaleFactor=1.1, minNeighbors=3, minSize=(10, 10))
+
+        height, width = gray.shape
+        boxes = []
+        for ex, ey, ew, eh in sorted(eyes, key=lambda eye: eye[2] * eye[3], reverse=True)[:2]:
+            x0, y0 = fx + ex / scale, fy + ey / scale
+            x1, y1 = x0 + ew / scale, y0 + eh / scale
+            boxes.append(np.array([(x0, y0), (x1, y0), (x1, y1), (x0, y1)], dtype=np.float32)
+                         / np.array([width, height], dtype=np.float32))
+        # Left to right in the image
+        boxes.sort(key=lambda box: box[0, 0])
+        empty = np.zeros((0, 2), dtype=np.float32)
+        left_eye = boxes[0] if boxes else empty
+        right_eye = boxes[1] if len(boxes) > 1 else empty
+        return (OPEN_EAR if boxes else CLOSED_EAR), left_eye, right_eye
@@ -0,0 +1,219 @@
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+
+# Bookkeeping per buffered frame on top of the JPEG bytes object itself:
+# the (timestamp, jpeg) tuple, the float and the deque slot
+ENTRY_OVERHEAD = sys.getsizeof((0.0, b'')) + sys.getsizeof(0.0) + 8
+
+
+class JpegRingBuffer:
+    # The last few seconds of already-encoded frames, bounded by memory
+    # footprint rather than frame count: whenever a new frame pushes the
+    # total over max_bytes, the oldest frames are dropped.
+
+    def __init__(self, max_bytes=16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.frames = deque()
+        self.memory_bytes = 0
+        self.evicted = 0
+        self.lock = threading.Lock()
+
+    def append(self, timestamp, jpeg):
+        size = sys.getsizeof(jpeg) + ENTRY_OVERHEAD
+        with self.lock:
+            self.frames.append((timestamp, jpeg))
+            self.memory_bytes += size
+            while self.memory_bytes > self.max_bytes and len(self.frames) > 1:
+                _, old = self.frames.popleft()
+                self.memory_bytes -= sys.getsizeof(old) + ENTRY_OVERHEAD
+                self.evicted += 1
+
+    def since(self, timestamp):
+        # Frames newer than timestamp, oldest first; the bytes are shared, not copied
+        with self.lock:
+            return [entry for entry in self.frames if entry[0] >= timestamp]
+
+    def stats(self):
+        with self.lock:
+            frames = len(self.frames)
+            seconds = self.frames[-1][0] - self.frames[0][0] if frames > 1 else 0.0
+            return {
+                'frames': frames,
+                'seconds': round(seconds, 2),
+                'memory_bytes': self.memory_bytes,
+                'max_bytes': self.max_bytes,
+                'evicted': self.evicted
+            }
+
+
+class ClipWriter:
+    # Writes finished incidents on one background thread, shared by all
+    # streams. Disk I/O is bounded twice: writes are paced to
+    # max_write_rate bytes per second, and at most max_pending clips wait in
+    # memory; further clips are dropped (and counted) rather than blocking.
+
+    def __init__(self, output_dir='incidents', max_write_rate=4 * 1024 * 1024, max_pending=4):
+        self.output_dir = output_dir
+        self.max_write_rate = max_write_rate
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.clips_written = 0
+        self.clips_dropped = 0
+        self.bytes_written = 0
+        self.last_clip = None
+        self.running = True
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+    def submit(self, incident):
+        try:
+            self.pending.put_nowait(incident)
+            return True
+        except queue.Full:
+            self.clips_dropped += 1
+            print(f"Incident clip dropped, writer is {self.pending.maxsize} clips behind")
+            return False
+
+    def stop(self, timeout=5.0):
+        # Lets queued clips finish, up to timeout
+        self.running = False
+        self.pending.put(None)
+        self._thread.join(timeout)
+
+    def _write_loop(self):
+        while True:
+            incident = self.pending.get()
+            if incident is None:
+                break
+            try:
+                self.last_clip = self.write_clip(incident)
+                self.clips_written += 1
+            except OSError as e:
+                print("Error writing incident clip:", e)
+
+    def write_clip(self, incident):
+        # Motion JPEG: the frames back to back, exactly as encoded for the
+        # live view (plays with e.g. `ffplay -f mjpeg clip.mjpeg`), plus a
+        # JSON sidecar with per-frame times. Written under a temporary name
+        # so a clip on disk is always complete.
+        os.makedirs(self.output_dir, exist_ok=True)
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(incident['wall_time']))
+        name = f"incident-{incident['stream']}-{stamp}-{incident['reason']}"
+        path = os.path.join(self.output_dir, name + '.mjpeg')
+        frames = incident['frames']
+
+        start = time.monotonic()
+        written = 0
+        with open(path + '.part', 'wb') as f:
+            for _, jpeg in frames:
+                f.write(jpeg)
+                written += len(jpeg)
+                # Stay under max_write_rate on average
+                ahead = start + written / self.max_write_rate - time.monotonic()
+                if ahead > 0:
+                    time.sleep(ahead)
+        os.replace(path + '.part', path)
+        self.bytes_written += written
+
+        alert_at = incident['alert_at']
+        meta = {
+            'stream': incident['stream'],
+            'reason': incident['reason'],
+            'alert_time': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(incident['wall_time'])),
+            'frames': len(frames),
+            'bytes': written,
+            'pre_roll_s': round(alert_at - frames[0][0], 3) if frames else 0.0,
+            'post_roll_s': round(frames[-1][0] - alert_at, 3) if frames else 0.0,
+            'frame_times_s': [round(t - alert_at, 3) for t, _ in frames]
+        }
+        with open(os.path.join(self.output_dir, name + '.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+        return path
+
+    def stats(self):
+        return {
+            'output_dir': self.output_dir,
+            'pending': self.pending.qsize(),
+            'clips_written': self.clips_written,
+            'clips_dropped': self.clips_dropped,
+            'bytes_written': self.bytes_written,
+            'last_clip': self.last_clip
+        }
+
+
+class IncidentRecorder:
+    # Per-stream pre-alert recorder. add_frame() is fed the JPEG bytes the
+    # broadcaster already encoded, so recording costs no extra encoding.
+    # trigger() only marks the alert time; the pre-roll is taken from the
+    # ring buffer, post-roll frames are collected as they arrive, and the
+    # finished incident goes to the ClipWriter. Neither call touches disk.
+
+    def __init__(self, stream_id, writer, max_bytes=16 * 1024 * 1024, pre_seconds=10.0, post_seconds=5.0):
+        self.stream_id = stream_id
+        self.writer = writer
+        self.pre_seconds = pre_seconds
+        self.post_seconds = post_seconds
+        self.buffer = JpegRingBuffer(max_bytes)
+        self.active = None  # incident currently collecting post-roll
+        self.active_bytes = 0
+        self.incidents = 0
+        self.lock = threading.Lock()
+
+    def trigger(self, reason, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            if self.active is not None:
+                # A new alert during the post-roll extends the same clip
+                self.active['deadline'] = max(self.active['deadline'], now + self.post_seconds)
+                return
+            frames = self.buffer.since(now - self.pre_seconds)
+            self.active = {
+                'stream': self.stream_id,
+                'reason': reason,
+                'alert_at': now,
+                'wall_time': time.time(),
+                'deadline': now + self.post_seconds,
+                'frames': frames
+            }
+            self.active_bytes = sum(len(jpeg) for _, jpeg in frames)
+            self.incidents += 1
+
+    def add_frame(self, jpeg, now=None):
+        now = time.monotonic() if now is None else now
+        self.buffer.append(now, jpeg)
+        if self.active is None:
+            return
+        with self.lock:
+            incident = self.active
+            if incident is None:
+                return
+            incident['frames'].append((now, jpeg))
+            self.active_bytes += len(jpeg)
+            # Repeated alerts cannot grow one clip past the buffer budget
+            if now < incident['deadline'] and self.active_bytes < self.buffer.max_bytes:
+                return
+            self.active = None
+            self.active_bytes = 0
+        self.writer.submit(incident)
+
+    def flush(self):
+        # Hands over a clip that is still collecting post-roll, e.g. on shutdown
+        with self.lock:
+            incident, self.active = self.active, None
+            self.active_bytes = 0
+        if incident is not None and incident['frames']:
+            self.writer.submit(incident)
+
+    def stats(self):
+        stats = self.buffer.stats()
+        stats.update({
+            'pre_roll_s': self.pre_seconds,
+            'post_roll_s': self.post_seconds,
+            'incidents': self.incidents,
+            'recording': self.active is not None
+        })
+        return stats
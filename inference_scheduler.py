@@ -0,0 +1,103 @@
+import cv2
+import numpy as np
+
+
+class AdaptiveInferenceScheduler:
+    # Decides per frame whether FaceMesh has to run. While the eyes are
+    # clearly open and the head is still, inference drops to one frame in
+    # (max_skip + 1); as soon as EAR nears the threshold, the face is lost or
+    # the image moves, every frame is inferred again.
+    #
+    # Skipped frames are not fed to the drowsiness state machine right away.
+    # When the next inference arrives, update() returns one EAR per skipped
+    # frame, linearly interpolated between the two inferred values, followed
+    # by the new value. The stream replays them with each frame's capture
+    # time, and the state machine credits the time up to the next sample to
+    # each one's state. A closure that starts inside a skipped run is
+    # therefore timed from the frame it most likely began, not from the
+    # next inference, and a skipped run never counts as one long interval.
+
+    def __init__(self, ear_threshold, near_margin=0.04, far_margin=0.08,
+                 max_skip=3, motion_threshold=6.0, landmark_motion=0.01):
+        self.ear_threshold = ear_threshold
+        self.near_margin = near_margin
+        self.far_margin = far_margin
+        self.max_skip = max_skip
+        self.motion_threshold = motion_threshold  # mean abs pixel change on the thumbnail
+        self.landmark_motion = landmark_motion  # normalized face-centre shift between inferences
+
+        self.last_ear = None
+        self.last_landmarks = None
+        self.last_centre = None
+        self.head_moving = True
+        self.reference_thumb = None
+        self.skipped = 0  # frames skipped since the last inference
+
+        self.inferred_frames = 0
+        self.skipped_frames = 0
+
+    def _thumbnail(self, frame):
+        thumb = cv2.resize(frame, (32, 24), interpolation=cv2.INTER_AREA)
+        return thumb.astype(np.int16)
+
+    def _allowed_skip(self):
+        if self.last_ear is None or self.head_moving:
+            return 0
+        margin = self.last_ear - self.ear_threshold
+        if margin <= self.near_margin:
+            return 0
+        if margin < self.far_margin:
+            return 1
+        return self.max_skip
+
+    def should_infer(self, frame):
+        thumb = self._thumbnail(frame)
+        if self.skipped >= self._allowed_skip():
+            self.reference_thumb = thumb
+            return True
+
+        # Anything moving in the image (head turn, hand, lighting) cancels the skip
+        if self.reference_thumb is None or \
+                np.abs(thumb - self.reference_thumb).mean() > self.motion_threshold:
+            self.reference_thumb = thumb
+            return True
+
+        self.skipped += 1
+        self.skipped_frames += 1
+        return False
+
+    def update(self, ear, landmarks):
+        # Called after an inference; ear is None when no face was found.
+        # Returns the EAR samples (one per frame) to feed the state machine.
+        samples = []
+        if self.skipped:
+            if self.last_ear is not None and ear is not None:
+                step = (ear - self.last_ear) / (self.skipped + 1)
+                samples = [self.last_ear + step * (i + 1) for i in range(self.skipped)]
+            else:
+                samples = [self.last_ear] * self.skipped
+        samples.append(ear)
+
+        if landmarks is not None:
+            centre = landmarks.mean(axis=0)
+            self.head_moving = self.last_centre is None or \
+                float(np.abs(centre - self.last_centre).max()) > self.landmark_motion
+            self.last_centre = centre
+        else:
+            self.last_centre = None
+            self.head_moving = True
+
+        self.last_ear = ear
+        self.last_landmarks = landmarks
+        self.skipped = 0
+        self.inferred_frames += 1
+        return samples
+
+    def stats(self):
+        total = self.inferred_frames + self.skipped_frames
+        return {
+            'inferred_frames': self.inferred_frames,
+            'skipped_frames': self.skipped_frames,
+            'inference_ratio': round(self.inferred_frames / total, 3) if total else None,
+            'current_skip': self._allowed_skip()
+        }
@@ -0,0 +1,128 @@
+import time
+from collections import deque
+
+# Degradation ladder, cheapest last. Every level keeps the drowsiness state
+# machine fed; they differ in how much work each frame gets:
+#   inference_size  longest side of the FaceMesh input (None = the stream's own)
+#   overlay         draw landmarks and status on the video frame
+#   video_fps       cap on frames handed to viewers for JPEG encoding (None = every frame, 0 = none)
+#   detector        'face_mesh', or 'haar' for the OpenCV eye-region fallback
+DEFAULT_LEVELS = [
+    {'name': 'full', 'inference_size': None, 'overlay': True, 'video_fps': None, 'detector': 'face_mesh'},
+    {'name': 'low_res', 'inference_size': 192, 'overlay': True, 'video_fps': None, 'detector': 'face_mesh'},
+    {'name': 'no_overlay', 'inference_size': 160, 'overlay': False, 'video_fps': 5, 'detector': 'face_mesh'},
+    {'name': 'haar_eyes', 'inference_size': 160, 'overlay': False, 'video_fps': 2, 'detector': 'haar'}
+]
+
+
+class LoadController:
+    # Watches the per-frame processing time against a budget (usually the
+    # frame interval) and moves one level down the ladder when the smoothed
+    # time stays over it, or one level back up when it stays well under it.
+    # A level that had to be left again soon after stepping up to it is only
+    # retried after a back-off that doubles every time, so a machine that
+    # can't sustain it doesn't bounce between two levels. Without a budget
+    # the first level is kept.
+
+    def __init__(self, budget=None, levels=None, headroom=0.6, down_after=2.0, up_after=5.0,
+                 max_backoff=300.0, smoothing=0.1):
+        self.budget = budget  # seconds per frame, None = never degrade
+        self.levels = list(levels or DEFAULT_LEVELS)
+        self.ladder = [level['name'] for level in self.levels]  # as configured, before any disable()
+        self.headroom = headroom  # step up once frames take less than this share of the budget
+        self.down_after = down_after
+        self.up_after = up_after
+        self.max_backoff = max_backoff
+        self.smoothing = smoothing
+
+        self.index = 0
+        self.frame_time = None  # smoothed seconds per frame at the current level
+        self.changed_at = time.monotonic()
+        self.over_since = None
+        self.under_since = None
+        self.retry_at = [0.0] * len(self.levels)
+        self.backoff = [up_after] * len(self.levels)
+        self.changes = 0
+        self.history = deque(maxlen=20)  # (time, from, to, smoothed ms)
+
+    @property
+    def level(self):
+        return self.levels[self.index]
+
+    @property
+    def name(self):
+        return self.levels[self.index]['name']
+
+    @property
+    def depth(self):
+        # Position of the current level in the configured ladder (0 = full
+        # processing), which disabled levels don't shift
+        return self.ladder.index(self.name)
+
+    def disable(self, name):
+        # Drops a level that can't run here, e.g. the Haar fallback without
+        # its cascade files; the current level moves to a neighbour if needed
+        names = [level['name'] for level in self.levels]
+        if name not in names or len(self.levels) == 1:
+            return
+        position = names.index(name)
+        del self.levels[position]
+        del self.retry_at[position]
+        del self.backoff[position]
+        if self.index >= len(self.levels) or self.index > position:
+            self.index = max(0, self.index - 1)
+
+    def observe(self, seconds, now=None):
+        # Called once per processed frame; returns True when the level changed
+        if self.budget is None:
+            return False
+        now = time.monotonic() if now is None else now
+        self.frame_time = seconds if self.frame_time is None else \
+            self.frame_time + self.smoothing * (seconds - self.frame_time)
+
+        if self.frame_time > self.budget:
+            self.under_since = None
+            if self.over_since is None:
+                self.over_since = now
+            if now - self.over_since >= self.down_after and self.index < len(self.levels) - 1:
+                # Leaving a level soon after reaching it: wait longer before the next try
+                if now - self.changed_at < self.up_after * 2:
+                    self.backoff[self.index] = min(self.backoff[self.index] * 2, self.max_backoff)
+                else:
+                    self.backoff[self.index] = self.up_after
+                self.retry_at[self.index] = now + self.backoff[self.index]
+                self._change(self.index + 1, now)
+                return True
+        elif self.frame_time < self.budget * self.headroom:
+            self.over_since = None
+            if self.under_since is None:
+                self.under_since = now
+            if now - self.under_since >= self.up_after and self.index > 0 \
+                    and now >= self.retry_at[self.index - 1]:
+                self._change(self.index - 1, now)
+                return True
+        else:
+            self.over_since = self.under_since = None
+        return False
+
+    def _change(self, index, now):
+        self.history.append((round(now, 3), self.name, self.levels[index]['name'],
+                             round(self.frame_time * 1000, 2)))
+        self.index = index
+        self.changes += 1
+        self.changed_at = now
+        # The new level's cost is measured from scratch
+        self.frame_time = None
+        self.over_since = self.under_since = None
+
+    def stats(self):
+        return {
+            'level': self.name,
+            'index': self.index,
+            'levels': [level['name'] for level in self.levels],
+            'budget_ms': None if self.budget is None else round(self.budget * 1000, 2),
+            'frame_ms': None if self.frame_time is None else round(self.frame_time * 1000, 2),
+            'changes': self.changes,
+            'recent_changes': [
+                {'at': at, 'from': old, 'to': new, 'frame_ms': ms} for at, old, new, ms in self.history]
+        }
@@ -0,0 +1,292 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Defaults used when no fix is available yet
+UNKNOWN_LOCATION = {
+    'latitude': 0,
+    'longitude': 0,
+    'address': "Acquiring...",
+    'ip_address': "127.0.0.1",
+    'speed': 0
+}
+
+KNOTS_TO_KMH = 1.852
+
+# Refresh periods in seconds. The public IP-geolocation API is only asked
+# every few minutes: a vehicle's public IP rarely changes its answer.
+LOCATION_INTERVAL = 5.0
+IP_LOCATION_INTERVAL = 300.0
+
+
+class IPLocationSource:
+    # Coarse location from the public IP address (needs network access)
+    def read(self):
+        import geocoder
+        g = geocoder.ip('me')
+        if not g.latlng:
+            return None
+        lat, lng = g.latlng
+        return {'latitude': lat, 'longitude': lng, 'ip_address': g.ip, 'speed': 0}
+
+
+class StaticLocationSource:
+    # Fixed position, useful for offline runs and benchmarks
+    def __init__(self, latitude, longitude, speed=0, ip_address="127.0.0.1"):
+        self.fix = {'latitude': latitude, 'longitude': longitude,
+                    'ip_address': ip_address, 'speed': speed}
+
+    def read(self):
+        return dict(self.fix)
+
+
+def _nmea_checksum_ok(sentence):
+    if '*' not in sentence:
+        return True
+    body, checksum = sentence[1:].split('*', 1)
+    value = 0
+    for ch in body:
+        value ^= ord(ch)
+    try:
+        return value == int(checksum[:2], 16)
+    except ValueError:
+        return False
+
+
+def _nmea_coordinate(value, hemisphere):
+    # NMEA encodes coordinates as (d)ddmm.mmmm
+    if not value:
+        return None
+    dot = value.index('.') if '.' in value else len(value)
+    degrees = float(value[:dot - 2])
+    minutes = float(value[dot - 2:])
+    coordinate = degrees + minutes / 60.0
+    if hemisphere in ('S', 'W'):
+        coordinate = -coordinate
+    return coordinate
+
+
+def parse_nmea(sentence):
+    # Returns a fix dict for valid RMC/GGA sentences, None otherwise
+    sentence = sentence.strip()
+    if not sentence.startswith('$') or not _nmea_checksum_ok(sentence):
+        return None
+    fields = sentence.split('*', 1)[0].split(',')
+    kind = fields[0][3:]
+    try:
+        if kind == 'RMC' and len(fields) > 7 and fields[2] == 'A':
+            speed = float(fields[7]) * KNOTS_TO_KMH if fields[7] else 0
+            return {'latitude': _nmea_coordinate(fields[3], fields[4]),
+                    'longitude': _nmea_coordinate(fields[5], fields[6]),
+                    'speed': speed}
+        if kind == 'GGA' and len(fields) > 6 and fields[6] not in ('', '0'):
+            return {'latitude': _nmea_coordinate(fields[2], fields[3]),
+                    'longitude': _nmea_coordinate(fields[4], fields[5])}
+    except ValueError:
+        return None
+    return None
+
+
+class NMEAReplaySource:
+    # Replays a recorded NMEA log one fix per read(), looping at the end
+    def __init__(self, path, loop=True):
+        self.fixes = []
+        speed = 0
+        with open(path, 'r', errors='ignore') as f:
+            for line in f:
+                fix = parse_nmea(line)
+                if not fix or fix['latitude'] is None or fix['longitude'] is None:
+                    continue
+                # GGA carries no speed, keep the last one reported by RMC
+                speed = fix.get('speed', speed)
+                fix['speed'] = speed
+                fix['ip_address'] = "127.0.0.1"
+                self.fixes.append(fix)
+        self.loop = loop
+        self.position = 0
+
+    def read(self):
+        if not self.fixes:
+            return None
+        if self.position >= len(self.fixes):
+            if not self.loop:
+                return dict(self.fixes[-1])
+            self.position = 0
+        fix = self.fixes[self.position]
+        self.position += 1
+        return dict(fix)
+
+
+def make_location_source(spec):
+    # "ip", "static:<lat>,<lng>" or "nmea:<path>"
+    kind, _, arg = spec.partition(':')
+    if kind == 'static':
+        lat, lng = (float(v) for v in arg.split(','))
+        return StaticLocationSource(lat, lng)
+    if kind == 'nmea':
+        return NMEAReplaySource(arg)
+    return IPLocationSource()
+
+
+class NominatimReverseGeocoder:
+    def __init__(self, user_agent="dms", timeout=10):
+        self.user_agent = user_agent
+        self.timeout = timeout
+        self.geolocator = None
+
+    def reverse(self, lat, lng):
+        if self.geolocator is None:
+            from geopy.geocoders import Nominatim
+            self.geolocator = Nominatim(user_agent=self.user_agent)
+        location = self.geolocator.reverse((lat, lng), timeout=self.timeout)
+        return location.address if location else "Unknown"
+
+
+class CoordinateReverseGeocoder:
+    # Offline stand-in that formats the coordinates instead of an address
+    def reverse(self, lat, lng):
+        return f"{lat:.5f}, {lng:.5f}"
+
+
+class AddressCache:
+    # LRU cache of reverse-geocoded addresses keyed by rounded coordinates
+    def __init__(self, max_entries=256, ttl=600, precision=3):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.precision = precision
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, lat, lng):
+        return (round(lat, self.precision), round(lng, self.precision))
+
+    def get(self, lat, lng, now=None):
+        now = time.monotonic() if now is None else now
+        key = self.key(lat, lng)
+        entry = self.entries.get(key)
+        if entry is None or now - entry[1] > self.ttl:
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, lat, lng, address, now=None):
+        now = time.monotonic() if now is None else now
+        key = self.key(lat, lng)
+        self.entries[key] = (address, now)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+class LocationService:
+    # Refreshes the position in the background and serves the last known
+    # value instantly, so HTTP handlers never wait on the network.
+    def __init__(self, source, reverse_geocoder=None, interval=5.0, cache=None):
+        self.source = source
+        self.reverse_geocoder = reverse_geocoder
+        self.interval = interval
+        self.cache = cache if cache is not None else AddressCache()
+        self.current = dict(UNKNOWN_LOCATION)
+        self.updated_at = None  # wall-clock time of the last fix, None before the first
+        self.on_update = None  # called with each new location
+        self.running = False
+        self._thread = None
+
+    def get(self):
+        # Reference read of an immutable-by-convention dict, no locking needed
+        return self.current
+
+    def refresh(self):
+        fix = self.source.read()
+        if not fix:
+            return self.current
+
+        lat, lng = fix['latitude'], fix['longitude']
+        address = self.cache.get(lat, lng)
+        if address is None:
+            address = "Unknown"
+            if self.reverse_geocoder is not None:
+                try:
+                    address = self.reverse_geocoder.reverse(lat, lng)
+                    self.cache.put(lat, lng, address)
+                except Exception as e:
+                    print("Reverse geocoding error:", e)
+                    address = self.current.get('address', "Unknown")
+
+        location = dict(UNKNOWN_LOCATION)
+        location.update(fix)
+        location['address'] = address
+        changed = location != self.current
+        self.current = location
+        self.updated_at = time.time()
+        if changed and self.on_update is not None:
+            self.on_update(location)
+        return location
+
+    def _run(self):
+        next_refresh = time.monotonic()
+        while self.running:
+            try:
+                self.refresh()
+            except Exception as e:
+                print("Location error:", e)
+            next_refresh += self.interval
+            time.sleep(max(0, next_refresh - time.monotonic()))
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.running = False
+
+
+def create_location_service(spec=None, interval=None):
+    spec = spec or os.environ.get('DMS_LOCATION_SOURCE', 'ip')
+    default_interval = IP_LOCATION_INTERVAL if spec.startswith('ip') else LOCATION_INTERVAL
+    interval = interval or float(os.environ.get('DMS_LOCATION_INTERVAL', default_interval))
+    source = make_location_source(spec)
+    if spec.startswith('ip'):
+        reverse_geocoder = NominatimReverseGeocoder()
+    else:
+        reverse_geocoder = CoordinateReverseGeocoder()
+    return LocationService(source, reverse_geocoder, interval=interval)
+
+
+if __name__ == '__main__':
+    # Offline benchmark: cached reads vs. background refreshes
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the location service offline")
+    parser.add_argument('--source', default='static:12.9716,77.5946',
+                        help="ip, static:<lat>,<lng> or nmea:<path>")
+    parser.add_argument('--reads', type=int, default=100000)
+    parser.add_argument('--refreshes', type=int, default=1000)
+    args = parser.parse_args()
+
+    service = LocationService(make_location_source(args.source), CoordinateReverseGeocoder())
+
+    start = time.perf_counter()
+    for _ in range(args.refreshes):
+        service.refresh()
+    refresh_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(args.reads):
+        service.get()
+    read_time = time.perf_counter() - start
+
+    print(f"refresh: {refresh_time / args.refreshes * 1e6:.2f} us/call")
+    print(f"get:     {read_time / args.reads * 1e9:.1f} ns/call")
+    print(f"address cache: {service.cache.hits} hits, {service.cache.misses} misses, "
+          f"{len(service.cache.entries)} entries")
+    print("last:", service.get())
@@ -0,0 +1,28 @@
+import cv2
+
+
+def draw_overlay(frame, left_eye, right_eye, avg_ear, status, alert_active):
+    # Draws the dashboard overlay in place. Eye points are normalized to the
+    # frame; left_eye is None when no face was found.
+    if left_eye is not None:
+        # Draw eye landmarks and EAR value
+        for eye in [left_eye, right_eye]:
+            for point in eye:
+                x = int(point[0] * frame.shape[1])
+                y = int(point[1] * frame.shape[0])
+                cv2.circle(frame, (x, y), 1, (0, 255, 0), -1)
+
+        cv2.putText(frame, f"EAR: {avg_ear:.2f}", (10, 30),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+
+    # Add status text to frame
+    color = (0, 0, 255) if alert_active else (0, 255, 0)
+    cv2.putText(frame, status, (10, 60),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
+
+    # Add red border if alert is active
+    if alert_active:
+        cv2.rectangle(frame, (0, 0),
+                      (frame.shape[1]-1, frame.shape[0]-1),
+                      (0, 0, 255), 10)
+    return frame
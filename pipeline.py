@@ -0,0 +1,73 @@
+import threading
+import time
+from collections import deque
+
+
+class LatestQueue:
+    # Small bounded queue between pipeline stages. When full, the oldest item
+    # is dropped so the consumer always works on the freshest data and the
+    # producer never blocks.
+    def __init__(self, maxsize=1):
+        self.maxsize = maxsize
+        self.items = deque()
+        self.cond = threading.Condition()
+        self.puts = 0
+        self.drops = 0
+
+    def put(self, item):
+        with self.cond:
+            if len(self.items) >= self.maxsize:
+                self.items.popleft()
+                self.drops += 1
+            self.items.append(item)
+            self.puts += 1
+            self.cond.notify()
+
+    def get(self, timeout=None):
+        # Returns None if nothing arrived within the timeout
+        with self.cond:
+            if not self.items:
+                self.cond.wait(timeout)
+            if not self.items:
+                return None
+            return self.items.popleft()
+
+    def stats(self):
+        with self.cond:
+            return {
+                'depth': len(self.items),
+                'maxsize': self.maxsize,
+                'puts': self.puts,
+                'drops': self.drops
+            }
+
+
+class DeadlinePacer:
+    # Paces a loop to a fixed period by sleeping only for whatever is left
+    # until the next deadline. A loop that is already late does not sleep and
+    # does not try to catch up with a burst afterwards. due() is the
+    # non-sleeping variant for loops that must keep running, e.g. to drain a
+    # camera faster than frames are wanted.
+    def __init__(self, period):
+        self.period = period
+        self.deadline = time.monotonic() + period
+
+    def wait(self):
+        now = time.monotonic()
+        if now < self.deadline:
+            time.sleep(self.deadline - now)
+            self.deadline += self.period
+        else:
+            self.deadline = now + self.period
+
+    def due(self):
+        # Half a period of tolerance so a camera running at exactly the
+        # target rate is not decimated by jitter
+        now = time.monotonic()
+        if now < self.deadline - self.period / 2:
+            return False
+        if now > self.deadline + self.period:
+            self.deadline = now + self.period
+        else:
+            self.deadline += self.period
+        return True
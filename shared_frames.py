@@ -0,0 +1,160 @@
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+from detection_engine import STATUS_DROWSY, STATUS_FAULT, STATUS_MONITORING, STATUS_NO_FACE, STATUS_SEARCHING
+
+# Status strings travel through shared memory as small integers
+STATUSES = [STATUS_MONITORING, STATUS_SEARCHING, STATUS_DROWSY, STATUS_NO_FACE, STATUS_FAULT]
+
+HEADER_DTYPE = np.dtype([
+    ('latest', '<u8'),  # sequence number of the newest complete slot
+    ('slots', '<u4'),
+    ('max_height', '<u4'),
+    ('max_width', '<u4')
+])
+HEADER_SIZE = 64
+
+# One result record per slot. version is a seqlock: 2 * seq - 1 while the
+# slot is being written and 2 * seq once it is complete.
+RECORD_DTYPE = np.dtype([
+    ('version', '<u8'),
+    ('seq', '<u8'),
+    ('captured_at', '<f8'),  # time.monotonic() in the detection process
+    ('ear', '<f8'),  # NaN when no face was found
+    ('closed_time', '<f8'),
+    ('no_face_time', '<f8'),
+    ('fps', '<f8'),
+    ('status', '<i4'),
+    ('alert_active', '<i4'),
+    ('drowsy_alerts', '<u8'),
+    ('face_missing_alerts', '<u8'),
+    ('height', '<u4'),  # 0 when the slot carries results only
+    ('width', '<u4'),
+    ('level', 'S16')  # degradation level name
+])
+
+
+def _attach(name):
+    # The creating process owns the block and unlinks it. A spawned child
+    # shares its parent's resource tracker, so on Python < 3.13 (no track
+    # argument) registering the block again there is harmless.
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+class SharedFrameRing:
+    # Ring of annotated frames and their detection results in one shared
+    # memory block, written by the detection process and read by the web
+    # process. The writer never waits for readers: it overwrites the oldest
+    # slot. Readers take NumPy views straight into the block (no copy) and
+    # use the slot's version to tell whether it was overwritten while they
+    # were using it.
+
+    def __init__(self, shm, owner=False):
+        self.shm = shm
+        self.owner = owner
+        self.header = np.ndarray((1,), dtype=HEADER_DTYPE, buffer=shm.buf)[0]
+        self.slots = int(self.header['slots'])
+        self.max_height = int(self.header['max_height'])
+        self.max_width = int(self.header['max_width'])
+        self.records = np.ndarray((self.slots,), dtype=RECORD_DTYPE, buffer=shm.buf, offset=HEADER_SIZE)
+        frames_offset = HEADER_SIZE + self.records.nbytes
+        self.frames = np.ndarray((self.slots, self.max_height * self.max_width * 3), dtype=np.uint8,
+                                 buffer=shm.buf, offset=frames_offset)
+        # Writer side: carry on after whatever a previous writer left
+        self.seq = int(self.header['latest'])
+        self.overwritten_reads = 0
+
+    @classmethod
+    def create(cls, slots=8, max_height=720, max_width=1280):
+        size = HEADER_SIZE + slots * RECORD_DTYPE.itemsize + slots * max_height * max_width * 3
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        header = np.ndarray((1,), dtype=HEADER_DTYPE, buffer=shm.buf)[0]
+        header['latest'] = 0
+        header['slots'] = slots
+        header['max_height'] = max_height
+        header['max_width'] = max_width
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        return cls(_attach(name))
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def write(self, snapshot, fps=None, with_frame=True):
+        # Copies the snapshot's frame into the next slot; the only copy on
+        # the way from the detection process to the web process. Without
+        # with_frame only the results are written.
+        frame = snapshot.frame
+        height, width = frame.shape[:2] if with_frame else (0, 0)
+        if height > self.max_height or width > self.max_width:
+            scale = min(self.max_height / height, self.max_width / width)
+            frame = cv2.resize(frame, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+            height, width = frame.shape[:2]
+
+        self.seq += 1
+        seq = self.seq
+        slot = seq % self.slots
+        record = self.records[slot]
+        record['version'] = 2 * seq - 1
+        record['seq'] = seq
+        record['captured_at'] = snapshot.captured_at
+        record['ear'] = np.nan if snapshot.ear is None else snapshot.ear
+        record['closed_time'] = snapshot.closed_time
+        record['no_face_time'] = snapshot.no_face_time
+        record['fps'] = np.nan if fps is None else fps
+        record['status'] = STATUSES.index(snapshot.status)
+        record['alert_active'] = snapshot.alert_active
+        record['drowsy_alerts'] = snapshot.drowsy_alerts
+        record['face_missing_alerts'] = snapshot.face_missing_alerts
+        record['height'] = height
+        record['width'] = width
+        record['level'] = snapshot.level.encode()
+        if height:
+            self.frames[slot, :height * width * 3].reshape(height, width, 3)[:] = frame
+        record['version'] = 2 * seq
+        self.header['latest'] = seq
+
+    def latest(self):
+        return int(self.header['latest'])
+
+    def read(self, seq):
+        # Returns (record, frame view) for seq, or None if that slot has
+        # already been overwritten. The record is a copy; the frame is a view
+        # into shared memory, so check is_current(seq) after using it.
+        slot = seq % self.slots
+        record = self.records[slot].copy()
+        if record['version'] != 2 * seq or not self.is_current(seq):
+            self.overwritten_reads += 1
+            return None
+        height, width = int(record['height']), int(record['width'])
+        frame = self.frames[slot, :height * width * 3].reshape(height, width, 3)
+        return record, frame
+
+    def is_current(self, seq):
+        return int(self.records['version'][seq % self.slots]) == 2 * seq
+
+    def stats(self):
+        return {
+            'name': self.name,
+            'slots': self.slots,
+            'bytes': self.shm.size,
+            'latest': self.latest(),
+            'overwritten_reads': self.overwritten_reads
+        }
+
+    def close(self):
+        # Views into the block must go before it can be closed
+        if self.header is None:
+            return
+        self.header = self.records = self.frames = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -1,170 +1,215 @@
-import cv2
-import mediapipe as mp
-import numpy as np
-from scipy.spatial import distance
-import pygame
-from flask import Flask, render_template_string, Response, jsonify
-import threading
 import time
-import requests
-from geopy.geocoders import Nominatim
-import geocoder
-
-app = Flask(__name__)
-
-# Audio initialization with error handling
-pygame.mixer.init()
-try:
-    pygame.mixer.music.load("alarm.wav")
-    alarm_sound_loaded = True
-except:
-    print("Could not load alarm sound, using system beep")
-    alarm_sound_loaded = False
-
-# Drowsiness detection parameters
-EAR_THRESHOLD = 0.25  # Eye Aspect Ratio threshold
-EAR_CONSEC_FRAMES = 30  # Number of consecutive frames below threshold to trigger alert
-NO_FACE_THRESHOLD = 60  # Frames without face detection to trigger alert
-
-# MediaPipe face mesh setup
-mp_face_mesh = mp.solutions.face_mesh
-face_mesh = mp_face_mesh.FaceMesh(
-    min_detection_confidence=0.5,
-    min_tracking_confidence=0.5,
-    max_num_faces=1
-)
-
-# Landmark indices for left and right eyes
-LEFT_EYE_INDICES = [33, 160, 158, 133, 153, 144]
-RIGHT_EYE_INDICES = [362, 385, 387, 263, 373, 380]
-
-# Global variables with thread safety
-frame = None
-frame_count = 0
-no_face_count = 0
-status = "Monitoring Active"
-alert_active = False
-alert_frame = None
-system_running = True
-data_lock = threading.Lock()
-
-def eye_aspect_ratio(eye_landmarks):
-    # Compute the euclidean distances between the two sets of vertical eye landmarks
-    A = distance.euclidean(eye_landmarks[1], eye_landmarks[5])
-    B = distance.euclidean(eye_landmarks[2], eye_landmarks[4])
-    
-    # Compute the euclidean distance between the horizontal eye landmarks
-    C = distance.euclidean(eye_landmarks[0], eye_landmarks[3])
-    
-    # Compute the eye aspect ratio
-    ear = (A + B) / (2.0 * C)
-    return ear
-
-def play_alert():
-    if alarm_sound_loaded:
-        try:
-            pygame.mixer.music.play(-1)  # Loop indefinitely
-        except:
-            print("Error playing alarm sound")
-
-def stop_alert():
-    if alarm_sound_loaded:
-        try:
-            pygame.mixer.music.stop()
-        except:
-            print("Error stopping alarm sound")
+STARTED_AT = time.monotonic()  # reference for the startup timings below
 
-def drowsiness_detection():
-    global frame, frame_count, no_face_count, status, alert_active, alert_frame
-    
-    cap = cv2.VideoCapture(0)
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-    
-    while system_running:
-        ret, frame = cap.read()
-        if not ret:
-            print("Camera error - reconnecting...")
-            cap.release()
-            time.sleep(2)
-            cap = cv2.VideoCapture(0)
-            continue
-        
-        # Convert to RGB and process with MediaPipe
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        results = face_mesh.process(rgb_frame)
-        
-        with data_lock:
-            if results.multi_face_landmarks:
-                no_face_count = 0  # Reset no face counter
-                
-                landmarks = results.multi_face_landmarks[0].landmark
-                
-                # Get eye landmarks
-                left_eye = [(landmarks[i].x, landmarks[i].y) for i in LEFT_EYE_INDICES]
-                right_eye = [(landmarks[i].x, landmarks[i].y) for i in RIGHT_EYE_INDICES]
-                
-                # Calculate EAR for both eyes
-                left_ear = eye_aspect_ratio(left_eye)
-                right_ear = eye_aspect_ratio(right_eye)
-                avg_ear = (left_ear + right_ear) / 2.0
-                
-                # Check for drowsiness
-                if avg_ear < EAR_THRESHOLD:
-                    frame_count += 1
-                    if frame_count >= EAR_CONSEC_FRAMES and not alert_active:
-                        status = "DROWSINESS DETECTED!"
-                        alert_active = True
-                        play_alert()
-                else:
-                    if frame_count > 0:
-                        frame_count -= 1  # Slowly decay the counter for more robust detection
-
-                    if frame_count == 0 and alert_active:
-                        alert_active = False
-                        stop_alert()
-                        status = "Monitoring Active"
+import atexit
+import os
+import threading
+from alarm import Alarm
+from metrics import Registry, CONTENT_TYPE, merge_rendered
+from frame_broadcaster import MJPEG_BOUNDARY
+from location_service import create_location_service
+from detection_stream import DetectionStream, StreamMetrics, StreamWorkerPool
+from detection_process import DetectionProcess, RemoteStream, WebStreamMetrics
+from incident_recorder import ClipWriter
+from load_controller import DEFAULT_LEVELS
+from async_server import AsyncStreamServer
+from detection_engine import EAR_THRESHOLD, CLOSED_EYES_SECONDS, NO_FACE_SECONDS
+IMPORTS_DONE = round(time.monotonic() - STARTED_AT, 3)
+
+# Nothing below starts threads, opens devices or reads files at import time:
+# the spawned detection process imports this script again (as __mp_main__).
+# create_app() builds the web app and start() brings the system up.
+app = None
+
+MAX_FPS = 30  # Upper bound on processed frames per second, per stream
+
+# Track the face region between frames and run FaceMesh on a padded crop,
+# downscaled so its longest side is at most INFERENCE_SIZE pixels
+ROI_TRACKING = True
+INFERENCE_SIZE = 320
+
+# Lower the FaceMesh rate while the eyes are clearly open and the head is still
+ADAPTIVE_INFERENCE = True
+
+# CPU budget per processed frame. When frames take longer, each stream steps
+# down the degradation ladder (lower inference resolution, then no overlay
+# and a reduced video rate, then the OpenCV Haar eye fallback) and steps
+# back up once there is headroom. DMS_FRAME_BUDGET_MS=0 keeps full processing.
+FRAME_BUDGET_MS = float(os.environ.get('DMS_FRAME_BUDGET_MS', str(1000.0 / MAX_FPS)))
+DEGRADATION_LEVELS = DEFAULT_LEVELS
+
+# Camera sources, one detection stream each: camera indices, video files or
+# stream URLs separated by commas, e.g. DMS_CAMERAS=0,1,rtsp://cabin-3/live
+CAMERA_SOURCES = os.environ.get('DMS_CAMERAS', '0').split(',')
+# Inference workers shared by all streams (default: one per core)
+INFERENCE_WORKERS = int(os.environ.get('DMS_INFERENCE_WORKERS', '0')) or os.cpu_count() or 1
+
+# Run capture, inference and the alarm in a separate detection process, so
+# web traffic cannot slow detection down. Frames and results reach this
+# process through shared memory. DMS_DETECTION_PROCESS=0 runs everything in
+# this process instead.
+DETECTION_PROCESS = os.environ.get('DMS_DETECTION_PROCESS', '1') != '0'
+
+# Incident clips: the seconds before and after each alert are saved to
+# INCIDENT_DIR from a per-stream buffer of encoded frames capped at
+# INCIDENT_BUFFER_MB. An empty DMS_INCIDENT_DIR turns recording off.
+INCIDENT_DIR = os.environ.get('DMS_INCIDENT_DIR', 'incidents')
+INCIDENT_BUFFER_MB = float(os.environ.get('DMS_INCIDENT_BUFFER_MB', '16'))
+
+# Telemetry: every EAR sample with the alert state is appended to a
+# memory-mapped log in TELEMETRY_DIR, one file per stream rotated every
+# TELEMETRY_FILE_MB and flushed to disk every TELEMETRY_FLUSH_SECONDS. An
+# empty DMS_TELEMETRY_DIR turns it off.
+TELEMETRY_DIR = os.environ.get('DMS_TELEMETRY_DIR', 'telemetry')
+TELEMETRY_FILE_MB = float(os.environ.get('DMS_TELEMETRY_FILE_MB', '64'))
+TELEMETRY_FLUSH_SECONDS = float(os.environ.get('DMS_TELEMETRY_FLUSH_SECONDS', '5'))
+
+# Dashboard pages are gzip-compressed for clients that accept it;
+# DMS_GZIP=0 turns that off (e.g. behind a proxy that compresses)
+GZIP_RESPONSES = os.environ.get('DMS_GZIP', '1') != '0'
+# "threaded" serves everything from Flask's threaded server. "async" serves
+# /video_feed, /api/stream and /api/status from one asyncio event loop, so
+# many viewers do not each hold a thread, and hands the other routes to
+# Flask on a small thread pool.
+SERVER_MODE = os.environ.get('DMS_SERVER', 'threaded')
+
+ALARM_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'alarm.wav')
+
+# Prometheus-style metrics served on /metrics. Hot paths only bump
+# preallocated counters; everything else is computed at scrape time.
+metrics = Registry()
+# Requests for the in-memory dashboard pages and alarm.wav, and how many of
+# them a 304 answered
+asset_requests = metrics.counter('dms_asset_requests_total', 'Requests for an in-memory web asset', ['asset'])
+asset_not_modified = metrics.counter(
+    'dms_asset_not_modified_total', 'Web asset requests answered with an empty 304', ['asset'])
+
+# Detection streams by id (RemoteStreams when detection runs in its own
+# process), and the inference workers or process they share
+streams = {}
+worker_pool = None
+detection_process = None
+clip_writer = None
+server = None  # AsyncStreamServer in the async server mode
+
+# Location refreshed in the background; source set by DMS_LOCATION_SOURCE
+# ("ip", "static:<lat>,<lng>" or "nmea:<path>")
+location_service = None
+
+def publish_location(location):
+    # Location updates go out on every stream's dashboard event stream
+    for stream in list(streams.values()):
+        stream.status_events.publish('location', location)
+
+# Seconds from process start to each startup milestone of the process as a
+# whole; per-stream milestones are kept on each stream
+startup_times = {}
+
+# The alarm sounds while any stream is alerting. With a detection process
+# it is played from there instead.
+alarm = None
+
+def create_streams(sources):
+    global detection_process, alarm
+    stream_options = dict(roi_tracking=ROI_TRACKING, inference_size=INFERENCE_SIZE,
+                          adaptive_inference=ADAPTIVE_INFERENCE, max_fps=MAX_FPS,
+                          started_at=STARTED_AT, frame_budget=FRAME_BUDGET_MS / 1000.0 or None,
+                          degradation_levels=DEGRADATION_LEVELS)
+    if TELEMETRY_DIR:
+        stream_options['telemetry'] = dict(directory=TELEMETRY_DIR,
+                                           max_bytes=int(TELEMETRY_FILE_MB * 1024 * 1024),
+                                           flush_interval=TELEMETRY_FLUSH_SECONDS)
+    incident_buffer_bytes = int(INCIDENT_BUFFER_MB * 1024 * 1024)
+    if DETECTION_PROCESS:
+        detection_process = DetectionProcess(sources, INFERENCE_WORKERS, stream_options, alarm_path=ALARM_PATH)
+        web_metrics = WebStreamMetrics(metrics)
+        for stream_id, (source, ring) in enumerate(zip(sources, detection_process.rings)):
+            streams[stream_id] = RemoteStream(
+                stream_id, source, ring, detection_process, web_metrics,
+                clip_writer=clip_writer, incident_buffer_bytes=incident_buffer_bytes)
+        return
+
+    stream_metrics = StreamMetrics(metrics)
+    alarm = Alarm(ALARM_PATH)
+    alarm.register_metrics(metrics)
+    for source in sources:
+        stream_id = len(streams)
+        streams[stream_id] = DetectionStream(
+            stream_id, source, stream_metrics,
+            on_alert=alarm.stream_alert, on_clear=alarm.stream_clear,
+            clip_writer=clip_writer, incident_buffer_bytes=incident_buffer_bytes,
+            **stream_options)
+
+def report_startup(timeout=120.0):
+    # Prints how long each stream took to process its first frame, with
+    # the milestones on the way, once all of them and the alarm are up
+    deadline = time.monotonic() + timeout
+    for stream in list(streams.values()):
+        stream.first_frame.wait(max(0.0, deadline - time.monotonic()))
+    if detection_process is not None:
+        # The detection process answers at once; ask until its alarm is up
+        while time.monotonic() < deadline:
+            audio = detection_process.call('startup')
+            if audio:
+                startup_times.update(audio)
+                break
+            time.sleep(0.05)
+    elif alarm.ready.wait(max(0.0, deadline - time.monotonic())):
+        startup_times['audio_ready'] = round(alarm.ready_at - STARTED_AT, 3)
+    for stream in list(streams.values()):
+        startup = stream.startup
+        first = startup.get('first_frame')
+        steps = ', '.join(f"{name} {seconds:.2f} s" for name, seconds in sorted(startup.items(), key=lambda item: item[1]))
+        if first is None:
+            print(f"Stream {stream.id}: no frame processed within {timeout:.0f} s ({steps or 'nothing started'})")
+        else:
+            print(f"Stream {stream.id}: time to first processed frame {first:.2f} s ({steps})")
+    print("Startup:", ', '.join(f"{name} {seconds:.2f} s" for name, seconds in startup_times.items()))
 
-                
-                # Draw eye landmarks and EAR value
-                for eye in [left_eye, right_eye]:
-                    for point in eye:
-                        x = int(point[0] * frame.shape[1])
-                        y = int(point[1] * frame.shape[0])
-                        cv2.circle(frame, (x, y), 1, (0, 255, 0), -1)
-                
-                cv2.putText(frame, f"EAR: {avg_ear:.2f}", (10, 30),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-            else:
-                no_face_count += 1
-                if no_face_count >= NO_FACE_THRESHOLD:
-                    status = "FACE NOT DETECTED!"
-                    if not alert_active:
-                        alert_active = True
-                        play_alert()
-                else:
-                    status = "Searching for face..."
-            
-            # Add status text to frame
-            color = (0, 0, 255) if alert_active else (0, 255, 0)
-            cv2.putText(frame, status, (10, 60),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
-            
-            # Add red border if alert is active
-            if alert_active:
-                cv2.rectangle(frame, (0, 0), 
-                              (frame.shape[1]-1, frame.shape[0]-1),
-                              (0, 0, 255), 10)
-            
-            alert_frame = frame.copy()
-        
-        time.sleep(0.033)  # ~30 FPS
-    
-    cap.release()
-
-@app.route('/')
-def dashboard():
-    return render_template_string('''
+def drowsiness_detection():
+    # Each stream runs capture and annotation on its own threads and
+    # hands frames to a worker pool (sized to the cores) for inference,
+    # either in the detection process or in this one.
+    # Startup work runs in parallel: the alarm sound loads while each
+    # stream opens its camera and builds its FaceMesh
+    global worker_pool
+    startup_times['imports_done'] = IMPORTS_DONE
+    if not streams:
+        create_streams(CAMERA_SOURCES)
+    if detection_process is not None:
+        detection_process.start()
+        for stream in streams.values():
+            stream.start()
+    else:
+        alarm.start_loading()
+        worker_pool = StreamWorkerPool(min(INFERENCE_WORKERS, len(streams)))
+        worker_pool.start()
+        for stream in streams.values():
+            stream.start(worker_pool)
+    threading.Thread(target=report_startup, daemon=True).start()
+
+def shutdown():
+    # Stops the readers before the detection process and its shared memory
+    for stream in list(streams.values()):
+        stream.stop()
+    if worker_pool is not None:
+        worker_pool.stop()
+    if detection_process is not None:
+        detection_process.stop()
+    if clip_writer is not None:
+        clip_writer.stop()
+
+def start():
+    # Brings up incident recording, detection and the location service
+    global clip_writer, location_service
+    clip_writer = ClipWriter(INCIDENT_DIR) if INCIDENT_DIR else None
+    location_service = create_location_service()
+    location_service.on_update = publish_location
+    atexit.register(shutdown)
+    drowsiness_detection()
+    location_service.start()
+
+DASHBOARD_TEMPLATE = '''
     <!DOCTYPE html>
     <html lang="en">
     <head>
@@ -251,6 +296,7 @@ def dashboard():
             <div class="row mb-4">
                 <div class="col-12">
                     <h2 class="text-center">🚗 Driver Monitoring Dashboard</h2>
+                    <p class="text-center text-muted">Camera {{ stream_id }}</p>
                 </div>
             </div>
 
@@ -260,7 +306,7 @@ def dashboard():
                         <div class="card-body">
                             <h5 class="card-title">Live Camera Feed</h5>
                             <div class="video-container">
-                                <img src="{{ url_for('video_feed') }}" class="img-fluid rounded">
+                                <img src="/video_feed/{{ stream_id }}" class="img-fluid rounded">
                                 <div class="video-overlay" id="videoStatus">Loading...</div>
                             </div>
                         </div>
@@ -287,6 +333,7 @@ def dashboard():
                                     </div>
                                 </div>
                             </div>
+                            <p class="text-muted mb-0">Processing level: <span id="levelText">--</span></p>
                         </div>
                     </div>
                 </div>
@@ -312,9 +359,9 @@ def dashboard():
                             <div class="alert alert-info">
                                 <strong>Detection Thresholds:</strong>
                                 <ul class="mt-2">
-                                    <li>EAR Threshold: {{EAR_THRESHOLD}}</li>
-                                    <li>Closed Eye Frames: {{CLOSED_EYE_FRAME_THRESHOLD}}</li>
-                                    <li>Face Missing Frames: {{FACE_MISSING_THRESHOLD}}</li>
+                                    <li>EAR Threshold: {{ ear_threshold }}</li>
+                                    <li>Closed Eyes Alert: {{ closed_eyes_seconds }} s</li>
+                                    <li>Face Missing Alert: {{ no_face_seconds }} s</li>
                                 </ul>
                             </div>
                             <div class="alert alert-secondary">
@@ -333,7 +380,7 @@ def dashboard():
 
         <script>
             let map, marker;
-            let alertAudio = new Audio('alarm.wav');
+            let alertAudio = new Audio('/alarm.wav');
             let isAlertPlaying = false;
 
             function initMap(lat = 12.9716, lng = 77.5946) {
@@ -361,43 +408,57 @@ def dashboard():
                 }
             }
 
-            function updateData() {
-                fetch('/api/status').then(res => res.json()).then(data => {
-                    const status = document.getElementById("statusText");
-                    status.textContent = data.status;
-                    
-                    // Update status color based on alert state
-                    if (data.drowsy || data.face_missing) {
-                        status.className = "status alert alert-danger";
-                        playAlertSound();
-                    } else {
-                        status.className = "status alert alert-success";
-                        stopAlertSound();
-                    }
-                    
-                    // Update video overlay
-                    document.getElementById("videoStatus").textContent = data.status;
-                });
+            function applyStatus(data) {
+                const status = document.getElementById("statusText");
+                status.textContent = data.status;
+                
+                // Update status color based on alert state
+                if (data.drowsy || data.face_missing || data.fault) {
+                    status.className = "status alert alert-danger";
+                    playAlertSound();
+                } else {
+                    status.className = "status alert alert-success";
+                    stopAlertSound();
+                }
+                
+                // Update video overlay
+                document.getElementById("videoStatus").textContent = data.status;
+                document.getElementById("levelText").textContent = data.level;
+            }
 
-                fetch('/api/location').then(res => res.json()).then(data => {
-                    document.getElementById("locationText").textContent = data.address;
-                    document.getElementById("coordinatesText").textContent = 
-                        `${data.latitude.toFixed(6)}, ${data.longitude.toFixed(6)}`;
-                    document.getElementById("ipText").textContent = data.ip_address;
-                    document.getElementById("speedValue").textContent = data.speed.toFixed(1);
-                    
-                    if (map && marker) {
-                        let newPos = new google.maps.LatLng(data.latitude, data.longitude);
-                        map.setCenter(newPos);
-                        marker.setPosition(newPos);
-                    }
-                });
+            function applyEar(ear) {
+                document.getElementById("earValue").textContent = ear === null ? "--" : ear.toFixed(2);
+            }
+
+            function applyLocation(data) {
+                document.getElementById("locationText").textContent = data.address;
+                document.getElementById("coordinatesText").textContent = 
+                    `${data.latitude.toFixed(6)}, ${data.longitude.toFixed(6)}`;
+                document.getElementById("ipText").textContent = data.ip_address;
+                document.getElementById("speedValue").textContent = data.speed.toFixed(1);
+                
+                if (map && marker) {
+                    let newPos = new google.maps.LatLng(data.latitude, data.longitude);
+                    map.setCenter(newPos);
+                    marker.setPosition(newPos);
+                }
+            }
 
-                // Update EAR value (simulated in this example)
-                fetch('/api/status').then(res => res.json()).then(data => {
-                    // In a real implementation, you would get the actual EAR value from the API
-                    document.getElementById("earValue").textContent = data.drowsy ? "0.20" : "0.30";
+            // Polling fallback for browsers without EventSource
+            function updateData() {
+                fetch('/api/status/{{ stream_id }}').then(res => res.json()).then(data => {
+                    applyStatus(data);
+                    applyEar(data.ear);
                 });
+                fetch('/api/location').then(res => res.json()).then(applyLocation);
+            }
+
+            // Server push: status transitions arrive as they happen, EAR is throttled
+            function connectEvents() {
+                const events = new EventSource('/api/stream/{{ stream_id }}');
+                events.addEventListener('status', e => applyStatus(JSON.parse(e.data)));
+                events.addEventListener('ear', e => applyEar(JSON.parse(e.data).ear));
+                events.addEventListener('location', e => applyLocation(JSON.parse(e.data)));
             }
 
             function requestLocationPermission() {
@@ -420,76 +481,176 @@ def dashboard():
 
             window.onload = () => {
                 requestLocationPermission();
-                setInterval(updateData, 1000); // Update every second
+                if (window.EventSource) {
+                    connectEvents();
+                } else {
+                    setInterval(updateData, 1000); // Update every second
+                }
             };
         </script>
     </body>
     </html>
-    ''', ear_threshold=EAR_THRESHOLD,
-        ear_frames=EAR_CONSEC_FRAMES,
-        no_face_threshold=NO_FACE_THRESHOLD)
-
-@app.route('/video_feed')
-def video_feed():
-    def generate():
-        while True:
-            with data_lock:
-                if alert_frame is not None:
-                    ret, buffer = cv2.imencode('.jpg', alert_frame)
-                    frame = buffer.tobytes()
-                    yield (b'--frame\r\n'
-                           b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-            time.sleep(0.033)
-    
-    return Response(generate(),
-                   mimetype='multipart/x-mixed-replace; boundary=frame')
-
-@app.route('/api/status')
-def api_status():
-    with data_lock:
-        return jsonify({
-            'status': status,
-            'alert_active': alert_active,
-            'drowsy': alert_active and status == "DROWSINESS DETECTED!",
-            'face_missing': alert_active and status == "FACE NOT DETECTED!",
-            'ear': 0.20 if alert_active else 0.30  # For now, you can use this placeholder
-        })
-
-@app.route('/api/location')
-def api_location():
+    '''
+
+def create_app():
+    # The Flask app with the dashboard and API routes over the module's
+    # streams. Flask is only imported here, never in the detection process.
+    from flask import Flask, Response, jsonify, abort, request
+    from web_assets import CachedAsset
+    app = Flask(__name__)
+
+    def get_stream(stream_id):
+        stream = streams.get(stream_id)
+        if stream is None:
+            abort(404)
+        return stream
+
+    # The dashboard template is compiled once, with the detection thresholds
+    # filled in; only the stream id differs between pages
+    dashboard_template = app.jinja_env.from_string(DASHBOARD_TEMPLATE, globals={
+        'ear_threshold': EAR_THRESHOLD,
+        'closed_eyes_seconds': CLOSED_EYES_SECONDS,
+        'no_face_seconds': NO_FACE_SECONDS
+    })
+    dashboard_pages = {}
+
+    def export_asset(name, asset):
+        asset_requests.labels(name).set_function(lambda: asset.requests)
+        asset_not_modified.labels(name).set_function(lambda: asset.not_modified)
+
+    # alarm.wav is read once and served from memory; browsers revalidate it
+    # with If-None-Match / If-Modified-Since and get an empty 304 back
     try:
-        g = geocoder.ip('me')
-        lat, lng = g.latlng
-
-        geolocator = Nominatim(user_agent="dms")
-        location = geolocator.reverse((lat, lng), timeout=10)
-
-        return jsonify({
-            'latitude': lat,
-            'longitude': lng,
-            'address': location.address if location else "Unknown",
-            'ip_address': g.ip,
-            'speed': 0  # Placeholder for GPS speed if needed
-        })
-    except Exception as e:
-        print("Location error:", e)
-        return jsonify({
-            'latitude': 0,
-            'longitude': 0,
-            'address': "Unable to fetch",
-            'ip_address': "127.0.0.1",
-            'speed': 0
-        })
-
+        alarm_asset = CachedAsset.from_file(ALARM_PATH, 'audio/wav')
+        export_asset('alarm.wav', alarm_asset)
+    except OSError as e:
+        print("Could not load alarm.wav for the dashboard:", e)
+        alarm_asset = None
+
+    @app.route('/')
+    @app.route('/dashboard/<int:stream_id>')
+    def dashboard(stream_id=0):
+        get_stream(stream_id)
+        # Rendered once per stream, then served from memory with an ETag
+        page = dashboard_pages.get(stream_id)
+        if page is None:
+            html = dashboard_template.render(stream_id=stream_id)
+            page = dashboard_pages.setdefault(stream_id, CachedAsset(
+                html.encode('utf-8'), 'text/html; charset=utf-8', compress=GZIP_RESPONSES))
+            export_asset(f'dashboard/{stream_id}', dashboard_pages[stream_id])
+        return page.response(request)
 
-if __name__ == '__main__':
-    # Make sure the alarm.wav file is accessible via Flask
     @app.route('/alarm.wav')
     def serve_alarm():
-        return app.send_static_file('alarm.wav')
-    
-    detection_thread = threading.Thread(target=drowsiness_detection)
-    detection_thread.daemon = True
-    detection_thread.start()
-    
-    app.run(host='0.0.0.0', port=5000, debug=False, use_reloader=False)
\ No newline at end of file
+        if alarm_asset is None:
+            abort(404)
+        return alarm_asset.response(request)
+
+    @app.route('/video_feed')
+    @app.route('/video_feed/<int:stream_id>')
+    def video_feed(stream_id=0):
+        # ?fps=N caps this viewer's frame rate
+        stream = get_stream(stream_id)
+        max_fps = min(max(request.args.get('fps', 0, type=float), 0), MAX_FPS)
+        return Response(stream.broadcaster.stream(max_fps=max_fps or None),
+                       mimetype='multipart/x-mixed-replace; boundary=' + MJPEG_BOUNDARY.decode())
+
+    @app.route('/api/status')
+    @app.route('/api/status/<int:stream_id>')
+    def api_status(stream_id=0):
+        snapshot = get_stream(stream_id).snapshot
+        status = snapshot.status_dict()
+        status['ear'] = snapshot.ear
+        return jsonify(status)
+
+    @app.route('/api/stream')
+    @app.route('/api/stream/<int:stream_id>')
+    def api_stream(stream_id=0):
+        # Server-sent events replacing dashboard polling of /api/status and /api/location
+        stream = get_stream(stream_id)
+        return Response(stream.status_events.stream(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    @app.route('/api/pipeline')
+    @app.route('/api/pipeline/<int:stream_id>')
+    def api_pipeline(stream_id=0):
+        return jsonify(get_stream(stream_id).pipeline_stats())
+
+    @app.route('/api/alarm')
+    def api_alarm():
+        # Alarm state and time from alert decision to sound start
+        if detection_process is not None:
+            return jsonify(detection_process.call('alarm'))
+        return jsonify(alarm.stats())
+
+    @app.route('/api/incidents')
+    def api_incidents():
+        # Clip writer progress plus each stream's pre-alert buffer footprint
+        if clip_writer is None:
+            return jsonify({'enabled': False})
+        summary = clip_writer.stats()
+        summary['enabled'] = True
+        summary['streams'] = {stream.id: stream.recorder.stats() for stream in list(streams.values())}
+        return jsonify(summary)
+
+    @app.route('/api/history')
+    @app.route('/api/history/<int:stream_id>')
+    def api_history(stream_id=0):
+        # Downsampled EAR history plus PERCLOS / blink rate, e.g. ?points=300&seconds=600
+        stream = get_stream(stream_id)
+        points = min(max(request.args.get('points', 300, type=int), 1), 5000)
+        seconds = request.args.get('seconds', type=float)
+        history = stream.history.downsample(points=points, seconds=seconds, now=time.monotonic())
+        history.update(stream.history.stats())
+        return jsonify(history)
+
+    @app.route('/api/streams')
+    def api_streams():
+        summary = []
+        for stream in list(streams.values()):
+            status = stream.snapshot.status_dict()
+            status['id'] = stream.id
+            status['source'] = str(stream.source)
+            status['fps'] = stream.fps()
+            summary.append(status)
+        return jsonify(summary)
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        text = metrics.render()
+        if detection_process is not None:
+            # Detection-side families come from the detection process
+            text = merge_rendered(text, detection_process.call('metrics') or '')
+        return Response(text, content_type=CONTENT_TYPE)
+
+    @app.route('/api/server')
+    def api_server():
+        # Connection and backpressure counters of the async server
+        if server is None:
+            return jsonify({'mode': SERVER_MODE})
+        return jsonify(server.stats())
+
+    @app.route('/api/location')
+    def api_location():
+        # Served from the background-refreshed cache, never blocks on the network;
+        # updated_at tells clients how old the fix is
+        return jsonify(dict(location_service.get(), updated_at=location_service.updated_at))
+
+
+    return app
+
+
+def main():
+    global app, server
+    app = create_app()
+    start()
+
+    if SERVER_MODE == 'async':
+        server = AsyncStreamServer(app, streams, host='0.0.0.0', port=5000, max_fps=MAX_FPS)
+        server.run()
+    else:
+        app.run(host='0.0.0.0', port=5000, debug=False, use_reloader=False, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,77 +1,109 @@
+import argparse
+import os
+import signal
+import time
+
 import cv2
-import mediapipe as mp
-import numpy as np
-from scipy.spatial import distance
-import pygame
-
-# Load the alarm sound
-pygame.mixer.init()
-pygame.mixer.music.load("alarm.wav")  # Add your alarm sound file
-
-# Eye Aspect Ratio (EAR) calculation function
-def calculate_ear(eye):
-    A = distance.euclidean(eye[1], eye[5])
-    B = distance.euclidean(eye[2], eye[4])
-    C = distance.euclidean(eye[0], eye[3])
-    ear = (A + B) / (2.0 * C)
-    return ear
-
-# Constants for sleep detection
-EAR_THRESHOLD = 0.25  # Threshold for eye closure
-FRAME_THRESHOLD = 75  # Number of consecutive frames with closed eyes before alarm (5 seconds)
-
-# Initialize mediapipe face mesh
-mp_face_mesh = mp.solutions.face_mesh
-face_mesh = mp_face_mesh.FaceMesh(min_detection_confidence=0.5, min_tracking_confidence=0.5)
-
-cap = cv2.VideoCapture(0)  # Start video capture
-frame_count = 0
-
-while True:
-    ret, frame = cap.read()
-    if not ret:
-        break
-    
-    rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-    results = face_mesh.process(rgb_frame)
-
-    if not results.multi_face_landmarks:
-        cv2.putText(frame, "FACE NOT DETECTED!", (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
-        frame_count = 0
-        pygame.mixer.music.stop()  # Stop the alarm if no face is detected
-    else:
-        for face_landmarks in results.multi_face_landmarks:
-            cv2.putText(frame, "FACE DETECTED!", (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-
-            # Extract eye landmarks
-            left_eye = [(face_landmarks.landmark[i].x, face_landmarks.landmark[i].y) for i in [33, 160, 158, 133, 153, 144]]
-            right_eye = [(face_landmarks.landmark[i].x, face_landmarks.landmark[i].y) for i in [362, 385, 387, 263, 373, 380]]
-
-            left_eye = np.array([(int(x * frame.shape[1]), int(y * frame.shape[0])) for x, y in left_eye])
-            right_eye = np.array([(int(x * frame.shape[1]), int(y * frame.shape[0])) for x, y in right_eye])
-
-            left_ear = calculate_ear(left_eye)
-            right_ear = calculate_ear(right_eye)
-            avg_ear = (left_ear + right_ear) / 2.0
-
-            # Draw eye contours
-            cv2.polylines(frame, [left_eye], True, (0, 255, 0), 1)
-            cv2.polylines(frame, [right_eye], True, (0, 255, 0), 1)
-
-            if avg_ear < EAR_THRESHOLD:
-                frame_count += 1
-                if frame_count >= FRAME_THRESHOLD:
-                    cv2.putText(frame, "SLEEPING! WAKE UP!", (100, 100), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
-                    if not pygame.mixer.music.get_busy():
-                        pygame.mixer.music.play()
-            else:
-                frame_count = 0
-                pygame.mixer.music.stop()  # Stop the alarm if the driver is awake
-
-    cv2.imshow("Sleep Detection", frame)
-
-    if cv2.waitKey(1) & 0xFF == ord('q'):
-        break
-
-cap.release()
-cv2.destroyAllWindows()
+
+from face_roi import FaceROITracker
+from overlay import draw_overlay
+from detection_engine import (LEFT_EYE_INDICES, NO_FACE_SECONDS, RIGHT_EYE_INDICES,
+                              DrowsinessStateMachine, create_face_mesh, landmarks_ear)
+
+# Run FaceMesh on a padded crop around last frame's face, downscaled to INFERENCE_SIZE
+INFERENCE_SIZE = 320
+# This alarm has always waited longer than the vehicle server's CLOSED_EYES_SECONDS
+CLOSED_EYES_SECONDS = 5.0  # Seconds of closed eyes (net of decay) before alarm, at any frame rate
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Single-camera drowsiness alarm, with or without a window")
+    parser.add_argument('--source', default='0', help="camera index, video file or stream URL")
+    parser.add_argument('--headless', action='store_true',
+                        help="no window and no drawing; status changes are printed (for embedded use)")
+    parser.add_argument('--no-alarm', action='store_true', help="don't load pygame or play alarm.wav")
+    parser.add_argument('--closed-seconds', type=float, default=CLOSED_EYES_SECONDS,
+                        help="seconds of closed eyes before the alarm")
+    parser.add_argument('--no-face-seconds', type=float, default=NO_FACE_SECONDS,
+                        help="seconds without a face before the alarm")
+    parser.add_argument('--inference-size', type=int, default=INFERENCE_SIZE,
+                        help="longest side of the image passed to FaceMesh (0 = native)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    source = int(args.source) if args.source.isdigit() else args.source
+    # Recorded files are processed as fast as they decode, so their own
+    # timestamps drive the state machine instead of the wall clock
+    from_file = isinstance(source, str) and os.path.isfile(source)
+
+    alarm = None
+    if not args.no_alarm:
+        # Load the alarm sound into memory on its own mixer channel, while FaceMesh loads
+        from alarm import Alarm
+        alarm = Alarm(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'alarm.wav'))
+        alarm.start_loading()
+
+    # The same engine as the vehicle server: time-based, with closed time
+    # decaying while the eyes are open and an alert for a missing face
+    drowsiness = DrowsinessStateMachine(
+        closed_eyes_seconds=args.closed_seconds, no_face_seconds=args.no_face_seconds,
+        on_alert=alarm.play if alarm else None, on_clear=alarm.stop if alarm else None)
+    face_tracker = FaceROITracker(create_face_mesh(), inference_size=args.inference_size or None)
+
+    # SIGTERM (e.g. from systemd) stops the loop like Ctrl+C does
+    def on_sigterm(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, on_sigterm)
+
+    cap = cv2.VideoCapture(source)  # Start video capture
+    frames = 0
+    started = time.monotonic()
+    status = None
+    try:
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames += 1
+            now = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0 if from_file else time.monotonic()
+
+            landmarks = face_tracker.process(frame)
+            avg_ear = None if landmarks is None else landmarks_ear(landmarks, frame.shape[1] / frame.shape[0])[2]
+            drowsiness.update(avg_ear, now)
+
+            if drowsiness.status != status:
+                status = drowsiness.status
+                print(f"{time.strftime('%H:%M:%S')} {status}"
+                      + (" (alarm)" if drowsiness.alert_active else ""), flush=True)
+
+            if args.headless:
+                continue
+
+            left_eye = None if landmarks is None else landmarks[LEFT_EYE_INDICES]
+            right_eye = None if landmarks is None else landmarks[RIGHT_EYE_INDICES]
+            draw_overlay(frame, left_eye, right_eye, avg_ear, drowsiness.status, drowsiness.alert_active)
+            cv2.imshow("Sleep Detection", frame)
+
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        cap.release()
+        if alarm is not None:
+            alarm.stop()
+        if not args.headless:
+            cv2.destroyAllWindows()
+
+    elapsed = time.monotonic() - started
+    tracker_stats = face_tracker.stats()
+    print(f"{frames} frames in {elapsed:.1f} s ({frames / elapsed if elapsed else 0:.1f} FPS)")
+    print(f"FaceMesh latency: full frame {tracker_stats['full_latency_ms']} ms, "
+          f"tracked ROI {tracker_stats['tracked_latency_ms']} ms "
+          f"({tracker_stats['tracked_frames']} of {tracker_stats['full_frames'] + tracker_stats['tracked_frames']} frames tracked)")
+
+
+if __name__ == '__main__':
+    main()
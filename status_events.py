@@ -0,0 +1,84 @@
+import json
+import threading
+import time
+
+
+class StatusEventStream:
+    # Server-sent events for the dashboard. Only the newest event of each
+    # kind is kept, so a slow viewer skips stale updates instead of queueing
+    # them. Status transitions are pushed immediately; EAR values are
+    # throttled to one every ear_interval seconds.
+
+    def __init__(self, ear_interval=0.1, keepalive=15.0):
+        self.ear_interval = ear_interval
+        self.keepalive = keepalive
+        self.cond = threading.Condition()
+        self.seq = 0
+        self.latest = {}  # kind -> (seq, encoded event)
+        self.last_status = None
+        self.last_ear_time = 0.0
+        self.clients = 0
+        self.wakers = []  # called after every event, e.g. to wake an event loop
+        self.running = True
+
+    def publish(self, kind, payload):
+        data = f"event: {kind}\ndata: {json.dumps(payload)}\n\n".encode()
+        with self.cond:
+            self.seq += 1
+            self.latest[kind] = (self.seq, data)
+            self.cond.notify_all()
+        for waker in self.wakers:
+            waker()
+
+    def publish_status(self, status):
+        # status is a dict; only transitions are sent
+        if status != self.last_status:
+            self.last_status = status
+            self.publish('status', status)
+
+    def publish_ear(self, ear, now=None):
+        now = time.monotonic() if now is None else now
+        if now - self.last_ear_time < self.ear_interval:
+            return
+        self.last_ear_time = now
+        self.publish('ear', {'ear': None if ear is None else round(float(ear), 3)})
+
+    def add_waker(self, waker):
+        # Wakers run on the publishing thread and must only schedule work elsewhere
+        self.wakers.append(waker)
+
+    def stop(self):
+        self.running = False
+        with self.cond:
+            self.cond.notify_all()
+
+    def join(self):
+        with self.cond:
+            self.clients += 1
+
+    def leave(self):
+        with self.cond:
+            self.clients -= 1
+
+    def pending(self, seen):
+        # (newest seq, events newer than seen joined together, or None)
+        with self.cond:
+            if self.seq == seen:
+                return seen, None
+            return self.seq, b"".join(data for seq, data in sorted(self.latest.values()) if seq > seen)
+
+    def stream(self):
+        # Generator for a text/event-stream response; starts with the current
+        # value of every kind so a new viewer is up to date immediately
+        self.join()
+        try:
+            seen = 0
+            yield b"retry: 1000\n\n"
+            while self.running:
+                with self.cond:
+                    if self.seq == seen:
+                        self.cond.wait(self.keepalive)
+                seen, data = self.pending(seen)
+                yield b": keepalive\n\n" if data is None else data
+        finally:
+            self.leave()
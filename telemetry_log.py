@@ -0,0 +1,325 @@
+import glob
+import itertools
+import mmap
+import os
+import threading
+import time
+
+import numpy as np
+
+from detection_engine import EAR_THRESHOLD
+from shared_frames import STATUSES
+
+# One fixed-size record per EAR sample. 32 bytes divides the page (and
+# sector) size, so a record never straddles two pages and a power cut can
+# only lose whole records.
+RECORD_DTYPE = np.dtype([
+    ('timestamp', '<f8'),  # time.time() of the frame
+    ('seq', '<u4'),  # 1-based record number within the file; 0 = never written
+    ('left_ear', '<f4'),  # NaN when no face was found or the frame was skipped
+    ('right_ear', '<f4'),
+    ('ear', '<f4'),  # value fed to the state machine, NaN without a face
+    ('closed_time', '<f4'),
+    ('face_present', 'u1'),
+    ('alert_active', 'u1'),
+    ('status', 'u1'),  # index into shared_frames.STATUSES
+    ('reserved', 'u1')
+])
+assert RECORD_DTYPE.itemsize == 32
+
+MAGIC = b'DMSTLOG1'
+# The header has a page to itself so records start page-aligned
+HEADER_SIZE = 4096
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'),
+    ('record_size', '<u4'),
+    ('stream', '<u4'),
+    ('capacity', '<u8'),
+    ('count', '<u8'),  # records known to be on disk, updated after each flush
+    ('created', '<f8')
+])
+
+
+def _allocate(f, size):
+    # Reserve the blocks up front: a store into a sparse mapping on a full
+    # disk would kill the process with SIGBUS instead of raising an error
+    f.truncate(size)
+    if hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(f.fileno(), 0, size)
+        except OSError:
+            pass  # filesystems without fallocate support keep the sparse file
+
+
+class _LogFile:
+    # One preallocated, memory-mapped log file
+
+    def __init__(self, path, stream_id, capacity):
+        size = HEADER_SIZE + capacity * RECORD_DTYPE.itemsize
+        self.path = path
+        self.file = open(path, 'w+b')
+        _allocate(self.file, size)
+        self.map = mmap.mmap(self.file.fileno(), size)
+        self.header = np.ndarray((1,), dtype=HEADER_DTYPE, buffer=self.map)[0]
+        self.header['magic'] = MAGIC
+        self.header['record_size'] = RECORD_DTYPE.itemsize
+        self.header['stream'] = stream_id
+        self.header['capacity'] = capacity
+        self.header['count'] = 0
+        self.header['created'] = time.time()
+        self.records = np.ndarray((capacity,), dtype=RECORD_DTYPE, buffer=self.map, offset=HEADER_SIZE)
+        self.count = 0  # records appended
+        self.flushed = 0  # records known to be on disk
+        self.sync()
+
+    def sync(self):
+        # Writes the dirty pages out. mmap.flush() (msync) holds the GIL for
+        # the whole write in CPython, stalling every other thread, while
+        # os.fdatasync() releases it; on Linux it covers pages written
+        # through the mapping too, since both go through the page cache.
+        if hasattr(os, 'fdatasync'):
+            os.fdatasync(self.file.fileno())
+        else:
+            self.map.flush()
+
+    def commit(self, count):
+        # Only after the data pages are on disk does the header count them
+        self.header['count'] = count
+        self.sync()
+        self.flushed = count
+
+    def close(self):
+        self.sync()
+        self.commit(self.count)
+        used = HEADER_SIZE + self.count * RECORD_DTYPE.itemsize
+        self.header = self.records = None
+        self.map.close()
+        # Give back the preallocated space this file didn't use
+        self.file.truncate(used)
+        self.file.close()
+
+    def discard(self):
+        self.header = self.records = None
+        self.map.close()
+        self.file.close()
+        os.remove(self.path)
+
+
+class TelemetryLog:
+    # Per-stream log of every EAR sample for whole shifts. Each file is
+    # preallocated to max_bytes and memory-mapped, so append() is a store
+    # into the mapping with no system call. A background thread syncs the
+    # written pages every flush_interval seconds and only then advances the
+    # record count in the header, so after a power cut everything up to the
+    # last flush is intact and readers never count a record that wasn't
+    # flushed. That thread also does the slow file work: once the current
+    # file is half full it opens and preallocates the next one, so rotation
+    # in append() just swaps files, and it trims and closes full files.
+    # Only the newest max_files are kept.
+
+    def __init__(self, directory='telemetry', stream_id=0, max_bytes=64 * 1024 * 1024,
+                 flush_interval=5.0, max_files=50):
+        self.directory = directory
+        self.stream_id = stream_id
+        self.capacity = max(2, (max_bytes - HEADER_SIZE) // RECORD_DTYPE.itemsize)
+        self.flush_interval = flush_interval
+        self.max_files = max_files
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.numbers = itertools.count(1)
+
+        self.current = None  # file being appended to
+        self.spare = None  # next file, opened ahead by the flush thread
+        self.retired = []  # full files waiting to be closed by the flush thread
+        self.total = 0
+        self.files = 1
+        self.late_rotations = 0  # rotations that had to open the next file themselves
+        self.flushes = 0
+        self.last_flush = None
+        self.error = None
+
+        os.makedirs(directory, exist_ok=True)
+        self.current = self._open_file()
+        self._remove_old_files()
+        self.running = True
+        self._thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self._thread.start()
+
+    def _open_file(self):
+        # telemetry-<stream>-<start time>-<file number>.dmslog
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        while True:
+            path = os.path.join(self.directory, f"telemetry-{self.stream_id}-{stamp}-{next(self.numbers):03d}.dmslog")
+            if not os.path.exists(path):
+                return _LogFile(path, self.stream_id, self.capacity)
+
+    def _remove_old_files(self):
+        with self.lock:
+            keep = {log.path for log in [self.current, self.spare] + self.retired if log is not None}
+        paths = sorted(glob.glob(os.path.join(self.directory, f"telemetry-{self.stream_id}-*.dmslog")),
+                       key=os.path.getmtime)
+        for path in (paths[:-self.max_files] if self.max_files else []):
+            if path not in keep:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def append(self, timestamp, left_ear, right_ear, ear, closed_time, face_present, alert_active, status):
+        # Called once per EAR sample by the stream's inference step
+        with self.lock:
+            log = self.current
+            if log is None:
+                return
+            if log.count == self.capacity:
+                log = self._rotate()
+            # One store of the whole record into the mapping
+            log.records[log.count] = (timestamp, log.count + 1, left_ear, right_ear, ear, closed_time,
+                                      face_present, alert_active, STATUSES.index(status), 0)
+            log.count += 1
+            self.total += 1
+            half_full = log.count == self.capacity // 2
+        if half_full:
+            self.wake.set()  # time to open the next file
+
+    def _rotate(self):
+        # Called with the lock held
+        self.retired.append(self.current)
+        if self.spare is None:
+            # Files filling up faster than the flush thread runs
+            self.spare = self._open_file()
+            self.late_rotations += 1
+        self.current, self.spare = self.spare, None
+        self.current.header['created'] = time.time()
+        self.files += 1
+        self.wake.set()
+        return self.current
+
+    def _maintain(self):
+        # Closes full files and opens the next one ahead of time
+        with self.lock:
+            retired, self.retired = self.retired, []
+            need_spare = self.spare is None and self.current is not None \
+                and self.current.count >= self.capacity // 2
+        for log in retired:
+            try:
+                log.close()
+            except OSError as e:
+                self.error = str(e)
+        if need_spare:
+            try:
+                spare = self._open_file()
+            except OSError as e:
+                self.error = str(e)
+                return
+            with self.lock:
+                if self.spare is None and self.current is not None:
+                    self.spare, spare = spare, None
+            if spare is not None:
+                spare.discard()
+            self._remove_old_files()
+
+    def flush(self):
+        with self.lock:
+            log = self.current
+            if log is None or log.count == log.flushed:
+                return
+            count = log.count
+        # Appends go on while the disk works; the lock is only for the snapshot
+        try:
+            log.sync()
+            log.commit(count)
+        except (OSError, ValueError) as e:  # ValueError: closed by close() meanwhile
+            self.error = str(e)
+            return
+        self.flushes += 1
+        self.last_flush = time.monotonic()
+
+    def _flush_loop(self):
+        while self.running:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            if not self.running:
+                break
+            self._maintain()
+            self.flush()
+
+    def close(self):
+        self.running = False
+        self.wake.set()
+        self._thread.join(10.0)
+        with self.lock:
+            logs = self.retired + ([self.current] if self.current is not None else [])
+            spare = self.spare
+            self.current = self.spare = None
+            self.retired = []
+        for log in logs:
+            try:
+                log.close()
+            except OSError as e:
+                self.error = str(e)
+        if spare is not None:
+            spare.discard()
+
+    def stats(self):
+        log = self.current
+        return {
+            'path': None if log is None else log.path,
+            'records': 0 if log is None else log.count,
+            'capacity': self.capacity,
+            'unflushed': 0 if log is None else log.count - log.flushed,
+            'total_records': self.total,
+            'files': self.files,
+            'next_file_ready': self.spare is not None,
+            'late_rotations': self.late_rotations,
+            'flushes': self.flushes,
+            'last_flush_s': None if self.last_flush is None else round(time.monotonic() - self.last_flush, 1),
+            'error': self.error
+        }
+
+
+def open_log(path):
+    # The file's records as a read-only NumPy view of the file (no copy).
+    # After a crash the header count can lag behind; records past it are
+    # kept while their seq shows they were written completely.
+    header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)[0]
+    if header['magic'] != MAGIC or header['record_size'] != RECORD_DTYPE.itemsize:
+        raise ValueError(f"{path} is not a telemetry log")
+    available = (os.path.getsize(path) - HEADER_SIZE) // RECORD_DTYPE.itemsize
+    if available <= 0:
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    records = np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=HEADER_SIZE, shape=(available,))
+    count = int(min(header['count'], available))
+    complete = records['seq'][count:] == np.arange(count + 1, available + 1, dtype=np.uint32)
+    count += int(np.argmin(complete)) if not complete.all() else len(complete)
+    return records[:count]
+
+
+def log_files(directory, stream_id=None):
+    pattern = f"telemetry-{'*' if stream_id is None else stream_id}-*.dmslog"
+    return sorted(glob.glob(os.path.join(directory, pattern)), key=os.path.getmtime)
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Summarise telemetry logs written by the detection streams")
+    parser.add_argument('directory', nargs='?', default='telemetry')
+    parser.add_argument('--stream', type=int)
+    args = parser.parse_args()
+
+    print(f"{'file':<44}{'records':>9}{'hours':>7}{'face %':>8}{'closed %':>9}{'alerts':>7}")
+    for path in log_files(args.directory, args.stream):
+        records = open_log(path)
+        if not len(records):
+            print(f"{os.path.basename(path):<44}{0:>9}")
+            continue
+        hours = (records['timestamp'][-1] - records['timestamp'][0]) / 3600
+        face = records['face_present'].astype(bool)
+        closed = face & (records['ear'] < EAR_THRESHOLD)
+        alerts = int(np.count_nonzero(np.diff(records['alert_active'].astype(np.int8)) == 1))
+        print(f"{os.path.basename(path):<44}{len(records):>9}{hours:>7.2f}{100 * face.mean():>8.1f}"
+              f"{100 * closed.sum() / max(1, face.sum()):>9.1f}{alerts:>7}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+import gzip
+import hashlib
+import os
+import time
+
+from flask import Response
+
+# Bodies smaller than this are not worth compressing
+GZIP_MIN_SIZE = 1024
+
+
+class CachedAsset:
+    # A response body prepared once and kept in memory: its ETag, its
+    # Last-Modified time and (if it helps) a gzip-compressed copy are all
+    # computed up front, so serving it is a dictionary lookup. Requests
+    # carrying a matching If-None-Match or If-Modified-Since get an empty
+    # 304 instead of the body.
+
+    def __init__(self, body, content_type, max_age=0, compress=True, modified=None):
+        self.body = body
+        self.content_type = content_type
+        # max_age 0 means the client must revalidate (cheap with a 304)
+        self.cache_control = f'public, max-age={max_age}' if max_age else 'no-cache'
+        self.modified = int(time.time() if modified is None else modified)
+        self.etag = hashlib.sha1(body).hexdigest()[:20]
+        self.gzipped = None
+        if compress and len(body) >= GZIP_MIN_SIZE:
+            gzipped = gzip.compress(body, compresslevel=9, mtime=0)
+            if len(gzipped) < len(body):
+                self.gzipped = gzipped
+        self.requests = 0
+        self.not_modified = 0
+
+    @classmethod
+    def from_file(cls, path, content_type, max_age=86400, compress=False):
+        with open(path, 'rb') as f:
+            body = f.read()
+        return cls(body, content_type, max_age=max_age, compress=compress, modified=os.path.getmtime(path))
+
+    def _not_modified(self, request):
+        # If-None-Match takes precedence over If-Modified-Since (RFC 9110)
+        if request.if_none_match:
+            return (request.if_none_match.contains_weak(self.etag)
+                    or request.if_none_match.contains_weak(self.etag + '-gz'))
+        since = request.if_modified_since
+        return since is not None and since.timestamp() >= self.modified
+
+    def response(self, request):
+        self.requests += 1
+        # The gzip copy is a different representation, so it gets its own ETag
+        use_gzip = self.gzipped is not None and 'gzip' in request.accept_encodings
+        etag = self.etag + '-gz' if use_gzip else self.etag
+        if self._not_modified(request):
+            self.not_modified += 1
+            response = Response(status=304)
+        else:
+            response = Response(self.gzipped if use_gzip else self.body, content_type=self.content_type)
+            if use_gzip:
+                response.headers['Content-Encoding'] = 'gzip'
+        response.set_etag(etag)
+        response.last_modified = self.modified
+        response.headers['Cache-Control'] = self.cache_control
+        if self.gzipped is not None:
+            response.vary.add('Accept-Encoding')
+        return response